@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+
+# SPDX-License-Identifier: BSD-2-Clause
+
+# Boot-time profiling of the simulated BaseSoC (sipeed_tang_nano_20k.py --sim).
+#
+# BootProfiler (sipeed_tang_nano_20k.py) counts sys cycles from reset and timestamps the boot
+# milestones it sees on the SoC, each one printed by the simulator when it first happens:
+#
+#   sdram_init  DFII switched to software control (BIOS starts the SDRAM init/calibration)
+#   sdram_done  DFII back to hardware control
+#   sd_init     first command received by the SD emulator (CMD0)
+#   sd_load     first CMD17/CMD18, the payload load starts
+#   boot        first instruction fetched from main_ram, the payload runs
+#
+# and splits the boot into BIOS init (everything outside the other phases), SDRAM calibration,
+# SD init and payload load. Software adds its own timestamps by writing the mark CSR; the fast
+# boot path (sdcard_boot() in litesdcardSOC/sdcard.c) marks 1 init done, 2 header, 3 DMA done
+# and 4 verified.
+#
+# The lines start with "[bootprof]", this script turns a simulation log into a table or JSON
+# (it only needs the standard library):
+#
+#   ./sipeed_tang_nano_20k.py --sim --sim-image sd.img --sdcard-boot-block 1 | tee sim.log
+#   ./bootprof.py sim.log --json boot.json
+
+import re
+import sys
+import json
+import argparse
+
+# Events -------------------------------------------------------------------------------------------
+
+EVENTS = ["sdram_init", "sdram_done", "sd_init", "sd_load", "boot"]
+
+# Phase: (start event, end event), BIOS init is what is left from reset to sd_init.
+PHASES = [
+    ("sdram_calibration", "sdram_init", "sdram_done"),
+    ("sd_init",           "sd_init",    "sd_load"),
+    ("payload_load",      "sd_load",    "boot"),
+]
+
+def phases(events):
+    """Phase durations (cycles) from the event cycles, phases missing an event are left out."""
+    r = {}
+    for name, start, end in PHASES:
+        if start in events and end in events:
+            r[name] = events[end] - events[start]
+    if "sd_init" in events:
+        r["bios_init"] = events["sd_init"] - r.get("sdram_calibration", 0)
+    elif "boot" in events:
+        r["bios_init"] = events["boot"] - r.get("sdram_calibration", 0)
+    if "boot" in events:
+        r["total"] = events["boot"]
+    return r
+
+# Log ----------------------------------------------------------------------------------------------
+
+_line_re = re.compile(r"\[bootprof\] (event|phase|mark|timeout) (.*)$")
+
+def parse_log(lines):
+    """Returns {"events": {name: cycle}, "phases": {name: cycles}, "marks": [(value, cycle)],
+       "timeout": cycle or None} from the [bootprof] lines of a simulation log."""
+    r = {"events": {}, "phases": {}, "marks": [], "timeout": None}
+    for line in lines:
+        m = _line_re.search(line.rstrip())
+        if m is None:
+            continue
+        kind, fields = m.group(1), m.group(2).split()
+        if kind == "event":
+            r["events"][fields[0]] = int(fields[1])
+        if kind == "phase":
+            r["phases"][fields[0]] = int(fields[1])
+        if kind == "mark":
+            r["marks"].append((int(fields[0]), int(fields[1])))
+        if kind == "timeout":
+            r["timeout"] = int(fields[0])
+    # Without a boot event the simulator prints no phases, derive what the events give.
+    for name, cycles in phases(r["events"]).items():
+        r["phases"].setdefault(name, cycles)
+    return r
+
+def _print_report(r, sys_clk_freq):
+    def fmt(cycles):
+        return "{:>12d} cycles {:>12.1f} us".format(cycles, cycles*1e6/sys_clk_freq)
+    print("Events:")
+    for name in EVENTS:
+        if name in r["events"]:
+            print("  {:<18s} {}".format(name, fmt(r["events"][name])))
+    for value, cycles in r["marks"]:
+        print("  {:<18s} {}".format(f"mark {value}", fmt(cycles)))
+    print("Phases:")
+    for name in ["bios_init", "sdram_calibration", "sd_init", "payload_load", "total"]:
+        if name in r["phases"]:
+            print("  {:<18s} {}".format(name, fmt(r["phases"][name])))
+    if r["timeout"] is not None:
+        print(f"Timed out at cycle {r['timeout']}.")
+
+def main():
+    parser = argparse.ArgumentParser(description="Boot-time profile of a simulated BaseSoC.")
+    parser.add_argument("log",            nargs="?", default="-",     help="Simulation log (default: stdin).")
+    parser.add_argument("--sys-clk-freq", default=48e6, type=float,   help="System clock frequency of the simulated SoC.")
+    parser.add_argument("--json",         default=None,               help="Also write the profile to this JSON file.")
+    args = parser.parse_args()
+
+    if args.log == "-":
+        r = parse_log(sys.stdin)
+    else:
+        with open(args.log, errors="replace") as f:
+            r = parse_log(f)
+    if not r["events"] and not r["marks"]:
+        raise SystemExit("No [bootprof] lines in the log.")
+    _print_report(r, args.sys_clk_freq)
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump({**r, "sys_clk_freq": args.sys_clk_freq}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,469 @@
+#!/usr/bin/env python3
+
+#
+# Batched CSR access over the LiteX UART bridge.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+
+# RemoteClient pays a full round-trip for each CSR access. Here accesses are queued in a Batch
+# and sent in one transfer: the UART bridge (UARTBone, --uart-name=uartbone or crossover+uartbone)
+# executes its frames in order and only answers reads, so a whole batch is written at once and
+# the read data comes back in one stream. Adjacent accesses to contiguous addresses are merged
+# into burst frames. Results are Futures, resolved when the batch completes; batches can be
+# submitted asynchronously and are executed in submission order.
+#
+#   bus = CSRBus(UARTLink("/dev/ttyUSB1"), csr_csv="csr.csv")
+#   with bus.batch() as b:
+#       buttons = b.read("buttons_in")
+#       b.write("leds_out", 0x15)
+#   print(buttons.result())
+#
+# LoopbackLink stands in for the SoC: it decodes the same frames against an in-memory register
+# file, so scripts can be tested without hardware.
+
+import csv
+import time
+import argparse
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+# UARTBone frames ----------------------------------------------------------------------------------
+
+# [cmd, length, word address (4 bytes, big-endian), data words (big-endian, writes only)], reads
+# answer with length data words. Lengths are 1..255 words.
+CMD_WRITE_BURST_INCR = 0x01
+CMD_READ_BURST_INCR  = 0x02
+
+MAX_BURST = 255
+
+def encode_frames(ops):
+    """Encodes [("write", addr, words)] / [("read", addr, count)] ops, returns (frames, words read)."""
+    frames = bytearray()
+    nread  = 0
+    for kind, addr, arg in ops:
+        count = len(arg) if kind == "write" else arg
+        for offset in range(0, count, MAX_BURST):
+            n = min(count - offset, MAX_BURST)
+            frames += bytes([CMD_WRITE_BURST_INCR if kind == "write" else CMD_READ_BURST_INCR, n])
+            frames += (addr//4 + offset).to_bytes(4, "big")
+            if kind == "write":
+                for word in arg[offset:offset + n]:
+                    frames += (word & 0xffffffff).to_bytes(4, "big")
+            else:
+                nread += n
+    return bytes(frames), nread
+
+def decode_words(data):
+    return [int.from_bytes(data[i:i + 4], "big") for i in range(0, len(data), 4)]
+
+# Links --------------------------------------------------------------------------------------------
+
+class UARTLink:
+    """UARTBone over a serial port (pyserial URL, e.g. /dev/ttyUSB1 or socket://host:port)."""
+    max_read_words = 512 # Read data in flight per transfer, stays within the OS serial buffers.
+
+    def __init__(self, port, baudrate=115200, timeout=1.0):
+        import serial
+        self.port = serial.serial_for_url(port, baudrate=baudrate, timeout=timeout)
+        self.port.reset_input_buffer()
+
+    def transfer(self, ops):
+        frames, nread = encode_frames(ops)
+        self.port.write(frames)
+        data = self.port.read(4*nread)
+        if len(data) != 4*nread:
+            raise TimeoutError("UART bridge: {} of {} bytes received.".format(len(data), 4*nread))
+        return decode_words(data)
+
+    def close(self):
+        self.port.close()
+
+
+class RemoteClientLink:
+    """Runs the ops through a litex RemoteClient (litex_server): batches keep their API but each
+       op still costs a round-trip."""
+    max_read_words = 1 << 16
+
+    def __init__(self, bus):
+        self.bus = bus
+
+    def transfer(self, ops):
+        words = []
+        for kind, addr, arg in ops:
+            if kind == "write":
+                self.bus.write(addr, arg)
+            else:
+                data = self.bus.read(addr, length=arg)
+                words += data if isinstance(data, list) else [data]
+        return words
+
+    def close(self):
+        self.bus.close()
+
+
+class LoopbackLink:
+    """Local stand-in for the SoC: executes UARTBone frames against a register file.
+
+       memory maps byte addresses to 32-bit words (missing addresses read 0). handlers maps
+       addresses to callables for registers with side effects: handler(addr) on reads returns
+       the value, handler(addr, value) on writes. latency (seconds) is added to every transfer
+       to model the round-trip; transfers counts them.
+       """
+    max_read_words = 512
+
+    def __init__(self, memory=None, handlers=None, latency=0.0):
+        self.memory    = {} if memory is None else memory
+        self.handlers  = {} if handlers is None else handlers
+        self.latency   = latency
+        self.transfers = 0
+        self._lock     = threading.Lock()
+
+    def _read(self, addr):
+        if addr in self.handlers:
+            return self.handlers[addr](addr) & 0xffffffff
+        return self.memory.get(addr, 0)
+
+    def _write(self, addr, value):
+        if addr in self.handlers:
+            self.handlers[addr](addr, value)
+        else:
+            self.memory[addr] = value
+
+    def execute(self, frames):
+        """Runs the frames as the bridge would and returns its response bytes."""
+        response = bytearray()
+        i = 0
+        while i < len(frames):
+            cmd, n = frames[i], frames[i + 1]
+            addr   = int.from_bytes(frames[i + 2:i + 6], "big")*4
+            i     += 6
+            for k in range(n):
+                if cmd == CMD_WRITE_BURST_INCR:
+                    self._write(addr + 4*k, int.from_bytes(frames[i:i + 4], "big"))
+                    i += 4
+                elif cmd == CMD_READ_BURST_INCR:
+                    response += self._read(addr + 4*k).to_bytes(4, "big")
+                else:
+                    raise ValueError("Loopback: unknown command 0x{:02x}.".format(cmd))
+        return bytes(response)
+
+    def transfer(self, ops):
+        frames, nread = encode_frames(ops)
+        with self._lock:
+            if self.latency:
+                time.sleep(self.latency)
+            self.transfers += 1
+            data = self.execute(frames)
+        assert len(data) == 4*nread
+        return decode_words(data)
+
+    def close(self):
+        pass
+
+# CSR map ------------------------------------------------------------------------------------------
+
+class CSRRegister:
+    def __init__(self, name, addr, size, mode):
+        self.name = name
+        self.addr = addr
+        self.size = size # Words of csr_data_width bits, most significant first.
+        self.mode = mode
+
+    def __repr__(self):
+        return "CSRRegister({}, 0x{:08x}, {}, {})".format(self.name, self.addr, self.size, self.mode)
+
+def load_csr_csv(filename):
+    """Returns ({name: CSRRegister}, {name: (base, size)} memory regions, {name: value} constants)."""
+    registers = {}
+    memories  = {}
+    constants = {}
+    with open(filename) as f:
+        for row in csv.reader(f):
+            if not row or row[0].startswith("#"):
+                continue
+            if row[0] == "csr_register":
+                registers[row[1]] = CSRRegister(row[1], int(row[2], 0), int(row[3]), row[4])
+            elif row[0] == "memory_region":
+                memories[row[1]] = (int(row[2], 0), int(row[3], 0))
+            elif row[0] == "constant":
+                try:
+                    constants[row[1]] = int(row[2], 0)
+                except ValueError:
+                    constants[row[1]] = row[2]
+    return registers, memories, constants
+
+# Batch --------------------------------------------------------------------------------------------
+
+class Batch:
+    """CSR accesses sent together, in order.
+
+       read/write take a register name (from the CSR map) or a byte address and return a Future:
+       reads resolve to the register value (multi-word registers combined), writes to None.
+       read_burst reads count consecutive words. Used as a context manager, the batch is sent
+       and waited for on exit.
+       """
+    def __init__(self, bus):
+        self.bus    = bus
+        self._ops   = []  # [kind, addr, words/count]
+        self._reads = []  # (future, first word, words, combine)
+        self._nread = 0
+        self._sent  = False
+
+    def __len__(self):
+        return len(self._ops)
+
+    def _add(self, kind, addr, arg):
+        assert not self._sent
+        if self._ops and self._ops[-1][0] == kind:
+            last  = self._ops[-1]
+            count = len(last[2]) if kind == "write" else last[2]
+            if last[1] + 4*count == addr:
+                if kind == "write":
+                    last[2] = last[2] + arg
+                else:
+                    last[2] += arg
+                return
+        self._ops.append([kind, addr, arg])
+
+    def write(self, reg, value):
+        addr, size = self.bus.resolve(reg)
+        width = self.bus.csr_data_width
+        words = [(value >> (width*(size - 1 - i))) & (2**width - 1) for i in range(size)]
+        self._add("write", addr, words)
+        future = Future()
+        self._reads.append((future, None, 0, None))
+        return future
+
+    def read(self, reg):
+        addr, size = self.bus.resolve(reg)
+        width = self.bus.csr_data_width
+        def combine(words):
+            value = 0
+            for word in words:
+                value = (value << width) | (word & (2**width - 1))
+            return value
+        return self._read(addr, size, combine)
+
+    def read_burst(self, reg, count):
+        addr, _ = self.bus.resolve(reg)
+        return self._read(addr, count, list)
+
+    def _read(self, addr, count, combine):
+        self._add("read", addr, count)
+        future = Future()
+        self._reads.append((future, self._nread, count, combine))
+        self._nread += count
+        return future
+
+    def send(self):
+        """Submits the batch, returns a Future resolved when it completed."""
+        self._sent = True
+        return self.bus.submit(self)
+
+    def _complete(self, words):
+        for future, first, count, combine in self._reads:
+            future.set_result(None if combine is None else combine(words[first:first + count]))
+
+    def _fail(self, exception):
+        for future, *_ in self._reads:
+            if not future.done():
+                future.set_exception(exception)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.send().result()
+
+# CSRBus -------------------------------------------------------------------------------------------
+
+class CSRBus:
+    """CSR access through a link (UARTLink, RemoteClientLink, LoopbackLink).
+
+       Batches are executed by a single worker thread, in submission order, so submit() never
+       blocks; read()/write()/read_many() are synchronous one-batch shortcuts.
+       """
+    def __init__(self, link, csr_csv=None, csr_data_width=32):
+        self.link           = link
+        self.csr_data_width = csr_data_width
+        self.registers, self.memories, self.constants = ({}, {}, {}) if csr_csv is None else load_csr_csv(csr_csv)
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def resolve(self, reg):
+        """Returns (byte address, words) of a register name or address."""
+        if isinstance(reg, str):
+            try:
+                r = self.registers[reg]
+            except KeyError:
+                raise KeyError("Unknown CSR {}.".format(reg)) from None
+            return r.addr, r.size
+        return reg, 1
+
+    def batch(self):
+        return Batch(self)
+
+    def submit(self, batch):
+        return self._executor.submit(self._run, batch)
+
+    def _run(self, batch):
+        words = []
+        try:
+            # Split on op boundaries so read data in flight stays bounded.
+            ops = []
+            pending = 0
+            for kind, addr, arg in batch._ops:
+                count = arg if kind == "read" else 0
+                if ops and pending + count > self.link.max_read_words:
+                    words += self.link.transfer(ops)
+                    ops, pending = [], 0
+                ops.append((kind, addr, arg))
+                pending += count
+            if ops:
+                words += self.link.transfer(ops)
+        except Exception as e:
+            batch._fail(e)
+            raise
+        batch._complete(words)
+
+    def read(self, reg):
+        with self.batch() as b:
+            value = b.read(reg)
+        return value.result()
+
+    def write(self, reg, value):
+        with self.batch() as b:
+            b.write(reg, value)
+
+    def read_many(self, regs):
+        """Reads registers in one batch, returns {reg: value}."""
+        with self.batch() as b:
+            futures = {reg: b.read(reg) for reg in regs}
+        return {reg: f.result() for reg, f in futures.items()}
+
+    def close(self):
+        self._executor.shutdown()
+        self.link.close()
+
+# SD emulator counters -----------------------------------------------------------------------------
+
+def read_sd_counters(bus, prefix="sd_emulator_counters_"):
+    """Snapshots the SDEmulatorCounters and reads the scalar counters and the 64 per-opcode counts
+       in one batch (each count is a cmd_sel write followed by a cmd_count read). The snapshot copy
+       takes 64 cycles, well below the time the next frame takes over the UART."""
+    scalars = [name for name in bus.registers
+        if name.startswith(prefix) and name[len(prefix):] not in ["control", "status", "cmd_sel", "cmd_count"]]
+    with bus.batch() as b:
+        b.write(prefix + "control", 1) # snapshot
+        values = {name[len(prefix):]: b.read(name) for name in scalars}
+        cmds   = []
+        for opcode in range(64):
+            b.write(prefix + "cmd_sel", opcode)
+            cmds.append(b.read(prefix + "cmd_count"))
+    counters = {name: f.result() for name, f in values.items()}
+    counters["cmd"] = {opcode: f.result() for opcode, f in enumerate(cmds) if f.result()}
+    return counters
+
+# Run ----------------------------------------------------------------------------------------------
+
+def _value(s):
+    return int(s, 0)
+
+def _reg(s):
+    try:
+        return int(s, 0)
+    except ValueError:
+        return s
+
+def main():
+    parser = argparse.ArgumentParser(description="Batched CSR access over the LiteX UART bridge.")
+    parser.add_argument("--csr-csv",  default="csr.csv",            help="SoC CSR definitions.")
+    parser.add_argument("--uart",     default=None,                 help="UART bridge serial port.")
+    parser.add_argument("--baudrate", default=115200, type=int,     help="UART bridge baudrate.")
+    parser.add_argument("--loopback", action="store_true",          help="Use the loopback stand-in instead of a SoC.")
+    parser.add_argument("--latency",  default=0.005, type=float,    help="Loopback round-trip latency (seconds).")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    p = commands.add_parser("read", help="Read registers in one batch.")
+    p.add_argument("regs", nargs="+", type=_reg, help="Register names or addresses.")
+    p.add_argument("--burst", default=None, type=int, help="Read this many words from the first register.")
+
+    p = commands.add_parser("write", help="Write register/value pairs in one batch.")
+    p.add_argument("pairs", nargs="+", help="reg=value.")
+
+    p = commands.add_parser("poll", help="Poll registers periodically (one batch per sample).")
+    p.add_argument("regs", nargs="+", type=_reg, help="Register names or addresses.")
+    p.add_argument("--interval", default=0.1, type=float, help="Seconds between samples.")
+    p.add_argument("--count",    default=None, type=int,  help="Samples (default: until Ctrl-C).")
+
+    commands.add_parser("counters", help="Read the SD emulator counters.")
+
+    p = commands.add_parser("bench", help="Compare one access per transfer with one batch.")
+    p.add_argument("--reads", default=64, type=int, help="Reads per run.")
+    args = parser.parse_args()
+
+    if args.loopback:
+        link = LoopbackLink(latency=args.latency)
+    elif args.uart is not None:
+        link = UARTLink(args.uart, baudrate=args.baudrate)
+    else:
+        from litex import RemoteClient
+        remote = RemoteClient(csr_csv=args.csr_csv)
+        remote.open()
+        link = RemoteClientLink(remote)
+    bus = CSRBus(link, csr_csv=None if args.loopback else args.csr_csv)
+
+    try:
+        if args.command == "read":
+            if args.burst is not None:
+                with bus.batch() as b:
+                    words = b.read_burst(args.regs[0], args.burst)
+                addr, _ = bus.resolve(args.regs[0])
+                for i, word in enumerate(words.result()):
+                    print("0x{:08x}: 0x{:08x}".format(addr + 4*i, word))
+            else:
+                for reg, value in bus.read_many(args.regs).items():
+                    print("{}: 0x{:x}".format(reg if isinstance(reg, str) else "0x{:08x}".format(reg), value))
+
+        if args.command == "write":
+            with bus.batch() as b:
+                for pair in args.pairs:
+                    reg, value = pair.split("=")
+                    b.write(_reg(reg), _value(value))
+
+        if args.command == "poll":
+            n = 0
+            try:
+                while args.count is None or n < args.count:
+                    start  = time.time()
+                    values = bus.read_many(args.regs)
+                    print(" ".join("{}={}".format(reg, value) for reg, value in values.items()), flush=True)
+                    n += 1
+                    time.sleep(max(0, args.interval - (time.time() - start)))
+            except KeyboardInterrupt:
+                pass
+
+        if args.command == "counters":
+            counters = read_sd_counters(bus)
+            for name, value in counters.items():
+                if name != "cmd":
+                    print("{:<16} {}".format(name, value))
+            for opcode, count in sorted(counters["cmd"].items()):
+                print("CMD{:<13} {}".format(opcode, count))
+
+        if args.command == "bench":
+            addrs = [0xf000_0000 + 4*i for i in range(args.reads)]
+            start = time.time()
+            for addr in addrs:
+                bus.read(addr)
+            single = time.time() - start
+            start = time.time()
+            bus.read_many(addrs)
+            batched = time.time() - start
+            print("{} reads: {:.3f}s one per transfer, {:.3f}s batched ({:.1f}x).".format(
+                args.reads, single, batched, single/batched if batched else float("inf")))
+    finally:
+        bus.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,405 @@
+#!/usr/bin/env python3
+
+#
+# Gowin implementation reports database.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+
+# Indexes the GowinEDA reports of the projects of this repository (PnR resources, Fmax, timing
+# paths, power and the synthesis resource hierarchy) into an SQLite database, one snapshot per
+# work tree or git revision, and queries/compares snapshots to spot regressions between commits.
+#
+#   ./gowin_reportdb.py index                     # Work tree, snapshot "worktree".
+#   ./gowin_reportdb.py index --rev HEAD~3        # Reports as committed in HEAD~3.
+#   ./gowin_reportdb.py query HEAD~3 --table paths --project microSD
+#   ./gowin_reportdb.py diff HEAD~3 worktree --check
+#
+# Revisions are read with git show and streamed through the parsers, nothing is checked out.
+# Revision snapshots are keyed by the commit hash the revision resolves to, so HEAD~3 always
+# means the current HEAD~3; query/diff re-index "worktree" on each run.
+
+import os
+import sys
+import time
+import fnmatch
+import sqlite3
+import argparse
+import contextlib
+import subprocess
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import gowin_reports
+
+# Projects -----------------------------------------------------------------------------------------
+
+default_projects = ["LED_BTN", "UART", "microSD", "LED_Projects/WS2812*"]
+
+# impl file suffix -> report kind.
+_reports = [
+    ("pnr/",         ".rpt.txt",         "resources"),
+    ("pnr/",         "_tr_content.html", "fmax"),
+    ("pnr/",         ".tr.html",         "fmax"),
+    ("pnr/",         ".timing_paths",    "paths"),
+    ("pnr/",         ".power.html",      "power"),
+    ("gwsynthesis/", "_syn_rsc.xml",     "modules"),
+]
+
+def _report_kind(path):
+    """Returns (project, design, kind) for an impl report path, or None."""
+    head, sep, tail = path.replace(os.sep, "/").rpartition("/impl/")
+    if not sep:
+        return None
+    for subdir, suffix, kind in _reports:
+        if tail.startswith(subdir) and tail.endswith(suffix) and "/" not in tail[len(subdir):]:
+            return head, tail[len(subdir):-len(suffix)], kind
+    return None
+
+def _match(project, patterns):
+    return any(fnmatch.fnmatchcase(project, p) for p in patterns)
+
+# Sources ------------------------------------------------------------------------------------------
+
+class WorkTree:
+    """Reports of the files on disk."""
+    def __init__(self, root):
+        self.root = root
+
+    def commit(self):
+        return None
+
+    def files(self):
+        for dirpath, dirnames, filenames in os.walk(self.root):
+            dirnames[:] = [d for d in dirnames if not d.startswith(".") and d != "build"]
+            for filename in filenames:
+                yield os.path.relpath(os.path.join(dirpath, filename), self.root)
+
+    @contextlib.contextmanager
+    def open(self, path):
+        yield os.path.join(self.root, path)
+
+
+class GitRevision:
+    """Reports as committed in a git revision."""
+    def __init__(self, root, rev):
+        self.root = root
+        self.rev  = rev
+
+    def _git(self, *args):
+        return subprocess.check_output(["git", "-C", self.root, *args], text=True)
+
+    def commit(self):
+        return self._git("rev-parse", "--verify", self.rev + "^{commit}").strip()
+
+    def files(self):
+        return self._git("ls-tree", "-r", "--name-only", self.rev).splitlines()
+
+    @contextlib.contextmanager
+    def open(self, path):
+        p = subprocess.Popen(["git", "-C", self.root, "show", "{}:{}".format(self.rev, path)],
+            stdout=subprocess.PIPE, encoding="utf-8", errors="replace")
+        try:
+            yield p.stdout
+        finally:
+            p.stdout.close()
+            p.wait()
+
+# Database -----------------------------------------------------------------------------------------
+
+_schema = """
+CREATE TABLE IF NOT EXISTS snapshot (
+    id       INTEGER PRIMARY KEY,
+    label    TEXT UNIQUE NOT NULL,
+    commit_  TEXT,
+    created  REAL
+);
+CREATE TABLE IF NOT EXISTS design (
+    id       INTEGER PRIMARY KEY,
+    snapshot INTEGER NOT NULL REFERENCES snapshot(id) ON DELETE CASCADE,
+    project  TEXT NOT NULL,
+    name     TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS resource (
+    design   INTEGER NOT NULL REFERENCES design(id) ON DELETE CASCADE,
+    name     TEXT NOT NULL,
+    used     INTEGER,
+    total    INTEGER
+);
+CREATE TABLE IF NOT EXISTS fmax (
+    design     INTEGER NOT NULL REFERENCES design(id) ON DELETE CASCADE,
+    clock      TEXT NOT NULL,
+    constraint_ REAL,
+    fmax       REAL,
+    levels     INTEGER
+);
+CREATE TABLE IF NOT EXISTS path (
+    design   INTEGER NOT NULL REFERENCES design(id) ON DELETE CASCADE,
+    kind     TEXT NOT NULL,
+    slack    REAL,
+    arrival  REAL,
+    required REAL,
+    start    TEXT,
+    end_     TEXT,
+    nodes    INTEGER
+);
+CREATE TABLE IF NOT EXISTS power (
+    design   INTEGER NOT NULL REFERENCES design(id) ON DELETE CASCADE,
+    name     TEXT NOT NULL,
+    value    REAL
+);
+CREATE TABLE IF NOT EXISTS module (
+    design     INTEGER NOT NULL REFERENCES design(id) ON DELETE CASCADE,
+    name       TEXT NOT NULL,
+    parent     TEXT,
+    register   INTEGER,
+    lut        INTEGER,
+    alu        INTEGER,
+    t_register INTEGER,
+    t_lut      INTEGER,
+    t_alu      INTEGER
+);
+CREATE INDEX IF NOT EXISTS design_snapshot ON design(snapshot, project);
+CREATE INDEX IF NOT EXISTS resource_design ON resource(design);
+CREATE INDEX IF NOT EXISTS fmax_design     ON fmax(design);
+CREATE INDEX IF NOT EXISTS path_design     ON path(design, kind, slack);
+CREATE INDEX IF NOT EXISTS power_design    ON power(design);
+CREATE INDEX IF NOT EXISTS module_design   ON module(design);
+"""
+
+def open_db(filename):
+    db = sqlite3.connect(filename)
+    db.execute("PRAGMA foreign_keys = ON")
+    db.executescript(_schema)
+    return db
+
+def _insert_report(db, design, kind, source):
+    if kind == "resources":
+        db.executemany("INSERT INTO resource VALUES (?, ?, ?, ?)",
+            [(design, name, used, total) for name, (used, total) in gowin_reports.parse_resources(source).items()])
+    elif kind == "fmax":
+        db.executemany("INSERT INTO fmax VALUES (?, ?, ?, ?, ?)",
+            [(design, clock, f["constraint"], f["fmax"], f["levels"]) for clock, f in gowin_reports.parse_fmax(source).items()])
+    elif kind == "paths":
+        db.executemany("INSERT INTO path VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            ((design, p["kind"], p["slack"], p["arrival"], p["required"], p["start"], p["end"], p["nodes"])
+                for p in gowin_reports.parse_timing_paths(source)))
+    elif kind == "power":
+        power  = gowin_reports.parse_power(source)
+        clocks = power.pop("clocks")
+        rows   = list(power.items()) + [("clock:" + clock, mw) for clock, mw in clocks.items()]
+        db.executemany("INSERT INTO power VALUES (?, ?, ?)", [(design, name, value) for name, value in rows])
+    elif kind == "modules":
+        db.executemany("INSERT INTO module VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            ((design, m["name"], m["parent"], m["register"], m["lut"], m["alu"], m["t_register"], m["t_lut"], m["t_alu"])
+                for m in gowin_reports.parse_syn_resources(source)))
+
+def index(db, source, label, projects=default_projects):
+    """Replaces snapshot label with the reports of source, returns the number of reports read."""
+    reports = []
+    for path in source.files():
+        report = _report_kind(path)
+        if report is not None and _match(report[0], projects):
+            reports.append((path, *report))
+    # Older GowinEDA versions write <name>.tr.html, only use it without _tr_content.html.
+    have_fmax = {(project, name) for path, project, name, kind in reports
+        if kind == "fmax" and path.endswith("_tr_content.html")}
+    reports = [r for r in reports if not (r[3] == "fmax" and r[0].endswith(".tr.html") and r[1:3] in have_fmax)]
+
+    with db:
+        db.execute("DELETE FROM snapshot WHERE label = ?", (label,))
+        snapshot = db.execute("INSERT INTO snapshot (label, commit_, created) VALUES (?, ?, ?)",
+            (label, source.commit(), time.time())).lastrowid
+        designs = {}
+        for path, project, name, kind in sorted(reports):
+            if (project, name) not in designs:
+                designs[project, name] = db.execute("INSERT INTO design (snapshot, project, name) VALUES (?, ?, ?)",
+                    (snapshot, project, name)).lastrowid
+            with source.open(path) as f:
+                _insert_report(db, designs[project, name], kind, f)
+    return len(reports)
+
+def _snapshot(db, label):
+    row = db.execute("SELECT id FROM snapshot WHERE label = ? OR commit_ = ? ORDER BY label = ? DESC",
+        (label, label, label)).fetchone()
+    return row[0] if row else None
+
+# Queries ------------------------------------------------------------------------------------------
+
+_queries = {
+    "resources" : ("SELECT d.project, r.name, r.used, r.total FROM resource r JOIN design d ON r.design = d.id",
+                   ["project", "resource", "used", "total"], "d.project, r.name"),
+    "fmax"      : ("SELECT d.project, f.clock, f.constraint_, f.fmax, f.levels FROM fmax f JOIN design d ON f.design = d.id",
+                   ["project", "clock", "constraint", "fmax", "levels"], "d.project, f.clock"),
+    "paths"     : ("SELECT d.project, p.kind, p.slack, p.start, p.end_, p.nodes FROM path p JOIN design d ON p.design = d.id",
+                   ["project", "kind", "slack", "start", "end", "nodes"], "d.project, p.kind, p.slack"),
+    "power"     : ("SELECT d.project, w.name, w.value FROM power w JOIN design d ON w.design = d.id",
+                   ["project", "power", "value"], "d.project, w.name"),
+    "modules"   : ("SELECT d.project, m.name, m.parent, m.t_register, m.t_lut, m.t_alu FROM module m JOIN design d ON m.design = d.id",
+                   ["project", "module", "parent", "registers", "luts", "alus"], "d.project, m.t_lut DESC"),
+}
+
+def query(db, label, table, projects=None, limit=None):
+    """Returns (columns, rows) of one table of a snapshot. For paths, limit keeps the limit worst
+       paths of each kind per project."""
+    snapshot = _snapshot(db, label)
+    if snapshot is None:
+        raise ValueError("Unknown snapshot {}.".format(label))
+    sql, columns, order = _queries[table]
+    rows = db.execute(sql + " WHERE d.snapshot = ? ORDER BY " + order, (snapshot,)).fetchall()
+    if projects:
+        rows = [r for r in rows if _match(r[0], projects)]
+    if limit is not None:
+        count = {}
+        keep  = []
+        for r in rows:
+            key = r[:2] if table == "paths" else r[:1]
+            count[key] = count.get(key, 0) + 1
+            if count[key] <= limit:
+                keep.append(r)
+        rows = keep
+    return columns, rows
+
+# Metrics compared by diff: (name, sql, higher is better).
+_metrics = [
+    ("resource:{}",   "SELECT d.project, r.name, r.used FROM resource r JOIN design d ON r.design = d.id WHERE d.snapshot = ?", False),
+    ("fmax:{}",       "SELECT d.project, f.clock, f.fmax FROM fmax f JOIN design d ON f.design = d.id WHERE d.snapshot = ?", True),
+    ("slack:{}",      "SELECT d.project, p.kind, MIN(p.slack) FROM path p JOIN design d ON p.design = d.id WHERE d.snapshot = ? GROUP BY d.project, p.kind", True),
+    ("power:{}",      "SELECT d.project, w.name, w.value FROM power w JOIN design d ON w.design = d.id WHERE d.snapshot = ?", False),
+    ("syn:{}",        "SELECT d.project, m.name || '.' || x.k, CASE x.k WHEN 'registers' THEN m.t_register WHEN 'luts' THEN m.t_lut ELSE m.t_alu END "
+                      "FROM module m JOIN design d ON m.design = d.id, (SELECT 'registers' AS k UNION SELECT 'luts' UNION SELECT 'alus') x "
+                      "WHERE d.snapshot = ? AND m.parent IS NULL", False),
+]
+
+def diff(db, label_a, label_b, projects=None):
+    """Compares two snapshots, returns [(project, metric, a, b, regression)] for the metrics that
+       differ (a or b None when only one snapshot has it)."""
+    snapshots = []
+    for label in [label_a, label_b]:
+        snapshot = _snapshot(db, label)
+        if snapshot is None:
+            raise ValueError("Unknown snapshot {}.".format(label))
+        snapshots.append(snapshot)
+    changes = []
+    for name, sql, higher_better in _metrics:
+        values = []
+        for snapshot in snapshots:
+            values.append({(project, name.format(key)): value
+                for project, key, value in db.execute(sql, (snapshot,))})
+        a, b = values
+        for key in sorted(set(a) | set(b)):
+            if projects and not _match(key[0], projects):
+                continue
+            va, vb = a.get(key), b.get(key)
+            if va == vb:
+                continue
+            regression = va is not None and vb is not None and ((vb < va) if higher_better else (vb > va))
+            changes.append((*key, va, vb, regression))
+    return changes
+
+# Output -------------------------------------------------------------------------------------------
+
+def _format(value):
+    if value is None:
+        return "-"
+    if isinstance(value, float):
+        return "{:.3f}".format(value)
+    return str(value)
+
+def print_table(columns, rows, out=sys.stdout):
+    cells  = [columns] + [[_format(v) for v in row] for row in rows]
+    widths = [max(len(row[i]) for row in cells) for i in range(len(columns))]
+    for n, row in enumerate(cells):
+        print("  ".join(c.ljust(w) for c, w in zip(row, widths)).rstrip(), file=out)
+        if n == 0:
+            print("  ".join("-"*w for w in widths), file=out)
+
+# Run ----------------------------------------------------------------------------------------------
+
+def _source(root, rev):
+    return WorkTree(root) if rev is None else GitRevision(root, rev)
+
+def _rev_commit(root, rev):
+    # Commit hash of a git revision, None if rev is not one (e.g. a custom snapshot label).
+    try:
+        return subprocess.check_output(["git", "-C", root, "rev-parse", "--verify", "--quiet", rev + "^{commit}"],
+            text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _ensure(db, root, label, projects):
+    # Returns the snapshot label to read: the work tree is re-indexed every time, revisions are
+    # resolved now and their commit indexed on the fly if missing, other labels are used as is.
+    if label == "worktree":
+        index(db, WorkTree(root), label, projects)
+        return label
+    commit = _rev_commit(root, label)
+    if commit is None:
+        return label
+    if db.execute("SELECT 1 FROM snapshot WHERE label = ?", (commit,)).fetchone() is None:
+        index(db, GitRevision(root, commit), commit, projects)
+    return commit
+
+def main(argv=None):
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    parser = argparse.ArgumentParser(description="Gowin implementation reports database.")
+    parser.add_argument("--db",      default=os.path.join(root, "build", "gowin_reports.db"), help="SQLite database.")
+    parser.add_argument("--root",    default=root,                                             help="Repository root.")
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--project", action="append", default=None, help="Project path or glob (can be repeated, default: {}).".format(", ".join(default_projects)))
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    p = commands.add_parser("index", parents=[common], help="Index the reports of the work tree or of a git revision.")
+    p.add_argument("--rev",   default=None, help="Git revision (default: work tree).")
+    p.add_argument("--label", default=None, help="Snapshot label (default: commit hash of the revision or \"worktree\").")
+
+    commands.add_parser("list", help="List the indexed snapshots.")
+
+    p = commands.add_parser("query", parents=[common], help="Show one table of a snapshot (revisions are indexed if needed).")
+    p.add_argument("label",                                                   help="Snapshot label or revision.")
+    p.add_argument("--table", default="resources", choices=sorted(_queries), help="Table to show.")
+    p.add_argument("--limit", default=None, type=int,                         help="Rows per project (paths: worst paths per kind).")
+
+    p = commands.add_parser("diff", parents=[common], help="Compare two snapshots (revisions are indexed if needed).")
+    p.add_argument("a",                           help="Reference snapshot label or revision.")
+    p.add_argument("b", nargs="?", default="worktree", help="Compared snapshot label or revision.")
+    p.add_argument("--check", action="store_true", help="Exit with status 1 on regressions.")
+
+    args = parser.parse_args(argv)
+    projects = getattr(args, "project", None) or default_projects
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.db)), exist_ok=True)
+    db = open_db(args.db)
+
+    if args.command == "index":
+        source = _source(args.root, args.rev)
+        label  = args.label or (source.commit() if args.rev else "worktree")
+        count  = index(db, source, label, projects)
+        print("{}: {} reports indexed.".format(label, count))
+
+    if args.command == "list":
+        print_table(["label", "commit", "created", "designs"], [
+            (label, (commit or "-")[:12], time.strftime("%Y-%m-%d %H:%M", time.localtime(created)), designs)
+                for label, commit, created, designs in db.execute(
+                    "SELECT s.label, s.commit_, s.created, COUNT(d.id) FROM snapshot s "
+                    "LEFT JOIN design d ON d.snapshot = s.id GROUP BY s.id ORDER BY s.created")])
+
+    if args.command == "query":
+        label = _ensure(db, args.root, args.label, projects)
+        columns, rows = query(db, label, args.table, args.project, args.limit)
+        print_table(columns, rows)
+
+    if args.command == "diff":
+        label_a = _ensure(db, args.root, args.a, projects)
+        label_b = label_a if args.b == args.a else _ensure(db, args.root, args.b, projects)
+        changes = diff(db, label_a, label_b, args.project)
+        if not changes:
+            print("No changes.")
+            return 0
+        print_table(["project", "metric", args.a, args.b, ""],
+            [(project, metric, a, b, "REGRESSION" if regression else "") for project, metric, a, b, regression in changes])
+        if args.check and any(change[-1] for change in changes):
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,238 @@
+#
+# Gowin implementation reports parsing.
+#
+# SPDX-License-Identifier: BSD-2-Clause
+
+# Readers for the reports GowinEDA writes in impl/pnr: the PnR report (<name>.rpt.txt) for
+# resource usage, the timing report (<name>_tr_content.html, <name>.tr.html on older versions)
+# for Fmax, <name>.timing_paths for the analyzed paths and <name>.power.html for power, plus the
+# synthesis resource hierarchy (impl/gwsynthesis/<name>_syn_rsc.xml). Reports are streamed: every
+# parser takes a filename or an iterable of text lines (e.g. a pipe from git show).
+
+import os
+import re
+import glob
+import contextlib
+import xml.etree.ElementTree as ET
+
+
+# Helpers ------------------------------------------------------------------------------------------
+
+@contextlib.contextmanager
+def _open(source):
+    if isinstance(source, (str, os.PathLike)):
+        with open(source, encoding="utf-8", errors="replace") as f:
+            yield f
+    else:
+        yield source
+
+def find_report(pnr_dir, suffix):
+    """Returns the first impl/pnr file ending with suffix (e.g. ".rpt.txt"), or None."""
+    matches = sorted(glob.glob(os.path.join(pnr_dir, "*" + suffix)))
+    return matches[0] if matches else None
+
+# Resource usage (<name>.rpt.txt) ------------------------------------------------------------------
+
+# "Logic | 278/20736  2%", "--LUT,ALU,ROM16 | 278(268 LUT, 10 ALU, 0 ROM16)", "I/O Port | 10",
+# "BSRAM | 0%" (no count when unused).
+_resource_re = re.compile(r"^\s*(--)?(?P<name>[^|]+?)\s*\|\s*(?P<value>.*?)\s*$")
+_used_re     = re.compile(r"^(?P<used>\d+)(/(?P<total>\d+))?")
+_lut_re      = re.compile(r"(\d+) LUT, (\d+) ALU, (\d+) ROM16")
+
+def _resource_key(name):
+    return re.sub(r"[^a-z0-9]+", "_", name.lower()).strip("_")
+
+def parse_resources(source):
+    """Parses the Resource Usage Summary of a PnR report.
+
+       Returns {resource: (used, total)} with total None when the report gives none, resource
+       names lowercased ("logic", "register", "cls", "bsram", "logic_register_as_ff", ...), plus
+       "lut"/"alu"/"rom16" split from the LUT,ALU,ROM16 line.
+       """
+    resources = {}
+    section   = False
+    with _open(source) as f:
+        for line in f:
+            if "Resource Usage Summary" in line:
+                section = True
+                continue
+            if not section:
+                continue
+            if line.strip().startswith("==="):
+                break
+            m = _resource_re.match(line)
+            if m is None or m.group("name") == "Resources":
+                continue
+            name, value = m.group("name"), m.group("value")
+            lut = _lut_re.search(value)
+            if lut is not None:
+                for key, count in zip(["lut", "alu", "rom16"], lut.groups()):
+                    resources[key] = (int(count), None)
+            used = _used_re.match(value)
+            if used is not None:
+                total = used.group("total")
+                resources[_resource_key(name)] = (int(used.group("used")), int(total) if total else None)
+            elif value.endswith("%"):
+                resources[_resource_key(name)] = (0, None)
+    return resources
+
+# Fmax (<name>_tr_content.html) --------------------------------------------------------------------
+
+_cell_re = re.compile(r"<td[^>]*>(.*?)</td>")
+_mhz_re  = re.compile(r"([\d.]+)\s*\(MHz\)")
+
+def parse_fmax(source):
+    """Parses the Max Frequency Summary of a timing report.
+
+       Returns {clock: {"constraint": MHz, "fmax": MHz, "levels": logic levels}}.
+       """
+    clocks  = {}
+    section = False
+    cells   = []
+    with _open(source) as f:
+        for line in f:
+            if "Max_Frequency_Report" in line:
+                section = True
+                continue
+            if not section:
+                continue
+            if "</table>" in line:
+                break
+            cells += _cell_re.findall(line)
+            if "</tr>" in line:
+                if len(cells) >= 5:
+                    constraint = _mhz_re.search(cells[2])
+                    fmax       = _mhz_re.search(cells[3])
+                    clocks[cells[1]] = {
+                        "constraint" : float(constraint.group(1)) if constraint else None,
+                        "fmax"       : float(fmax.group(1))       if fmax       else None,
+                        "levels"     : int(cells[4]) if cells[4].isdigit() else None,
+                    }
+                cells = []
+    return clocks
+
+# Timing paths (<name>.timing_paths) --------------------------------------------------------------
+
+# Paths are separated by "=====": kind (SETUP/HOLD), slack, data arrival and data required
+# times, then the path nodes, each followed by its arrival time(s).
+
+def _float(value):
+    try:
+        return float(value)
+    except ValueError:
+        return None
+
+def parse_timing_paths(source):
+    """Yields the paths of a timing_paths file as dicts: kind, slack, arrival, required,
+       start/end node names and number of nodes (the first node is the clock source)."""
+    def path(lines):
+        if len(lines) < 4:
+            return None
+        nodes = [line for line in lines[4:] if _float(line) is None]
+        return {
+            "kind"     : lines[0],
+            "slack"    : _float(lines[1]),
+            "arrival"  : _float(lines[2]),
+            "required" : _float(lines[3]),
+            "start"    : nodes[1] if len(nodes) > 1 else (nodes[0] if nodes else None),
+            "end"      : nodes[-1] if nodes else None,
+            "nodes"    : len(nodes),
+        }
+    lines = []
+    with _open(source) as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith("====="):
+                p = path(lines)
+                if p is not None:
+                    yield p
+                lines = []
+            elif line:
+                lines.append(line)
+    p = path(lines)
+    if p is not None:
+        yield p
+
+# Power (<name>.power.html) ------------------------------------------------------------------------
+
+_power_summary = {
+    "Total Power (mW)"     : "total_mw",
+    "Quiescent Power (mW)" : "quiescent_mw",
+    "Dynamic Power (mW)"   : "dynamic_mw",
+    "Junction Temperature" : "junction_c",
+}
+
+def parse_power(source):
+    """Parses the power summary and the dynamic power per clock domain.
+
+       Returns {"total_mw", "quiescent_mw", "dynamic_mw", "junction_c", "clocks": {clock: mW}}.
+       """
+    power   = {"clocks": {}}
+    label   = None
+    section = None
+    cells   = []
+    with _open(source) as f:
+        for line in f:
+            if "By_Clock_Domain" in line and "<h2>" in line:
+                section = "clocks"
+                continue
+            if section == "clocks":
+                if "</table>" in line:
+                    section = None
+                    continue
+                cells += _cell_re.findall(line)
+                if "</tr>" in line:
+                    if len(cells) >= 3:
+                        power["clocks"][cells[0]] = _float(cells[2])
+                    cells = []
+                continue
+            m = re.search(r'<td class="label">(.*?)</td>', line)
+            if m is not None:
+                label = _power_summary.get(m.group(1).strip())
+                continue
+            if label is not None:
+                m = _cell_re.search(line)
+                if m is not None:
+                    power[label] = _float(m.group(1).strip())
+                label = None
+    return power
+
+# Synthesis resources (<name>_syn_rsc.xml) ---------------------------------------------------------
+
+def _count(value):
+    # "134(61)": total (own).
+    if value is None:
+        return None
+    m = re.match(r"(\d+)", value)
+    return int(m.group(1)) if m else None
+
+def parse_syn_resources(source):
+    """Yields the modules of the synthesis resource hierarchy: name, parent, own register/lut/alu
+       counts and the totals including submodules (t_register/t_lut/t_alu)."""
+    parents = []
+    with _open(source) as f:
+        for event, elem in ET.iterparse(f, events=("start", "end")):
+            if event == "start":
+                yield {
+                    "name"       : elem.get("name"),
+                    "parent"     : parents[-1] if parents else None,
+                    "register"   : _count(elem.get("Register")),
+                    "lut"        : _count(elem.get("Lut")),
+                    "alu"        : _count(elem.get("Alu")),
+                    "t_register" : _count(elem.get("T_Register")),
+                    "t_lut"      : _count(elem.get("T_Lut")),
+                    "t_alu"      : _count(elem.get("T_Alu")),
+                }
+                parents.append(elem.get("name"))
+            else:
+                parents.pop()
+                elem.clear()
+
+def parse_pnr_dir(pnr_dir):
+    """Resources and Fmax of an impl/pnr directory, missing reports give empty dicts."""
+    rpt = find_report(pnr_dir, ".rpt.txt")
+    tr  = find_report(pnr_dir, "_tr_content.html") or find_report(pnr_dir, ".tr.html")
+    return {
+        "resources" : parse_resources(rpt) if rpt else {},
+        "fmax"      : parse_fmax(tr)       if tr  else {},
+    }
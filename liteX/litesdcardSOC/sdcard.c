@@ -13,7 +13,9 @@
 #include <generated/mem.h>
 #include <generated/soc.h>
 #include <system.h>
+#include <irq.h>
 
+#include <libbase/crc.h>
 #include <libfatfs/ff.h>
 #include <libfatfs/diskio.h>
 #include "sdcard.h"
@@ -33,6 +35,121 @@
 #define SDCARD_CLK_FREQ 25000000
 #endif
 
+/* Block cache (0 to disable), sdcard_read serves single-block reads from it. A streak of
+   SDCARD_READAHEAD_STREAK consecutive single-block reads turns the next miss into a CMD18 of
+   SDCARD_READAHEAD blocks. The cache lives in the SDCARD_CACHE_BASE/SDCARD_CACHE_SIZE region
+   the SoC reserves for it (sdcard_cache), without it the cache is disabled. */
+#ifndef SDCARD_CACHE_BLOCKS
+#define SDCARD_CACHE_BLOCKS 64
+#endif
+
+#ifndef SDCARD_READAHEAD
+#define SDCARD_READAHEAD 8
+#endif
+
+#ifndef SDCARD_READAHEAD_STREAK
+#define SDCARD_READAHEAD_STREAK 2
+#endif
+
+#if !defined(SDCARD_CACHE_BASE)
+#undef  SDCARD_CACHE_BLOCKS
+#define SDCARD_CACHE_BLOCKS 0
+#elif defined(SDCARD_CACHE_SIZE) && 512*(SDCARD_CACHE_BLOCKS + SDCARD_READAHEAD) > SDCARD_CACHE_SIZE
+#error "SDCARD_CACHE_BLOCKS + SDCARD_READAHEAD blocks do not fit in SDCARD_CACHE_SIZE"
+#endif
+
+static uint32_t sdcard_blocks; /* Card capacity, from CSD */
+
+/*-----------------------------------------------------------------------*/
+/* SDCard completion interrupt                                           */
+/*-----------------------------------------------------------------------*/
+
+#ifdef SDCARD_IRQ
+
+#define SDEVENT_CMD_DONE  (1 << CSR_SDCARD_IRQ_PENDING_CMD_DONE_OFFSET)
+#define SDEVENT_DATA_DONE (1 << CSR_SDCARD_IRQ_PENDING_DATA_DONE_OFFSET)
+
+/* Longest sleep waiting for an event, the dedicated sdcard_timer wakes the CPU after it in case
+   the IRQ got lost (timer0 is left to busy_wait) */
+#ifndef SDCARD_IRQ_TIMEOUT_MS
+#define SDCARD_IRQ_TIMEOUT_MS 100
+#endif
+
+static volatile uint32_t sdcard_events;
+static volatile int sdcard_irq_timeout;
+
+void sdcard_isr(void) {
+	uint32_t pending;
+	pending = sdcard_irq_pending_read() & (SDEVENT_CMD_DONE | SDEVENT_DATA_DONE);
+	/* Level events stay pending until the next command: mask them until re-armed */
+	sdcard_irq_enable_write(sdcard_irq_enable_read() & ~pending);
+	sdcard_events |= pending;
+}
+
+#if defined(__riscv) && defined(SDCARD_TIMER_INTERRUPT)
+#define SDCARD_IRQ_SLEEP
+
+static void sdcard_timer_isr(void) {
+	sdcard_timer_ev_enable_write(0);
+	sdcard_timer_ev_pending_write(sdcard_timer_ev_pending_read());
+	sdcard_irq_timeout = 1;
+}
+
+static void sdcard_timeout_start(void) {
+	sdcard_irq_timeout = 0;
+	sdcard_timer_en_write(0);
+	sdcard_timer_reload_write(0);
+	sdcard_timer_load_write(CONFIG_CLOCK_FREQUENCY/1000*SDCARD_IRQ_TIMEOUT_MS);
+	sdcard_timer_ev_pending_write(sdcard_timer_ev_pending_read());
+	sdcard_timer_ev_enable_write(1);
+	sdcard_timer_en_write(1);
+}
+
+static void sdcard_timeout_stop(void) {
+	sdcard_timer_en_write(0);
+	sdcard_timer_ev_enable_write(0);
+	sdcard_timer_ev_pending_write(sdcard_timer_ev_pending_read());
+}
+#endif
+
+static void sdcard_irq_init(void) {
+	sdcard_irq_enable_write(0);
+	sdcard_events = 0;
+	irq_attach(SDCARD_IRQ_INTERRUPT, sdcard_isr);
+	irq_setmask(irq_getmask() | (1 << SDCARD_IRQ_INTERRUPT));
+#ifdef SDCARD_IRQ_SLEEP
+	sdcard_timer_en_write(0);
+	sdcard_timer_ev_enable_write(0);
+	irq_attach(SDCARD_TIMER_INTERRUPT, sdcard_timer_isr);
+	irq_setmask(irq_getmask() | (1 << SDCARD_TIMER_INTERRUPT));
+#endif
+}
+
+/* Sleeps until event (or the timeout), the caller then reads the result from the core. On a
+   timeout or without sleep support it returns early and the caller polls the core instead. */
+static void sdcard_irq_wait(uint32_t event) {
+	/* Without interrupts enabled, fall back to polling the core */
+	if (!irq_getie())
+		return;
+	sdcard_events &= ~event;
+	sdcard_irq_enable_write(sdcard_irq_enable_read() | event);
+#ifdef SDCARD_IRQ_SLEEP
+	sdcard_timeout_start();
+	/* Test and sleep with interrupts off: an event raised in between stays pending and wakes
+	   wfi, then the ISR runs once they are re-enabled. */
+	irq_setie(0);
+	while ((sdcard_events & event) == 0 && !sdcard_irq_timeout) {
+		__asm__ volatile("wfi");
+		irq_setie(1);
+		irq_setie(0);
+	}
+	irq_setie(1);
+	sdcard_timeout_stop();
+#endif
+}
+
+#endif
+
 /*-----------------------------------------------------------------------*/
 /* SDCard command helpers                                                */
 /*-----------------------------------------------------------------------*/
@@ -42,10 +159,12 @@ int sdcard_wait_cmd_done(void) {
 #ifdef SDCARD_DEBUG
 	uint32_t r[SD_CMD_RESPONSE_SIZE/4];
 	printf("cmdevt: wait for event & 0x1\n");
+#endif
+#ifdef SDCARD_IRQ
+	sdcard_irq_wait(SDEVENT_CMD_DONE);
 #endif
 	for (;;) {
 		event = sdcard_core_cmd_event_read();
-		busy_wait_us(10);
 		if (event & 0x1)
 			break;
 	}
@@ -66,12 +185,14 @@ int sdcard_wait_data_done(void) {
 	unsigned int event;
 #ifdef SDCARD_DEBUG
 	printf("dataevt: wait for event & 0x1\n");
+#endif
+#ifdef SDCARD_IRQ
+	sdcard_irq_wait(SDEVENT_DATA_DONE);
 #endif
 	for (;;) {
 		event = sdcard_core_data_event_read();
 		if (event & 0x1)
 			break;
-		busy_wait_us(10);
 	}
 #ifdef SDCARD_DEBUG
 	printf("dataevt: %08x\n", event);
@@ -371,6 +492,81 @@ void sdcard_decode_csd(void) {
 }
 #endif
 
+/*-----------------------------------------------------------------------*/
+/* SDCard block cache                                                    */
+/*-----------------------------------------------------------------------*/
+
+#if SDCARD_CACHE_BLOCKS > 0
+
+#define SDCARD_CACHE_INVALID 0xffffffff
+
+static uint32_t sdcard_cache_tags[SDCARD_CACHE_BLOCKS];
+static uint32_t sdcard_cache_stamps[SDCARD_CACHE_BLOCKS];
+static uint32_t sdcard_cache_clock;
+static uint32_t sdcard_cache_next;
+static uint32_t sdcard_cache_streak;
+
+static inline uint8_t *sdcard_cache_entry(int i)
+{
+	return (uint8_t *)(SDCARD_CACHE_BASE) + 512*i;
+}
+
+void sdcard_cache_invalidate(void)
+{
+	int i;
+	for (i = 0; i < SDCARD_CACHE_BLOCKS; i++)
+		sdcard_cache_tags[i] = SDCARD_CACHE_INVALID;
+	sdcard_cache_next   = SDCARD_CACHE_INVALID;
+	sdcard_cache_streak = 0;
+}
+
+static int sdcard_cache_lookup(uint32_t block)
+{
+	int i;
+	for (i = 0; i < SDCARD_CACHE_BLOCKS; i++) {
+		if (sdcard_cache_tags[i] == block) {
+			sdcard_cache_stamps[i] = ++sdcard_cache_clock;
+			return i;
+		}
+	}
+	return -1;
+}
+
+static void sdcard_cache_insert(uint32_t block, const uint8_t *data)
+{
+	int i, victim;
+	/* Reuse the entry of the block, else evict the least recently used one */
+	victim = 0;
+	for (i = 0; i < SDCARD_CACHE_BLOCKS; i++) {
+		if (sdcard_cache_tags[i] == block) {
+			victim = i;
+			break;
+		}
+		if (sdcard_cache_tags[i] == SDCARD_CACHE_INVALID ||
+		    (sdcard_cache_tags[victim] != SDCARD_CACHE_INVALID &&
+		     sdcard_cache_stamps[i] < sdcard_cache_stamps[victim]))
+			victim = i;
+	}
+	memcpy(sdcard_cache_entry(victim), data, 512);
+	sdcard_cache_tags[victim]   = block;
+	sdcard_cache_stamps[victim] = ++sdcard_cache_clock;
+}
+
+static void sdcard_cache_update(uint32_t block, uint32_t count, const uint8_t *buf)
+{
+	int i;
+	/* Keep cached copies of written blocks current */
+	for (i = 0; i < SDCARD_CACHE_BLOCKS; i++)
+		if (sdcard_cache_tags[i] - block < count)
+			memcpy(sdcard_cache_entry(i), buf + 512*(sdcard_cache_tags[i] - block), 512);
+}
+
+#else
+
+void sdcard_cache_invalidate(void) {}
+
+#endif
+
 /*-----------------------------------------------------------------------*/
 /* SDCard user functions                                                 */
 /*-----------------------------------------------------------------------*/
@@ -379,6 +575,10 @@ int sdcard_init(void) {
 	uint16_t rca, timeout;
 	uint32_t r[SD_CMD_RESPONSE_SIZE/4];
 
+#ifdef SDCARD_IRQ
+	sdcard_irq_init();
+#endif
+
 	/* Set SD clk freq to Initialization frequency */
 	sdcard_set_clk_freq(SDCARD_CLK_FREQ_INIT, 0);
 	busy_wait(1);
@@ -443,6 +643,14 @@ int sdcard_init(void) {
 #ifdef SDCARD_DEBUG
 	sdcard_decode_csd();
 #endif
+	/* Capacity, only decoded for CSD structure version 2.0: (C_SIZE+1) * 512KB, left unknown (0)
+	   for SDSC (version 1.0) cards */
+	csr_rd_buf_uint32(CSR_SDCARD_CORE_CMD_RESPONSE_ADDR,
+			  r, SD_CMD_RESPONSE_SIZE/4);
+	if ((r[0] >> 30) == 1)
+		sdcard_blocks = ((r[2] >> 16) + ((r[1] & 0xff) << 16) + 1) * 1024;
+	else
+		sdcard_blocks = 0;
 
 	/* Select card */
 	if (sdcard_select_card(rca) != SD_OK)
@@ -469,12 +677,14 @@ int sdcard_init(void) {
 	if (sdcard_app_set_blocklen(512) != SD_OK)
 		return 0;
 
+	sdcard_cache_invalidate();
+
 	return 1;
 }
 
 #ifdef CSR_SDCARD_BLOCK2MEM_BASE
 
-void sdcard_read(uint32_t block, uint32_t count, uint8_t* buf)
+static void sdcard_read_blocks(uint32_t block, uint32_t count, uint8_t* buf)
 {
 	while (count) {
 		uint32_t nblocks;
@@ -518,12 +728,89 @@ void sdcard_read(uint32_t block, uint32_t count, uint8_t* buf)
 #endif
 }
 
+#if SDCARD_CACHE_BLOCKS > 0
+
+static uint32_t sdcard_readahead(uint32_t block)
+{
+	uint32_t nblocks;
+	/* Readahead on a streak of consecutive single-block reads */
+	if (block == sdcard_cache_next)
+		sdcard_cache_streak++;
+	else
+		sdcard_cache_streak = 0;
+	sdcard_cache_next = block + 1;
+	if (sdcard_cache_streak < SDCARD_READAHEAD_STREAK)
+		return 1;
+	nblocks = SDCARD_READAHEAD;
+	if (sdcard_blocks) {
+		if (block >= sdcard_blocks)
+			return 1;
+		if (block + nblocks > sdcard_blocks)
+			nblocks = sdcard_blocks - block;
+	}
+	return nblocks;
+}
+
+void sdcard_read(uint32_t block, uint32_t count, uint8_t* buf)
+{
+	int i;
+	uint32_t n, nblocks;
+	uint8_t *staging = (uint8_t *)(SDCARD_CACHE_BASE) + 512*SDCARD_CACHE_BLOCKS;
+
+	while (count) {
+		/* Hit */
+		i = sdcard_cache_lookup(block);
+		if (i >= 0) {
+			if (count == 1)
+				sdcard_readahead(block);
+			memcpy(buf, sdcard_cache_entry(i), 512);
+			block++;
+			buf += 512;
+			count--;
+			continue;
+		}
+
+		/* Single-block miss: fill the cache (with readahead) */
+		if (count == 1) {
+			nblocks = sdcard_readahead(block);
+			sdcard_read_blocks(block, nblocks, staging);
+			for (n = 0; n < nblocks; n++)
+				sdcard_cache_insert(block + n, staging + 512*n);
+			memcpy(buf, staging, 512);
+			return;
+		}
+
+		/* Multi-block miss: read the missing run straight to buf, bypassing the cache */
+		for (nblocks = 1; nblocks < count; nblocks++)
+			if (sdcard_cache_lookup(block + nblocks) >= 0)
+				break;
+		sdcard_read_blocks(block, nblocks, buf);
+		sdcard_cache_next   = block + nblocks;
+		sdcard_cache_streak = 0;
+		block += nblocks;
+		buf   += 512*nblocks;
+		count -= nblocks;
+	}
+}
+
+#else
+
+void sdcard_read(uint32_t block, uint32_t count, uint8_t* buf)
+{
+	sdcard_read_blocks(block, count, buf);
+}
+
+#endif
+
 #endif
 
 #ifdef CSR_SDCARD_MEM2BLOCK_BASE
 
 void sdcard_write(uint32_t block, uint32_t count, uint8_t* buf)
 {
+#if SDCARD_CACHE_BLOCKS > 0
+	sdcard_cache_update(block, count, buf);
+#endif
 	while (count) {
 		uint32_t nblocks;
 #ifdef SDCARD_CMD25_SUPPORT
@@ -561,6 +848,259 @@ void sdcard_write(uint32_t block, uint32_t count, uint8_t* buf)
 }
 #endif
 
+/*-----------------------------------------------------------------------*/
+/* SDCard fast boot                                                      */
+/*-----------------------------------------------------------------------*/
+
+/* A boot image is a header block (struct sdcard_boot_header) followed by the payload, see
+   litesdcardHDL/sdboot.py. The payload is read with a single CMD18 whose DMA writes straight to
+   the load address, and each chunk is checked against its CRC32 as soon as the DMA is past it:
+   while chunk n is verified, the next ones are in flight. */
+
+#ifdef CSR_SDCARD_BLOCK2MEM_BASE
+
+#ifndef SDCARD_BOOT_BLOCK
+#define SDCARD_BOOT_BLOCK 1
+#endif
+
+/* CMD18 attempts before giving up on the fast boot, the BIOS then goes on with its boot sequence */
+#ifndef SDCARD_BOOT_CMD_RETRIES
+#define SDCARD_BOOT_CMD_RETRIES 8
+#endif
+
+/* Polls of the DMA position once the data phase has ended, before the load is given up */
+#ifndef SDCARD_BOOT_DMA_SPINS
+#define SDCARD_BOOT_DMA_SPINS 100000
+#endif
+
+/* The block2mem offset register counts DMA bus words */
+#ifndef SDCARD_DMA_WORD_BYTES
+#define SDCARD_DMA_WORD_BYTES 4
+#endif
+
+static uint32_t sdcard_boot_cycles(void)
+{
+#ifdef CSR_TIMER0_UPTIME_CYCLES_ADDR
+	timer0_uptime_latch_write(1);
+	return timer0_uptime_cycles_read();
+#else
+	return 0;
+#endif
+}
+
+/* Timestamps for the simulation boot profiler (sipeed_tang_nano_20k.py --sim, see bootprof.py) */
+enum {
+	SDCARD_BOOT_MARK_INIT     = 1, /* SD init done */
+	SDCARD_BOOT_MARK_HEADER   = 2, /* Header read and checked */
+	SDCARD_BOOT_MARK_TRANSFER = 3, /* DMA done */
+	SDCARD_BOOT_MARK_VERIFIED = 4, /* Last chunk verified, transfer stopped */
+};
+
+static void sdcard_boot_mark(uint8_t mark)
+{
+#ifdef CSR_BOOTPROF_MARK_ADDR
+	bootprof_mark_write(mark);
+#endif
+}
+
+static uint32_t sdcard_boot_us(uint32_t cycles)
+{
+	return cycles/(CONFIG_CLOCK_FREQUENCY/1000000);
+}
+
+static uint32_t sdcard_boot_loaded(uint32_t length)
+{
+	/* Bytes already written by the DMA (only known at the end without the offset register) */
+	if (sdcard_block2mem_dma_done_read() & 0x1)
+		return length;
+#ifdef CSR_SDCARD_BLOCK2MEM_DMA_OFFSET_ADDR
+	return sdcard_block2mem_dma_offset_read()*SDCARD_DMA_WORD_BYTES;
+#else
+	return 0;
+#endif
+}
+
+static void sdcard_boot_dma_start(uint8_t *dst, uint32_t nblocks)
+{
+	/* (Re)starts the DMA from the load address, the previous attempt may have been part way */
+	sdcard_block2mem_dma_enable_write(0);
+	sdcard_block2mem_dma_base_write((uint64_t)(uintptr_t) dst);
+	sdcard_block2mem_dma_length_write(512*nblocks);
+	sdcard_block2mem_dma_enable_write(1);
+#ifdef SDCARD_CMD23_SUPPORT
+	sdcard_set_block_count(nblocks);
+#endif
+	sdcard_core_block_length_write(512);
+	sdcard_core_block_count_write(nblocks);
+}
+
+static int sdcard_boot_wait(uint32_t length, uint32_t offset)
+{
+	/* Waits until the DMA is past offset. The data phase is bounded by the core timeout: once it
+	   has ended with an error, or ended and the DMA still doesn't get there, the load failed. */
+	uint32_t event, spins;
+	spins = 0;
+	while (sdcard_boot_loaded(length) < offset) {
+		event = sdcard_core_data_event_read();
+		if ((event & 0x1) == 0)
+			continue;
+		if (event & 0x4)
+			return SD_TIMEOUT;
+		if (event & 0x8)
+			return SD_CRCERROR;
+		if (++spins > SDCARD_BOOT_DMA_SPINS)
+			return SD_TIMEOUT;
+	}
+	return SD_OK;
+}
+
+int sdcard_boot_load(uint32_t block, struct sdcard_boot_header *header)
+{
+	uint32_t t0, t1, t2, t3;
+	uint32_t crc, nblocks, chunk_bytes, offset, chunk, n;
+	uint8_t *dst;
+	int ret, retries;
+
+	t0 = sdcard_boot_cycles();
+
+	/* Header */
+	sdcard_read(block, 1, (uint8_t *) header);
+	if (header->magic != SDCARD_BOOT_MAGIC || header->version != SDCARD_BOOT_VERSION) {
+		printf("SD boot: no boot image at block %lu\n", block);
+		return SD_NOBOOTIMAGE;
+	}
+	crc = header->header_crc;
+	header->header_crc = 0;
+	if (crc32((unsigned char *) header, sizeof(*header)) != crc) {
+		printf("SD boot: header CRC error\n");
+		return SD_CRCERROR;
+	}
+	header->header_crc = crc;
+	nblocks = header->length/512 + (header->length%512 != 0);
+	if (nblocks == 0 || header->chunk_blocks == 0 || header->chunk_blocks > 0xffffffff/512 ||
+	    header->nchunks > SDCARD_BOOT_CHUNKS) {
+		printf("SD boot: invalid header\n");
+		return SD_NOBOOTIMAGE;
+	}
+	chunk_bytes = 512*header->chunk_blocks;
+	/* Exactly ceil(length/chunk_bytes) chunks: an extra chunk would start past the payload and
+	   its length (length - offset) underflow */
+	if (header->nchunks != header->length/chunk_bytes + (header->length%chunk_bytes != 0)) {
+		printf("SD boot: invalid header\n");
+		return SD_NOBOOTIMAGE;
+	}
+	dst = (uint8_t *)(uintptr_t) header->load_addr;
+	t1  = sdcard_boot_cycles();
+	sdcard_boot_mark(SDCARD_BOOT_MARK_HEADER);
+
+#ifndef CONFIG_CPU_HAS_DMA_BUS
+	/* Write back dirty lines of the destination before the DMA overwrites it */
+	flush_cpu_dcache();
+	flush_l2_cache();
+#endif
+
+	/* Single CMD18 to the load address, the data event is only waited for at the end */
+	for (retries = SDCARD_BOOT_CMD_RETRIES; retries > 0; retries--) {
+		sdcard_boot_dma_start(dst, nblocks);
+		if (sdcard_send_command(block + 1, 18,
+		    (SDCARD_CTRL_DATA_TRANSFER_READ << 5) |
+		    SDCARD_CTRL_RESPONSE_SHORT) == SD_OK)
+			break;
+		/* The card may be sending already: stop it before the next attempt */
+		sdcard_block2mem_dma_enable_write(0);
+		sdcard_stop_transmission();
+	}
+	if (retries == 0) {
+		printf("SD boot: CMD18 failed\n");
+		return SD_TIMEOUT;
+	}
+
+	/* Verify behind the DMA */
+	ret = SD_OK;
+	t2  = 0;
+	for (n = 0; n < header->nchunks; n++) {
+		offset = n*chunk_bytes;
+		chunk  = min(chunk_bytes, header->length - offset);
+		ret    = sdcard_boot_wait(512*nblocks, offset + chunk);
+		if (ret != SD_OK) {
+			printf("SD boot: transfer error in chunk %lu (0x%08lx)\n", n, header->load_addr + offset);
+			break;
+		}
+		if (t2 == 0 && (sdcard_block2mem_dma_done_read() & 0x1)) {
+			t2 = sdcard_boot_cycles();
+			sdcard_boot_mark(SDCARD_BOOT_MARK_TRANSFER);
+		}
+#ifndef CONFIG_CPU_HAS_DMA_BUS
+		flush_cpu_dcache();
+		flush_l2_cache();
+#endif
+		if (crc32(dst + offset, chunk) != header->chunk_crc[n]) {
+			printf("SD boot: CRC error in chunk %lu (0x%08lx)\n", n, header->load_addr + offset);
+			ret = SD_CRCERROR;
+			break;
+		}
+	}
+
+	/* End of the transfer, on errors the DMA is stopped where it is */
+	if (ret == SD_OK)
+		ret = sdcard_boot_wait(512*nblocks, 512*nblocks);
+	if (ret == SD_OK && sdcard_wait_data_done() != SD_OK)
+		ret = SD_CRCERROR;
+	if (ret != SD_OK)
+		sdcard_block2mem_dma_enable_write(0);
+	sdcard_stop_transmission();
+	t3 = sdcard_boot_cycles();
+	if (t2 == 0) {
+		t2 = t3;
+		sdcard_boot_mark(SDCARD_BOOT_MARK_TRANSFER);
+	}
+	sdcard_boot_mark(SDCARD_BOOT_MARK_VERIFIED);
+
+	if (ret == SD_OK) {
+		printf("SD boot: %lu bytes to 0x%08lx, %lu chunks verified\n",
+			header->length, header->load_addr, header->nchunks);
+#ifdef CSR_TIMER0_UPTIME_CYCLES_ADDR
+		printf("SD boot: %lu us (header %lu us, transfer %lu us, verify tail %lu us), %lu KiB/s\n",
+			sdcard_boot_us(t3 - t0), sdcard_boot_us(t1 - t0), sdcard_boot_us(t2 - t1),
+			sdcard_boot_us(t3 - t2),
+			(uint32_t)((uint64_t) header->length*1000000/1024/max(sdcard_boot_us(t3 - t1), 1)));
+#endif
+	}
+	return ret;
+}
+
+void sdcard_boot(void)
+{
+	struct sdcard_boot_header header;
+	uint32_t t0;
+
+	printf("Booting from SDCard (fast boot)...\n");
+	t0 = sdcard_boot_cycles();
+	if (!sdcard_init()) {
+		printf("SDCard initialization failed.\n");
+		return;
+	}
+	sdcard_boot_mark(SDCARD_BOOT_MARK_INIT);
+#ifdef CSR_TIMER0_UPTIME_CYCLES_ADDR
+	printf("SD boot: init %lu us\n", sdcard_boot_us(sdcard_boot_cycles() - t0));
+#endif
+	if (sdcard_boot_load(SDCARD_BOOT_BLOCK, &header) != SD_OK) {
+		printf("SD boot failed, continuing with the regular boot.\n");
+		return;
+	}
+
+	printf("Executing booted program at 0x%08lx\n\n", header.load_addr);
+	printf("--============= \e[1mLiftoff!\e[0m ===============--\n");
+	irq_setmask(0);
+	irq_setie(0);
+	flush_cpu_icache();
+	flush_cpu_dcache();
+	flush_l2_cache();
+	((void (*)(void))(uintptr_t) header.load_addr)();
+}
+
+#endif
+
 /*-----------------------------------------------------------------------*/
 /* SDCard FatFs disk functions                                           */
 /*-----------------------------------------------------------------------*/
@@ -9,6 +9,7 @@ extern "C" {
 #endif
 
 #include <generated/csr.h>
+#include <generated/soc.h>
 
 #define CLKGEN_STATUS_BUSY		0x1
 #define CLKGEN_STATUS_PROGDONE	0x2
@@ -22,6 +23,7 @@ extern "C" {
 #define SD_CRCERROR   1
 #define SD_TIMEOUT    2
 #define SD_WRITEERROR 3
+#define SD_NOBOOTIMAGE 4
 
 #define SD_SWITCH_CHECK  0
 #define SD_SWITCH_SWITCH 1
@@ -57,6 +59,12 @@ extern "C" {
 #define SDCARD_CTRL_RESPONSE_LONG       2
 #define SDCARD_CTRL_RESPONSE_SHORT_BUSY 3
 
+/* Command/data completion is waited for on the sdcard_irq interrupt when the SoC has it with
+   its data_done event, otherwise (or with SDCARD_NO_IRQ) the core event registers are polled. */
+#if defined(CSR_SDCARD_IRQ_PENDING_DATA_DONE_OFFSET) && defined(SDCARD_IRQ_INTERRUPT) && !defined(SDCARD_NO_IRQ)
+#define SDCARD_IRQ
+#endif
+
 /*-----------------------------------------------------------------------*/
 /* SDCard command helpers                                                */
 /*-----------------------------------------------------------------------*/
@@ -64,6 +72,9 @@ extern "C" {
 int sdcard_wait_cmd_done(void);
 int sdcard_wait_data_done(void);
 int sdcard_wait_response(void);
+#ifdef SDCARD_IRQ
+void sdcard_isr(void);
+#endif
 
 /*-----------------------------------------------------------------------*/
 /* SDCard clocker functions                                              */
@@ -107,8 +118,33 @@ void sdcard_decode_csd(void);
 int sdcard_init(void);
 void sdcard_read(uint32_t sector, uint32_t count, uint8_t* buf);
 void sdcard_write(uint32_t sector, uint32_t count, uint8_t* buf);
+void sdcard_cache_invalidate(void);
 void fatfs_set_ops_sdcard(void);
 
+/*-----------------------------------------------------------------------*/
+/* SDCard fast boot                                                      */
+/*-----------------------------------------------------------------------*/
+
+#define SDCARD_BOOT_MAGIC   0x54424453 /* "SDBT" */
+#define SDCARD_BOOT_VERSION 1
+#define SDCARD_BOOT_CHUNKS  120
+
+/* Boot image header block (little-endian), followed on the card by the payload */
+struct sdcard_boot_header {
+	uint32_t magic;
+	uint32_t version;
+	uint32_t load_addr;    /* Link address of the payload, also its entry point */
+	uint32_t length;       /* Payload length in bytes */
+	uint32_t chunk_blocks; /* Blocks per verified chunk */
+	uint32_t nchunks;
+	uint32_t reserved;
+	uint32_t header_crc;   /* CRC32 of this block with header_crc = 0 */
+	uint32_t chunk_crc[SDCARD_BOOT_CHUNKS];
+};
+
+int sdcard_boot_load(uint32_t block, struct sdcard_boot_header *header);
+void sdcard_boot(void);
+
 #endif /* CSR_SDCARD_CORE_BASE */
 
 #ifdef __cplusplus
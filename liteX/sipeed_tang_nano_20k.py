@@ -7,38 +7,85 @@
 # Copyright (c) 2022 Florent Kermarrec <florent@enjoy-digital.fr>
 # SPDX-License-Identifier: BSD-2-Clause
 
+import os
+import re
+import sys
+import json
+import glob
+import time
+import shutil
+import hashlib
+import struct
+import argparse
+import itertools
+import importlib
+from concurrent.futures import ProcessPoolExecutor
+
 from migen import *
 from migen.genlib.resetsync import AsyncResetSynchronizer
+from migen.genlib.cdc import MultiReg
 
 from litex.gen import *
 
 from litex.build.io import DDROutput
+from litex.build.generic_platform import Pins, Subsignal
+from litex.build.sim import SimPlatform
+from litex.build.sim.config import SimConfig
 
 from litex.soc.cores.clock.gowin_gw2a import GW2APLL
 from litex.soc.integration.soc_core import *
 from litex.soc.integration.soc import SoCRegion
 from litex.soc.integration.builder import *
+from litex.soc.interconnect import wishbone
+from litex.soc.interconnect.csr import CSRStorage
+from litex.soc.interconnect.csr_eventmanager import EventManager, EventSourceLevel
 from litex.soc.cores.gpio import GPIOIn
+from litex.soc.cores.timer import Timer
 from litex.soc.cores.led import LedChaser, WS2812
 
 from litedram.modules import M12L64322A  # FIXME: use the real model number
 from litedram.phy import GENSDRPHY
+from litedram.phy.model import SDRAMPHYModel, get_sdram_phy_settings
+from litedram.frontend.wishbone import LiteDRAMWishbone2Native
 
 from litex_boards.platforms import sipeed_tang_nano_20k
 
 # litesdcard -------------------------------
 
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "litesdcardHDL"))
+
+from core import SDEmulator
+from backing import SDEmulatorDRAMBacking
+from counters import SDEmulatorCounters
+from tracer import SDEmulatorTrace, SDEmulatorTraceDRAMWriter
+
+import bootprof
+
 
+# Platforms ----------------------------------------------------------------------------------------
 
+class _SDEmulatorPadsMixin:
+    # The SDCard core requests "sdcard": once an SDEmulator is added, its pads are returned instead
+    # of the card connector, looping the core to the emulated card.
+    sdcard = None
 
+    def request(self, name, *args, **kwargs):
+        if name == "sdcard" and self.sdcard is not None:
+            return self.sdcard
+        return super().request(name, *args, **kwargs)
+
+class _Platform(_SDEmulatorPadsMixin, sipeed_tang_nano_20k.Platform):
+    pass
 
 # CRG ----------------------------------------------------------------------------------------------
 
 class _CRG(LiteXModule):
-    def __init__(self, platform, sys_clk_freq):
+    def __init__(self, platform, sys_clk_freq, sd_clk_freq=None):
         self.rst      = Signal()
         self.cd_sys   = ClockDomain()
         self.cd_por   = ClockDomain()
+        if sd_clk_freq is not None:
+            self.cd_sd = ClockDomain()
 
         # Clk
         clk27 = platform.request("clk27")
@@ -56,19 +103,191 @@ class _CRG(LiteXModule):
         pll.register_clkin(clk27, 27e6)
         pll.create_clkout(self.cd_sys, sys_clk_freq)
 
+        # SD PLL (SD emulator core clock, independent of sys_clk_freq)
+        if sd_clk_freq is not None:
+            self.sd_pll = sd_pll = GW2APLL(devicename=platform.devicename, device=platform.device)
+            self.comb += sd_pll.reset.eq(~por_done | self.rst)
+            sd_pll.register_clkin(clk27, 27e6)
+            sd_pll.create_clkout(self.cd_sd, sd_clk_freq)
+
+# Simulation ---------------------------------------------------------------------------------------
+
+# --sim runs BaseSoC in Verilator: the clocks come from the simulator, the SDRAM is LiteDRAM's
+# SDR model (preloaded with the SD image at the emulator storage) and the SD host core talks to
+# the SDEmulator pads instead of the card connector.
+
+_sim_io = [
+    ("sys_clk", 0, Pins(1)),
+    ("sd_clk",  0, Pins(1)),
+    ("serial", 0,
+        Subsignal("source_valid", Pins(1)),
+        Subsignal("source_ready", Pins(1)),
+        Subsignal("source_data",  Pins(8)),
+        Subsignal("sink_valid",   Pins(1)),
+        Subsignal("sink_ready",   Pins(1)),
+        Subsignal("sink_data",    Pins(8)),
+    ),
+]
+
+class _SimPlatform(_SDEmulatorPadsMixin, SimPlatform):
+    def __init__(self):
+        SimPlatform.__init__(self, "SIM", _sim_io)
+
+class _SimCRG(LiteXModule):
+    def __init__(self, platform, sd_clk_freq=None):
+        self.rst    = Signal()
+        self.cd_sys = ClockDomain()
+        self.comb += [
+            self.cd_sys.clk.eq(platform.request("sys_clk")),
+            self.cd_sys.rst.eq(self.rst),
+        ]
+        if sd_clk_freq is not None:
+            self.cd_sd = ClockDomain()
+            self.comb += [
+                self.cd_sd.clk.eq(platform.request("sd_clk")),
+                self.cd_sd.rst.eq(self.rst),
+            ]
+
+def _sim_sdram_init(image, base, size):
+    # 32-bit little-endian words of the SDRAM model from address 0, the image at base.
+    with open(image, "rb") as f:
+        data = f.read()
+    if len(data) > size:
+        raise ValueError(f"{image} ({len(data)} bytes) does not fit the SD emulator storage ({size} bytes).")
+    data += bytes(-len(data) % 4)
+    return [0]*(base//4) + list(struct.unpack(f"<{len(data)//4}I", data))
+
+class BootProfiler(LiteXModule):
+    """Timestamps the boot milestones of the simulated SoC and prints them ($display), see
+       bootprof.py for the events and the log parser.
+
+       dfii is the LiteDRAM DFI injector, ibus the CPU instruction bus and main_ram its
+       (origin, size) region, sd_emulator the SDEmulator serving the card; events without their
+       source are left out. At boot the phase durations are printed in cycles and microseconds,
+       with finish_on_boot the simulation ends there. timeout (cycles) ends it in any case.
+       Software timestamps are written to the mark CSR.
+       """
+    def __init__(self, sys_clk_freq, dfii=None, ibus=None, main_ram=None, sd_emulator=None,
+        finish_on_boot=True, timeout=None):
+        self.mark = CSRStorage(8, description="Software timestamp, printed with the cycle count.")
+
+        # # #
+
+        cycles = Signal(64)
+        self.sync += cycles.eq(cycles + 1)
+
+        # Fixed-point cycles -> us.
+        us_shift = 24
+        us_scale = int(2**us_shift*1e6/sys_clk_freq)
+
+        # Events -----------------------------------------------------------------------------------
+        conditions = {}
+        if dfii is not None:
+            sel     = dfii._control.fields.sel
+            sw_ctrl = Signal()
+            self.sync += If(~sel, sw_ctrl.eq(1))
+            conditions["sdram_init"] = ~sel
+            conditions["sdram_done"] = sw_ctrl & sel
+        if sd_emulator is not None:
+            # cmd_in is static long after cmd_in_act rises, resynchronize both to sys.
+            cmd_in_act   = Signal()
+            cmd_in_act_d = Signal()
+            cmd_opcode   = Signal(6)
+            self.specials += [
+                MultiReg(sd_emulator.cmd_in_act,    cmd_in_act, "sys"),
+                MultiReg(sd_emulator.cmd_in[40:46], cmd_opcode, "sys"),
+            ]
+            cmd_event = Signal()
+            self.sync += cmd_in_act_d.eq(cmd_in_act)
+            self.comb += cmd_event.eq(cmd_in_act & ~cmd_in_act_d)
+            conditions["sd_init"] = cmd_event
+            conditions["sd_load"] = cmd_event & ((cmd_opcode == 17) | (cmd_opcode == 18))
+        if ibus is not None and main_ram is not None:
+            origin, size = main_ram
+            adr = Signal(32)
+            self.comb += adr.eq(ibus.adr << 2)
+            conditions["boot"] = ibus.cyc & ibus.stb & (adr >= origin) & (adr < origin + size)
+
+        stamps = {}
+        seen   = {}
+        for event in bootprof.EVENTS:
+            if event not in conditions:
+                continue
+            stamps[event] = Signal(64, name=event + "_cycles")
+            seen[event]   = Signal(name=event + "_seen")
+            self.sync += If(conditions[event] & ~seen[event],
+                seen[event].eq(1),
+                stamps[event].eq(cycles),
+                Display("[bootprof] event " + event + " %0d", cycles),
+            )
+
+        # Report -----------------------------------------------------------------------------------
+        if "boot" in stamps:
+            spans = {}
+            for name, start, end in bootprof.PHASES:
+                if start in stamps and end in stamps:
+                    spans[name] = Signal(64, name=name + "_cycles")
+                    self.comb += spans[name].eq(stamps[end] - stamps[start])
+            spans["bios_init"] = Signal(64, name="bios_init_cycles")
+            self.comb += spans["bios_init"].eq(stamps.get("sd_init", stamps["boot"]) -
+                spans.get("sdram_calibration", 0))
+            spans["total"] = stamps["boot"]
+
+            report = []
+            for name in ["bios_init", "sdram_calibration", "sd_init", "payload_load", "total"]:
+                if name in spans:
+                    report.append(Display("[bootprof] phase " + name + " %0d cycles %0d us",
+                        spans[name], (spans[name]*us_scale) >> us_shift))
+            boot_d  = Signal()
+            boot_dd = Signal()
+            self.sync += [
+                boot_d.eq(seen["boot"]),
+                boot_dd.eq(boot_d),
+                If(seen["boot"] & ~boot_d, *report),
+            ]
+            if finish_on_boot:
+                self.sync += If(boot_d & ~boot_dd, Finish())
+
+        # Software marks / timeout -----------------------------------------------------------------
+        self.sync += If(self.mark.re,
+            Display("[bootprof] mark %0d %0d", self.mark.storage, cycles)
+        )
+        if timeout is not None:
+            self.sync += If(cycles == timeout,
+                Display("[bootprof] timeout %0d", cycles),
+                Finish(),
+            )
+
 # BaseSoC ------------------------------------------------------------------------------------------
 
 class BaseSoC(SoCCore):
     def __init__(self, toolchain="gowin", sys_clk_freq=48e6,
-        with_led_chaser = True,
-        with_rgb_led    = False,
-        with_buttons    = True,
+        with_led_chaser   = True,
+        with_rgb_led      = False,
+        with_buttons      = True,
+        with_sd_emulator  = False,
+        sd_emulator_size  = 0x40_0000,
+        sd_clk_freq       = None,
+        with_sd_trace     = False,
+        sd_trace_size     = 0x10_0000,
+        sdcard_cache_size = 0,
+        l2_cache_size     = 128,
+        sim               = False,
+        sim_image         = None,
         **kwargs):
 
-        platform = sipeed_tang_nano_20k.Platform(toolchain=toolchain)
+        if sim:
+            # No board IOs in simulation.
+            platform = _SimPlatform()
+            with_led_chaser = with_rgb_led = with_buttons = False
+        else:
+            platform = _Platform(toolchain=toolchain)
 
         # CRG --------------------------------------------------------------------------------------
-        self.crg = _CRG(platform, sys_clk_freq)
+        if sim:
+            self.crg = _SimCRG(platform, sd_clk_freq if with_sd_emulator else None)
+        else:
+            self.crg = _CRG(platform, sys_clk_freq, sd_clk_freq if with_sd_emulator else None)
 
         # SoCCore ----------------------------------------------------------------------------------
         SoCCore.__init__(self, platform, sys_clk_freq, ident="LiteX SoC on Tang Nano 20K", **kwargs)
@@ -77,29 +296,66 @@ class BaseSoC(SoCCore):
 
         # SDR SDRAM --------------------------------------------------------------------------------
         if not self.integrated_main_ram_size:
-            class SDRAMPads:
-                def __init__(self):
-                    self.clk   = platform.request("O_sdram_clk")
-                    self.cke   = platform.request("O_sdram_cke")
-                    self.cs_n  = platform.request("O_sdram_cs_n")
-                    self.cas_n = platform.request("O_sdram_cas_n")
-                    self.ras_n = platform.request("O_sdram_ras_n")
-                    self.we_n  = platform.request("O_sdram_wen_n")
-                    self.dm    = platform.request("O_sdram_dqm")
-                    self.a     = platform.request("O_sdram_addr")
-                    self.ba    = platform.request("O_sdram_ba")
-                    self.dq    = platform.request("IO_sdram_dq")
-            sdram_pads = SDRAMPads()
-
-            self.specials += DDROutput(0, 1, sdram_pads.clk, ClockSignal("sys"))
-
-            self.sdrphy = GENSDRPHY(sdram_pads, sys_clk_freq)
+            # The SD emulator storage (and its trace buffer) and the sdcard driver block cache are
+            # carved from the top of the SDRAM (8MB), main_ram stops below them.
+            sdram_size    = 0x80_0000
+            reserved_size = sdcard_cache_size
+            if with_sd_emulator:
+                reserved_size += sd_emulator_size
+                if with_sd_trace:
+                    reserved_size += sd_trace_size
+            main_ram_size = sdram_size - reserved_size if reserved_size else None
+
+            sdram_module = M12L64322A(sys_clk_freq, "1:1") # FIXME.
+            if sim:
+                # SD image preloaded at the emulator storage.
+                sdram_init = None
+                if with_sd_emulator and sim_image is not None:
+                    sdram_init = _sim_sdram_init(sim_image, base=main_ram_size, size=sd_emulator_size)
+                self.sdrphy = SDRAMPHYModel(
+                    module   = sdram_module,
+                    settings = get_sdram_phy_settings(memtype="SDR", data_width=32, clk_freq=sys_clk_freq),
+                    clk_freq = sys_clk_freq,
+                    init     = sdram_init,
+                )
+            else:
+                class SDRAMPads:
+                    def __init__(self):
+                        self.clk   = platform.request("O_sdram_clk")
+                        self.cke   = platform.request("O_sdram_cke")
+                        self.cs_n  = platform.request("O_sdram_cs_n")
+                        self.cas_n = platform.request("O_sdram_cas_n")
+                        self.ras_n = platform.request("O_sdram_ras_n")
+                        self.we_n  = platform.request("O_sdram_wen_n")
+                        self.dm    = platform.request("O_sdram_dqm")
+                        self.a     = platform.request("O_sdram_addr")
+                        self.ba    = platform.request("O_sdram_ba")
+                        self.dq    = platform.request("IO_sdram_dq")
+                sdram_pads = SDRAMPads()
+
+                self.specials += DDROutput(0, 1, sdram_pads.clk, ClockSignal("sys"))
+
+                self.sdrphy = GENSDRPHY(sdram_pads, sys_clk_freq)
             self.add_sdram("sdram",
                 phy           = self.sdrphy,
-                module        = M12L64322A(sys_clk_freq, "1:1"), # FIXME.
-                l2_cache_size = 128,
+                module        = sdram_module,
+                size          = main_ram_size,
+                l2_cache_size = l2_cache_size,
             )
 
+            # SD Emulator ------------------------------------------------------------------------
+            if with_sd_emulator:
+                self.add_sd_emulator(base=main_ram_size, size=sd_emulator_size,
+                    clock_domain = "sys" if sd_clk_freq is None else "sd")
+                if with_sd_trace:
+                    self.add_sd_trace(base=main_ram_size + sd_emulator_size, size=sd_trace_size,
+                        clk_freq = sys_clk_freq if sd_clk_freq is None else sd_clk_freq)
+
+            # SDCard cache -----------------------------------------------------------------------
+            # Mapped by add_sdcard() for the driver's block cache.
+            self.sdcard_cache_base = sdram_size - sdcard_cache_size
+            self.sdcard_cache_size = sdcard_cache_size
+
         # Leds -------------------------------------------------------------------------------------
         if with_led_chaser:
             self.leds = LedChaser(
@@ -123,6 +379,208 @@ class BaseSoC(SoCCore):
         if with_buttons:
             self.buttons = GPIOIn(pads=~platform.request_all("btn"))
 
+    def add_sd_emulator(self, base, size, num_blocks=4, clock_domain="sys"):
+        # SDRAM-backed emulated card, add_sdcard() loops the SDCard core to its pads.
+        self.sd_emulator = SDEmulator(self.platform, num_blocks=num_blocks, clock_domain=clock_domain)
+        self.sd_emulator_backing = SDEmulatorDRAMBacking(self.sd_emulator,
+            rd_port = self.sdram.crossbar.get_port(mode="read",  data_width=32),
+            wr_port = self.sdram.crossbar.get_port(mode="write", data_width=32),
+            base    = base,
+            size    = size,
+        )
+        self.sd_emulator_counters = SDEmulatorCounters(self.sd_emulator)
+        self.platform.sdcard = self.sd_emulator.pads
+
+    def add_boot_profiler(self, finish_on_boot=True, timeout=None):
+        # Boot milestones of the simulated SoC, see bootprof.py.
+        main_ram = None
+        if "main_ram" in self.bus.regions:
+            main_ram = (self.bus.regions["main_ram"].origin, self.bus.regions["main_ram"].size)
+        self.bootprof = BootProfiler(self.sys_clk_freq,
+            dfii           = self.sdram.dfii if hasattr(self, "sdram") else None,
+            ibus           = getattr(self.cpu, "ibus", None),
+            main_ram       = main_ram,
+            sd_emulator    = getattr(self, "sd_emulator", None),
+            finish_on_boot = finish_on_boot,
+            timeout        = timeout,
+        )
+
+    def add_sd_trace(self, base, size, clk_freq, origin=0x3000_0000):
+        # Change-only capture of the SD emulator PHY/link states to SDRAM. The buffer is also
+        # mapped (uncached) on the bus so the host reads it back over the UART bridge, see
+        # litesdcardHDL/sdtrace.py.
+        self.sd_trace = SDEmulatorTrace(self.sd_emulator)
+        self.sd_trace_writer = SDEmulatorTraceDRAMWriter(self.sd_trace,
+            port = self.sdram.crossbar.get_port(mode="write", data_width=32),
+            base = base,
+            size = size,
+        )
+        sd_trace_bus = wishbone.Interface(data_width=32)
+        self.sd_trace_bridge = LiteDRAMWishbone2Native(
+            wishbone     = sd_trace_bus,
+            port         = self.sdram.crossbar.get_port(data_width=32),
+            base_address = origin - base,
+        )
+        self.bus.add_slave(name="sd_trace", slave=sd_trace_bus, region=SoCRegion(
+            origin = origin,
+            size   = size,
+            cached = False,
+        ))
+        self.add_constant("SD_TRACE_CLK_FREQ", int(clk_freq))
+
+    def finalize(self):
+        # Nothing drives the emulator pads without the SDCard core, it would be optimized out.
+        if hasattr(self, "sd_emulator") and not hasattr(self, "sdcard_core"):
+            raise ValueError("The SD emulator needs the SDCard core (add_sdcard/--with-sdcard) as its host.")
+        SoCCore.finalize(self)
+
+    def add_sdcard_cache(self, origin=0x3100_0000):
+        # SDRAM reserved for the sdcard driver block cache, outside main_ram so payloads and the
+        # stack can't overlap it. Exported as SDCARD_CACHE_BASE/SDCARD_CACHE_SIZE.
+        sdcard_cache_bus = wishbone.Interface(data_width=32)
+        self.sdcard_cache_bridge = LiteDRAMWishbone2Native(
+            wishbone     = sdcard_cache_bus,
+            port         = self.sdram.crossbar.get_port(data_width=32),
+            base_address = origin - self.sdcard_cache_base,
+        )
+        self.bus.add_slave(name="sdcard_cache", slave=sdcard_cache_bus, region=SoCRegion(
+            origin = origin,
+            size   = self.sdcard_cache_size,
+        ))
+        self.add_constant("SDCARD_CACHE_BASE", origin)
+        self.add_constant("SDCARD_CACHE_SIZE", self.sdcard_cache_size)
+
+    def add_module(self, name, module):
+        # add_sdcard() finalizes its sdcard_irq EventManager right after creating its sources: add
+        # a data transfer done source at that point, last so the LiteX event bits don't move.
+        if name == "sdcard_irq" and isinstance(module, EventManager):
+            finalize = module.finalize
+            def finalize_with_data_done(*args, **kwargs):
+                if not module.finalized:
+                    module.data_done = EventSourceLevel(description="Data transfer completed.")
+                finalize(*args, **kwargs)
+            module.finalize = finalize_with_data_done
+        SoCCore.add_module(self, name, module)
+
+    def add_sdcard(self, *args, **kwargs):
+        SoCCore.add_sdcard(self, *args, **kwargs)
+        if getattr(self, "sdcard_cache_size", 0):
+            self.add_sdcard_cache()
+        # Command/data completion interrupt (sdcard_irq cmd_done/data_done), used by the sdcard
+        # driver instead of polling.
+        self.comb += self.sdcard_irq.data_done.trigger.eq(self.sdcard_core.data_event.fields.done)
+        # Timeout of those waits, a timer of its own so timer0 (busy_wait) is left alone.
+        if self.irq.enabled:
+            self.sdcard_timer = Timer()
+            self.irq.add("sdcard_timer", use_loc_if_exists=True)
+
+
+# Build cache --------------------------------------------------------------------------------------
+
+# Bitstreams are cached under <output_dir>/build_cache/<key>, the key hashes everything the
+# gateware depends on: SoC/builder/toolchain arguments, this file, the SD emulator Python and
+# Verilog sources, the SDCard driver built into the BIOS (litesdcardSOC) and the installed LiteX
+# packages. Packages installed from a source checkout (editable or on sys.path) are keyed on their
+# git HEAD and uncommitted changes, or on their sources outside git, not on their version string.
+
+_build_cache_packages = {
+    "migen"        : "migen",
+    "litex"        : "litex",
+    "litedram"     : "litedram",
+    "litesdcard"   : "litesdcard",
+    "litex-boards" : "litex_boards",
+}
+
+def _build_cache_sources():
+    root_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+    sources  = [os.path.abspath(__file__)]
+    for pattern in ["*.py", "*.v", "*.vh"]:
+        sources += sorted(glob.glob(os.path.join(root_dir, "litesdcardHDL", pattern)))
+    sources += sorted(f for f in glob.glob(os.path.join(root_dir, "liteX", "litesdcardSOC", "*")) if os.path.isfile(f))
+    return sources
+
+def _build_cache_tree_hash(path):
+    # Sources of a checkout outside git (bytecode and build outputs skipped).
+    h = hashlib.sha256()
+    for root, dirs, files in os.walk(path):
+        dirs[:] = sorted(d for d in dirs if d not in ["__pycache__", "build", ".git"])
+        for name in sorted(files):
+            if name.endswith((".pyc", ".pyo")):
+                continue
+            filename = os.path.join(root, name)
+            h.update(os.path.relpath(filename, path).encode())
+            with open(filename, "rb") as f:
+                h.update(hashlib.sha256(f.read()).digest())
+    return h.hexdigest()
+
+def _build_cache_package_id(package, module):
+    import importlib.util
+    import subprocess
+    import sysconfig
+    from importlib import metadata
+    try:
+        spec = importlib.util.find_spec(module)
+    except (ImportError, ValueError):
+        spec = None
+    if spec is None:
+        return None
+    origin = spec.origin if spec.origin not in [None, "namespace"] else list(spec.submodule_search_locations)[0]
+    path   = os.path.realpath(os.path.dirname(origin) if os.path.isfile(origin) else origin)
+    installed = {os.path.realpath(sysconfig.get_paths()[k]) for k in ["purelib", "platlib"]}
+    if any(path.startswith(p + os.sep) for p in installed):
+        try:
+            return metadata.version(package)
+        except metadata.PackageNotFoundError:
+            return None
+    # Source checkout: git HEAD + uncommitted changes, or the whole tree.
+    def git(*args):
+        return subprocess.run(["git", "-C", path, *args], capture_output=True, check=True).stdout
+    try:
+        head  = git("rev-parse", "HEAD").decode().strip()
+        dirty = hashlib.sha256(git("diff", "--binary", "HEAD"))
+        for name in sorted(git("ls-files", "--others", "--exclude-standard", "-z").split(b"\0")):
+            if name:
+                dirty.update(name)
+                with open(os.path.join(path, name.decode()), "rb") as f:
+                    dirty.update(hashlib.sha256(f.read()).digest())
+        return f"git:{head}:{dirty.hexdigest()}"
+    except (OSError, subprocess.CalledProcessError):
+        return "tree:" + _build_cache_tree_hash(path)
+
+def _build_cache_key(config):
+    h = hashlib.sha256()
+    h.update(json.dumps(config, sort_keys=True, default=str).encode())
+    for package, module in _build_cache_packages.items():
+        h.update(f"{package}={_build_cache_package_id(package, module)}\n".encode())
+    for source in _build_cache_sources():
+        h.update(os.path.relpath(source, os.path.dirname(os.path.abspath(__file__))).encode())
+        with open(source, "rb") as f:
+            h.update(hashlib.sha256(f.read()).digest())
+    return h.hexdigest()[:16]
+
+def _build_cache_lookup(cache_dir, key):
+    manifest = os.path.join(cache_dir, key, "manifest.json")
+    if not os.path.exists(manifest):
+        return None
+    with open(manifest) as f:
+        bitstreams = json.load(f)["bitstreams"]
+    bitstreams = {mode: os.path.join(cache_dir, key, name) for mode, name in bitstreams.items()}
+    if not all(os.path.exists(filename) for filename in bitstreams.values()):
+        return None
+    return bitstreams
+
+def _build_cache_store(cache_dir, key, config, bitstreams):
+    entry_dir = os.path.join(cache_dir, key)
+    os.makedirs(entry_dir, exist_ok=True)
+    names = {}
+    for mode, filename in bitstreams.items():
+        if os.path.exists(filename):
+            names[mode] = mode + "_" + os.path.basename(filename)
+            shutil.copy2(filename, os.path.join(entry_dir, names[mode]))
+    # Manifest last: an interrupted store is a miss.
+    with open(os.path.join(entry_dir, "manifest.json"), "w") as f:
+        json.dump({"config": config, "bitstreams": names}, f, indent=2, sort_keys=True, default=str)
+    return {mode: os.path.join(entry_dir, name) for mode, name in names.items()}
 
 # Build --------------------------------------------------------------------------------------------
 
@@ -134,29 +592,285 @@ def main():
     sdopts = parser.target_group.add_mutually_exclusive_group()
     sdopts.add_argument("--with-spi-sdcard",            action="store_true", help="Enable SPI-mode SDCard support.")
     sdopts.add_argument("--with-sdcard",                action="store_true", help="Enable SDCard support.")
+    parser.add_target_argument("--with-sd-emulator", action="store_true",      help="Enable SDRAM-backed SDCard emulator (SDCard core looped to it, with --with-sdcard).")
+    parser.add_target_argument("--sd-clk-freq",      default=None, type=float, help="SDCard emulator core clock frequency (default: sys).")
+    parser.add_target_argument("--with-sd-trace",    action="store_true",      help="Capture the SDCard emulator PHY/link states to SDRAM (read back over a UART bridge, e.g. --uart-name=crossover+uartbone).")
+    parser.add_target_argument("--sdcard-boot-block", default=None, type=int,   help="Enable the SDCard fast boot path (sdcard_boot) with its image header at this block.")
+    parser.add_target_argument("--sdcard-cache-size", default=0x1_0000, type=lambda x: int(x, 0), help="SDRAM reserved for the SDCard driver block cache with --with-sdcard (0 to disable).")
+    parser.add_target_argument("--no-build-cache",   action="store_true",      help="Always elaborate/build, bypassing the build cache.")
+    parser.add_target_argument("--sim",              action="store_true",      help="Build and run the SoC in a Verilator simulation instead of the board.")
+    parser.add_target_argument("--sim-image",        default=None,             help="Disk image served by the simulated SDCard (enables the SDCard emulator and core).")
+    parser.add_target_argument("--sim-timeout",      default=None, type=int,   help="End the simulation after this many sys cycles.")
+    parser.add_target_argument("--sim-no-finish",    action="store_true",      help="Keep simulating once the payload runs.")
+    parser.add_target_argument("--sim-no-memtest",   action="store_true",      help="Skip the BIOS SDRAM memtest in simulation.")
+    parser.add_target_argument("--sim-threads",      default=1, type=int,      help="Verilator threads.")
+    parser.add_target_argument("--sim-trace",        action="store_true",      help="Dump simulation waveforms.")
     args = parser.parse_args()
-
-    soc = BaseSoC(
-        toolchain    = args.toolchain,
-        sys_clk_freq = args.sys_clk_freq,
+    if args.with_sd_emulator and not (args.with_sdcard or args.sim):
+        parser.error("--with-sd-emulator needs --with-sdcard, the SDCard core is looped to the emulated card.")
+
+    soc_kwargs = dict(
+        toolchain         = args.toolchain,
+        sys_clk_freq      = args.sys_clk_freq,
+        with_sd_emulator  = args.with_sd_emulator,
+        sd_clk_freq       = args.sd_clk_freq,
+        with_sd_trace     = args.with_sd_trace,
+        # Only reserved with the SDCard core, the cache is mapped by add_sdcard().
+        sdcard_cache_size = args.sdcard_cache_size if args.with_sdcard else 0,
         **parser.soc_argdict
     )
+    if args.sdcard_boot_block is not None:
+        soc_kwargs["timer_uptime"] = True # Boot time report.
+
+    if args.sim:
+        sim(args, parser, soc_kwargs)
+        return
+
+    # Build cache: on a hit, skip elaboration and build and go straight to load/flash.
+    output_dir = parser.builder_argdict.get("output_dir") or os.path.join("build", "sipeed_tang_nano_20k")
+    cache_dir  = os.path.join(output_dir, "build_cache")
+    config     = {
+        "soc"             : soc_kwargs,
+        "with_spi_sdcard" : args.with_spi_sdcard,
+        "with_sdcard"     : args.with_sdcard,
+        "sdcard_boot"     : args.sdcard_boot_block,
+        "builder"         : parser.builder_argdict,
+        "toolchain"       : parser.toolchain_argdict,
+    }
+    key        = _build_cache_key(config)
+    bitstreams = None if args.no_build_cache else _build_cache_lookup(cache_dir, key)
+
+    if bitstreams is not None:
+        print(f"Build cache hit ({key}), skipping build.")
+        platform = sipeed_tang_nano_20k.Platform(toolchain=args.toolchain)
+    else:
+        soc = BaseSoC(**soc_kwargs)
+        if args.with_spi_sdcard:
+            soc.add_spi_sdcard()
+        if args.with_sdcard:
+            soc.add_sdcard()
+            if args.sdcard_boot_block is not None:
+                soc.add_constant("SDCARD_BOOT_BLOCK", args.sdcard_boot_block)
+
+        builder = Builder(soc, **parser.builder_argdict)
+        bitstreams = {
+            "sram"  : builder.get_bitstream_filename(mode="sram"),
+            "flash" : builder.get_bitstream_filename(mode="flash", ext=".fs"),
+        }
+        if args.build:
+            builder.build(**parser.toolchain_argdict)
+            if not args.no_build_cache:
+                bitstreams.update(_build_cache_store(cache_dir, key, config, bitstreams))
+        platform = soc.platform
+
+    if args.load:
+        prog = platform.create_programmer()
+        prog.load_bitstream(bitstreams["sram"])
+
+    if args.flash:
+        prog = platform.create_programmer()
+        prog.flash(0, bitstreams["flash"], external=True)
+
+# Simulation ---------------------------------------------------------------------------------------
+
+# Same BaseSoC in Verilator, no build cache. The boot milestones are printed as [bootprof] lines
+# (see bootprof.py) and the simulation ends once the payload runs, so boot time can be profiled
+# on machines without a board:
+#
+#   ./sipeed_tang_nano_20k.py --sim --sim-image sd.img --sdcard-boot-block 1 --sim-no-memtest
+
+def sim(args, parser, soc_kwargs):
+    with_sdcard = args.with_sdcard or args.sim_image is not None
+    soc_kwargs  = dict(soc_kwargs,
+        sim               = True,
+        sim_image         = args.sim_image,
+        with_sd_emulator  = args.with_sd_emulator or with_sdcard,
+        sdcard_cache_size = args.sdcard_cache_size if with_sdcard else 0,
+        uart_name         = "sim",
+        timer_uptime      = True,
+    )
     if args.with_spi_sdcard:
-        soc.add_spi_sdcard()
-    if args.with_sdcard:
+        raise SystemExit("--sim only supports the SDCard core (--with-sdcard/--sim-image).")
+    soc = BaseSoC(**soc_kwargs)
+    if with_sdcard:
         soc.add_sdcard()
+        if args.sdcard_boot_block is not None:
+            soc.add_constant("SDCARD_BOOT_BLOCK", args.sdcard_boot_block)
+    if args.sim_no_memtest:
+        soc.add_constant("SDRAM_TEST_DISABLE")
+    soc.add_boot_profiler(finish_on_boot=not args.sim_no_finish, timeout=args.sim_timeout)
+
+    sim_config = SimConfig()
+    sim_config.add_clocker("sys_clk", freq_hz=args.sys_clk_freq)
+    if soc_kwargs["with_sd_emulator"] and args.sd_clk_freq is not None:
+        sim_config.add_clocker("sd_clk", freq_hz=args.sd_clk_freq)
+    sim_config.add_module("serial2console", "serial")
 
     builder = Builder(soc, **parser.builder_argdict)
-    if args.build:
-        builder.build(**parser.toolchain_argdict)
-
-    if args.load:
-        prog = soc.platform.create_programmer()
-        prog.load_bitstream(builder.get_bitstream_filename(mode="sram"))
+    builder.build(
+        sim_config  = sim_config,
+        threads     = args.sim_threads,
+        trace       = args.sim_trace,
+        interactive = sys.stdin.isatty(),
+    )
 
-    if args.flash:
-        prog = soc.platform.create_programmer()
-        prog.flash(0, builder.get_bitstream_filename(mode="flash", ext=".fs"), external=True)
+# Sweep --------------------------------------------------------------------------------------------
+
+# Builds BaseSoC variants in a process pool and collects Fmax, resources and build time in one
+# table. The toolchain step gets the Builder of a variant and returns its impl/pnr directory,
+# the default runs the Gowin flow. --dry-run swaps in StubBuildStep, which only generates the
+# gateware and writes made-up reports in the Gowin format so elaboration and report parsing can be
+# exercised without GowinEDA; its rows are marked dry_run and the table is labelled as fake.
+
+class GowinBuildStep:
+    builder_kwargs = {}
+
+    def __call__(self, builder):
+        builder.build()
+        return os.path.join(builder.gateware_dir, "impl", "pnr")
+
+class StubBuildStep:
+    builder_kwargs = {"compile_software": False, "compile_gateware": False}
+    fake           = True
+
+    def __call__(self, builder):
+        builder.build()
+        name    = builder.soc.platform.name
+        pnr_dir = os.path.join(builder.gateware_dir, "impl", "pnr")
+        os.makedirs(pnr_dir, exist_ok=True)
+        # Rough figures from the generated Verilog, only meant to vary across variants.
+        with open(os.path.join(builder.gateware_dir, name + ".v")) as f:
+            verilog = f.read()
+        luts = verilog.count("assign ") + verilog.count("always @(")
+        ffs  = verilog.count("<=")
+        mems = len(re.findall(r"^reg \[[^\]]*\] \w+\[\d+:\d+\];", verilog, re.M))
+        with open(os.path.join(pnr_dir, name + ".rpt.txt"), "w") as f:
+            f.write("FAKE REPORT: written by the sweep --dry-run stub, not by a Gowin build.\n\n")
+            f.write("3. Resource Usage Summary\n\n")
+            f.write(f"  Logic                       | {luts}/20736\n")
+            f.write(f"    --LUT,ALU,ROM16           | {luts}({luts} LUT, 0 ALU, 0 ROM16)\n")
+            f.write(f"  Register                    | {ffs}/15750\n")
+            f.write(f"  BSRAM                       | {mems}/46\n")
+            f.write("  ==========================================================\n")
+        with open(os.path.join(pnr_dir, name + "_tr_content.html"), "w") as f:
+            f.write("<!-- FAKE REPORT: written by the sweep --dry-run stub, not by a Gowin build. -->\n")
+            f.write("<h2><a name=\"Max_Frequency_Report\">Max Frequency Summary:</a></h2>\n<table>\n")
+            f.write("<tr>\n<td>1</td>\n<td>sys</td>\n")
+            f.write(f"<td>{builder.soc.sys_clk_freq/1e6:.3f}(MHz)</td>\n<td>{1e3/(1 + luts/1e3):.3f}(MHz)</td>\n")
+            f.write("<td>1</td>\n<td>TOP</td>\n</tr>\n</table>\n")
+        return pnr_dir
+
+_sweep_steps = {
+    "gowin" : GowinBuildStep,
+}
+
+def _sweep_step(spec, dry_run=False):
+    # Registered name or "module:callable" returning a step, the stub with dry_run.
+    if dry_run:
+        return StubBuildStep()
+    if spec in _sweep_steps:
+        return _sweep_steps[spec]()
+    module, name = spec.split(":")
+    return getattr(importlib.import_module(module), name)()
+
+_sweep_peripherals = {
+    "led"     : "with_led_chaser",
+    "rgb"     : "with_rgb_led",
+    "buttons" : "with_buttons",
+}
+
+def _sweep_variants(args):
+    variants = []
+    for sys_clk_freq, l2_cache_size, sdcard, peripherals in itertools.product(
+        args.sys_clk_freq, args.l2_cache_size, args.sdcard, args.peripherals):
+        enabled = set() if peripherals == "none" else set(peripherals.split("+"))
+        assert enabled <= set(_sweep_peripherals), peripherals
+        variants.append({
+            "sys_clk_freq"  : sys_clk_freq,
+            "l2_cache_size" : l2_cache_size,
+            "sdcard"        : sdcard,
+            **{kwarg: name in enabled for name, kwarg in _sweep_peripherals.items()},
+        })
+    return variants
+
+def _sweep_name(variant):
+    peripherals = "+".join(name for name, kwarg in _sweep_peripherals.items() if variant[kwarg]) or "none"
+    return "{:g}MHz_l2_{}_{}_{}".format(
+        variant["sys_clk_freq"]/1e6, variant["l2_cache_size"], variant["sdcard"], peripherals)
+
+def _sweep_run(variant, step_spec, toolchain, output_dir, dry_run=False):
+    import gowin_reports
+    step  = _sweep_step(step_spec, dry_run)
+    name  = _sweep_name(variant)
+    start = time.time()
+    kwargs = {k: v for k, v in variant.items() if k != "sdcard"}
+    if variant["sdcard"] == "sd":
+        kwargs["sdcard_cache_size"] = 0x1_0000
+    soc = BaseSoC(toolchain=toolchain, **kwargs)
+    if variant["sdcard"] == "spi":
+        soc.add_spi_sdcard()
+    if variant["sdcard"] == "sd":
+        soc.add_sdcard()
+    builder = Builder(soc, output_dir=os.path.join(output_dir, name), **step.builder_kwargs)
+    reports = gowin_reports.parse_pnr_dir(step(builder))
+    row = {"name": name, **variant, "build_time": time.time() - start}
+    if getattr(step, "fake", False):
+        row["dry_run"] = True
+    for resource in ["lut", "logic_register_as_ff", "register", "bsram"]:
+        if resource in reports["resources"]:
+            row[resource] = reports["resources"][resource][0]
+    for clock, timing in reports["fmax"].items():
+        row[f"fmax_{clock}"] = timing["fmax"]
+    return row
+
+def _sweep_table(rows):
+    columns = []
+    for row in rows:
+        columns += [c for c in row if c not in columns]
+    def fmt(v):
+        if isinstance(v, float):
+            return f"{v:.3f}" if v < 1e3 else f"{v:g}"
+        return "" if v is None else str(v)
+    cells  = [columns] + [[fmt(row.get(c)) for c in columns] for row in rows]
+    widths = [max(len(line[i]) for line in cells) for i in range(len(columns))]
+    return "\n".join("  ".join(cell.ljust(w) for cell, w in zip(line, widths)) for line in cells)
+
+def sweep(argv=None):
+    parser = argparse.ArgumentParser(description="BaseSoC design-space sweep on Tang Nano 20K.")
+    parser.add_argument("--sys-clk-freq",  default=[48e6],       type=float, nargs="+", help="System clock frequencies.")
+    parser.add_argument("--l2-cache-size", default=[128],        type=int,   nargs="+", help="SDRAM L2 cache sizes.")
+    parser.add_argument("--sdcard",        default=["none"],     nargs="+",  choices=["none", "spi", "sd"], help="SDCard options.")
+    parser.add_argument("--peripherals",   default=["led+buttons"], nargs="+",
+        help="Peripheral sets: '+'-separated from led, rgb, buttons, or 'none'.")
+    parser.add_argument("--toolchain",     default="gowin",      help="LiteX toolchain (gowin/apicula).")
+    parser.add_argument("--step",          default="gowin",      help="Build step: gowin or module:callable.")
+    parser.add_argument("--dry-run",       action="store_true",  help="Only elaborate, with made-up reports (no Gowin build, figures are fake).")
+    parser.add_argument("--jobs",          default=os.cpu_count(), type=int, help="Parallel builds.")
+    parser.add_argument("--output-dir",    default=os.path.join("build", "sweep"), help="Sweep output directory.")
+    parser.add_argument("--json",          default=None,         help="Also write the results to this JSON file.")
+    args = parser.parse_args(argv)
+
+    variants = _sweep_variants(args)
+    with ProcessPoolExecutor(max_workers=args.jobs) as pool:
+        futures = [pool.submit(_sweep_run, variant, args.step, args.toolchain, args.output_dir, args.dry_run)
+            for variant in variants]
+        rows    = []
+        for variant, future in zip(variants, futures):
+            try:
+                rows.append(future.result())
+            except Exception as e:
+                rows.append({"name": _sweep_name(variant), **variant, "error": repr(e),
+                    **({"dry_run": True} if args.dry_run else {})})
+
+    if args.dry_run:
+        print("DRY RUN: resources/Fmax below are made up by the stub build step, not from a Gowin build.")
+    print(_sweep_table(rows))
+    if args.json is not None:
+        with open(args.json, "w") as f:
+            json.dump(rows, f, indent=2)
 
 if __name__ == "__main__":
-    main()
+    if sys.argv[1:2] == ["sweep"]:
+        sweep(sys.argv[2:])
+    else:
+        main()
@@ -0,0 +1,229 @@
+# SPDX-License-Identifier: BSD-2-Clause
+
+from migen import *
+
+from litedram.frontend.dma import LiteDRAMDMAReader, LiteDRAMDMAWriter
+
+
+def _swap_bytes(d):
+    # The PHY shifts block data MSB first (byte 0 in bits 31:24), DRAM is little-endian.
+    return Cat(d[24:32], d[16:24], d[8:16], d[0:8])
+
+
+class SDEmulatorDRAMBacking(Module):
+    """Backs an SDEmulator with a region of SDRAM through two 32-bit LiteDRAM native ports.
+
+       Block n of the card lives at base + 512*n (modulo size). Read ring slots are filled
+       with one 128-word DMA burst per block, the emulator keeps requesting the next blocks
+       of a CMD18 while the current one is clocked out. Written slots are drained the same
+       way, a run of consecutive blocks as a single burst of drain_count*128 words; write
+       commands are accepted by the crossbar before the next fill is issued so a read-back
+       of the same block is ordered behind them.
+
+       Erased blocks are tracked in an on-chip bitmap (one bit per block, 32 blocks per word):
+       an erase only sets bits, fills of erased blocks write zeros to the slot without any
+       DRAM access (SCR DATA_STAT_AFTER_ERASE is 0) and draining a block clears its bit.
+       """
+    def __init__(self, emulator, rd_port, wr_port, base=0x0000_0000, size=0x40_0000):
+        assert rd_port.data_width == 32 and wr_port.data_width == 32
+        assert size >= 32*512 and (size & (size - 1)) == 0
+        emulator.backed = True
+
+        self.reader = reader = LiteDRAMDMAReader(rd_port, fifo_depth=16)
+        self.writer = writer = LiteDRAMDMAWriter(wr_port, fifo_depth=16)
+        self.submodules += reader, writer
+
+        base_words  = base//4
+        block_bits  = log2_int(size//512)
+        slot_bits   = log2_int(emulator.num_blocks)
+
+        fill_port  = emulator.fill_port
+        drain_port = emulator.drain_port
+
+        # Erased-block bitmap: word n holds blocks 32*n..32*n+31.
+        self.specials.erased = erased = Memory(32, size//512//32)
+        self.specials.erased_rd = erased_rd = erased.get_port()
+        self.specials.erased_rw = erased_rw = erased.get_port(write_capable=True)
+        self.comb += erased_rd.adr.eq(emulator.fill_addr[5:block_bits])
+
+        # Fill: stream block fill_addr into slot fill_slot ---------------------------------------
+        fill_cmd = Signal(7)
+        fill_dat = Signal(8)
+
+        self.submodules.fill_fsm = fill_fsm = FSM(reset_state="IDLE")
+        fill_fsm.act("IDLE",
+            NextValue(fill_cmd, 0),
+            If(emulator.fill_req,
+                NextState("CHECK")
+            )
+        )
+        fill_fsm.act("CHECK",
+            If((erased_rd.dat_r >> emulator.fill_addr[:5])[0],
+                NextState("ZERO")
+            ).Else(
+                NextState("READ")
+            )
+        )
+        fill_fsm.act("ZERO",
+            If(fill_dat == (512//4 - 1),
+                NextState("DONE")
+            )
+        )
+        fill_fsm.act("READ",
+            reader.sink.valid.eq(1),
+            reader.sink.address.eq(base_words + Cat(fill_cmd, emulator.fill_addr[:block_bits])),
+            If(reader.sink.ready,
+                NextValue(fill_cmd, fill_cmd + 1),
+                If(fill_cmd == (512//4 - 1),
+                    NextState("DATA")
+                )
+            )
+        )
+        fill_fsm.act("DATA",
+            If(fill_dat == 512//4,
+                NextState("DONE")
+            )
+        )
+        fill_fsm.act("DONE",
+            emulator.fill_done.eq(1),
+            If(~emulator.fill_req,
+                NextState("IDLE")
+            )
+        )
+        # Data returns while commands are still being issued.
+        self.comb += [
+            reader.source.ready.eq(1),
+            fill_port.adr.eq(Cat(fill_dat[:7], emulator.fill_slot)),
+            If(fill_fsm.ongoing("ZERO"),
+                fill_port.we.eq(1)
+            ).Else(
+                fill_port.dat_w.eq(_swap_bytes(reader.source.data)),
+                fill_port.we.eq(reader.source.valid),
+            )
+        ]
+        self.sync += [
+            If(fill_fsm.ongoing("IDLE"),
+                fill_dat.eq(0)
+            ).Elif(fill_port.we,
+                fill_dat.eq(fill_dat + 1)
+            )
+        ]
+
+        # Drain: stream slots drain_slot.. to blocks drain_addr.. ---------------------------------
+        drain_cnt  = Signal(7 + slot_bits) # Word in the run, {block, word}
+        drain_ack  = Signal()
+        drain_next = Signal(7 + slot_bits)
+        drain_blk  = Signal(slot_bits)     # Block of the run whose erased bit is cleared
+
+        self.submodules.drain_fsm = drain_fsm = FSM(reset_state="IDLE")
+        drain_fsm.act("IDLE",
+            NextValue(drain_cnt, 0),
+            NextValue(drain_blk, 0),
+            If(emulator.drain_req & ~emulator.erase_req,
+                NextState("PRIME")
+            )
+        )
+        # Memory read port is synchronous: present word 0 one cycle ahead.
+        drain_fsm.act("PRIME",
+            NextState("WRITE")
+        )
+        drain_fsm.act("WRITE",
+            writer.sink.valid.eq(1),
+            writer.sink.address.eq(base_words +
+                Cat(drain_cnt[:7], (emulator.drain_addr + drain_cnt[7:])[:block_bits])),
+            writer.sink.data.eq(_swap_bytes(drain_port.dat_r)),
+            drain_ack.eq(writer.sink.ready),
+            If(writer.sink.ready,
+                NextValue(drain_cnt, drain_cnt + 1),
+                If(drain_cnt == Cat(C(512//4 - 1, 7), (emulator.drain_count - 1)[:slot_bits]),
+                    NextState("UNERASE")
+                )
+            )
+        )
+        # The blocks now hold data, clear their erased bits (read-modify-write, one block at a
+        # time; the first read is issued in WRITE).
+        drain_fsm.act("UNERASE",
+            erased_rw.dat_w.eq(erased_rw.dat_r & ~(1 << (emulator.drain_addr + drain_blk)[:5])[:32]),
+            erased_rw.we.eq(1),
+            NextValue(drain_blk, drain_blk + 1),
+            If(drain_blk == (emulator.drain_count - 1),
+                NextState("DONE")
+            ).Else(
+                NextState("UNERASE_READ")
+            )
+        )
+        drain_fsm.act("UNERASE_READ",
+            NextState("UNERASE")
+        )
+        drain_fsm.act("DONE",
+            emulator.drain_done.eq(1),
+            If(~emulator.drain_req,
+                NextState("IDLE")
+            )
+        )
+        self.comb += [
+            drain_next.eq(drain_cnt + drain_ack),
+            drain_port.adr.eq(Cat(drain_next[:7], (emulator.drain_slot + drain_next[7:])[:slot_bits])),
+        ]
+
+        # Erase: set the bits of erase_start..erase_end ------------------------------------------
+        # One word per read-modify-write, the first and last words are masked to the range. A
+        # range covering the whole region (or more) sets every bit.
+        erase_diff  = Signal(33)
+        erase_all   = Signal()
+        erase_word  = Signal(block_bits - 5)
+        erase_cnt   = Signal(block_bits - 4)
+        erase_first = Signal()
+        erase_lo    = Signal(5)
+        erase_hi    = Signal(5)
+        erase_mask  = Signal(32)
+        self.comb += [
+            erase_diff.eq(emulator.erase_end - emulator.erase_start),
+            erase_lo.eq(Mux(erase_first & ~erase_all, emulator.erase_start[:5], 0)),
+            erase_hi.eq(Mux((erase_cnt == 0) & ~erase_all, emulator.erase_end[:5], 31)),
+            erase_mask.eq((2**32 - 1 << erase_lo)[:32] & (2**32 - 1 >> ~erase_hi)),
+        ]
+
+        self.submodules.erase_fsm = erase_fsm = FSM(reset_state="IDLE")
+        erase_fsm.act("IDLE",
+            NextValue(erase_first, 1),
+            NextValue(erase_all, erase_diff >= size//512),
+            If(erase_diff >= size//512,
+                NextValue(erase_word, 0),
+                NextValue(erase_cnt,  size//512//32 - 1),
+            ).Else(
+                NextValue(erase_word, emulator.erase_start[5:block_bits]),
+                NextValue(erase_cnt,  emulator.erase_end[5:] - emulator.erase_start[5:]),
+            ),
+            If(emulator.erase_req & drain_fsm.ongoing("IDLE"),
+                # end < start: nothing to erase.
+                If(erase_diff[32],
+                    NextState("DONE")
+                ).Else(
+                    NextState("READ")
+                )
+            )
+        )
+        erase_fsm.act("READ",
+            NextState("WRITE")
+        )
+        erase_fsm.act("WRITE",
+            erased_rw.dat_w.eq(erased_rw.dat_r | erase_mask),
+            erased_rw.we.eq(1),
+            NextValue(erase_first, 0),
+            NextValue(erase_word, erase_word + 1),
+            NextValue(erase_cnt,  erase_cnt - 1),
+            If(erase_cnt == 0,
+                NextState("DONE")
+            ).Else(
+                NextState("READ")
+            )
+        )
+        erase_fsm.act("DONE",
+            emulator.erase_done.eq(1),
+            If(~emulator.erase_req,
+                NextState("IDLE")
+            )
+        )
+        self.comb += erased_rw.adr.eq(Mux(erase_fsm.ongoing("IDLE"),
+            (emulator.drain_addr + drain_blk)[5:block_bits], erase_word))
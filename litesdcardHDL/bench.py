@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+
+# SPDX-License-Identifier: BSD-2-Clause
+
+# SDEmulator throughput/latency benchmarks.
+#
+# The SDEmulator is converted to Verilog and simulated with the sd_phy/sd_link sources under
+# Icarus Verilog through cocotb, the SDHostBFM plays the host. The fill/drain/erase interfaces
+# are served from a disk image by ImageBacking, with a fixed access latency standing in for the
+# DRAM, so the measures include the backing round-trips. Each variant (High Speed support on/off)
+# is a separate build; both bus widths are measured on each. Results are written as JSON so runs
+# can be compared across changes.
+
+import os
+import json
+import argparse
+import tempfile
+
+from migen import *
+from migen.fhdl.verilog import convert
+
+from core import SDEmulator
+from sim import SimPlatform, DiskImage
+
+
+# Benchmarks (cocotb side) -------------------------------------------------------------------------
+
+try:
+    import cocotb
+    from cocotb.clock import Clock
+    from cocotb.triggers import Timer, RisingEdge, FallingEdge, ClockCycles
+    from cocotb.utils import get_sim_time
+
+    from host import SDHostBFM
+except ImportError:
+    cocotb = None
+
+NUM_BLOCKS     = 4
+SYS_CLK_PERIOD = 20 # ns
+
+def _throughput(nbytes, clocks, clk_period):
+    # MB/s over the SD clocks spent on the transfer (commands included).
+    return nbytes/(clocks*clk_period*1e-9)/1e6
+
+def _stats(samples):
+    return {"min": min(samples), "mean": sum(samples)/len(samples), "max": max(samples)}
+
+class ImageBacking:
+    """Serves the fill/drain/erase requests of the emulator from a DiskImage, latency sys clocks
+       after each request (DRAM access), then one 32-bit word per sys clock through the ring
+       memory ports. The sys clocks from seeing a request to its release are collected in
+       fill_cycles/drain_cycles."""
+    def __init__(self, dut, image, latency):
+        self.dut          = dut
+        self.image        = image
+        self.latency      = latency
+        self.fill_cycles  = []
+        self.drain_cycles = []
+
+    def start(self):
+        cocotb.start_soon(self._fill())
+        cocotb.start_soon(self._drain())
+        cocotb.start_soon(self._erase())
+
+    async def _handshake_done(self, req, done, start, cycles):
+        done.value = 1
+        while int(req.value):
+            await RisingEdge(self.dut.sys_clk)
+        done.value = 0
+        cycles.append(round((get_sim_time("ns") - start)/SYS_CLK_PERIOD))
+
+    async def _fill(self):
+        dut = self.dut
+        dut.fill_done.value = 0
+        dut.fill_we.value   = 0
+        while True:
+            await FallingEdge(dut.sys_clk)
+            if not int(dut.fill_req.value):
+                continue
+            start = get_sim_time("ns")
+            slot  = int(dut.fill_slot.value)
+            block = self.image.block(int(dut.fill_addr.value)) or bytes(512)
+            await ClockCycles(dut.sys_clk, self.latency, rising=False)
+            for i in range(512//4):
+                dut.fill_adr.value   = slot*512//4 + i
+                dut.fill_dat_w.value = int.from_bytes(block[4*i:4*(i + 1)], "big")
+                dut.fill_we.value    = 1
+                await FallingEdge(dut.sys_clk)
+            dut.fill_we.value = 0
+            await self._handshake_done(dut.fill_req, dut.fill_done, start, self.fill_cycles)
+
+    async def _drain(self):
+        dut = self.dut
+        dut.drain_done.value = 0
+        while True:
+            await FallingEdge(dut.sys_clk)
+            if not int(dut.drain_req.value):
+                continue
+            start = get_sim_time("ns")
+            slot  = int(dut.drain_slot.value)
+            addr  = int(dut.drain_addr.value)
+            count = int(dut.drain_count.value)
+            await ClockCycles(dut.sys_clk, self.latency, rising=False)
+            for n in range(count):
+                block = self.image.block(addr + n)
+                base  = ((slot + n) % NUM_BLOCKS)*512//4
+                for i in range(512//4):
+                    # Synchronous read port: data is out one clock after the address.
+                    dut.drain_adr.value = base + i
+                    await FallingEdge(dut.sys_clk)
+                    if block is not None:
+                        block[4*i:4*(i + 1)] = int(dut.drain_dat_r.value).to_bytes(4, "big")
+            await self._handshake_done(dut.drain_req, dut.drain_done, start, self.drain_cycles)
+
+    async def _erase(self):
+        dut = self.dut
+        dut.erase_done.value = 0
+        while True:
+            await FallingEdge(dut.sys_clk)
+            if not int(dut.erase_req.value):
+                continue
+            start = get_sim_time("ns")
+            first = int(dut.erase_start.value)
+            last  = min(int(dut.erase_end.value), self.image.nblocks - 1)
+            await ClockCycles(dut.sys_clk, self.latency, rising=False)
+            for n in range(first, last + 1):
+                self.image.block(n)[:] = bytes(512)
+            await self._handshake_done(dut.erase_req, dut.erase_done, start, [])
+
+async def _measure(dut, backing, width, high_speed, iterations, nblocks):
+    bfm = SDHostBFM(dut)
+    await bfm.init(width=width, high_speed=high_speed)
+    result = {"width": width, "high_speed": high_speed, "clk_period_ns": bfm.clk_period}
+    backing.fill_cycles.clear()
+    backing.drain_cycles.clear()
+
+    # Command latency (CMD13, clocks from end bit to response start bit).
+    latencies = []
+    for _ in range(iterations):
+        _, latency = await bfm.command(13, bfm.rca << 16)
+        latencies.append(latency)
+    result["cmd13_latency_clocks"] = _stats(latencies)
+
+    def throughput(start, nbytes):
+        return _throughput(nbytes, bfm.clocks - start, bfm.clk_period)
+
+    def check(data, addr):
+        expected = b"".join(bytes(backing.image.block(addr + n) or bytes(512)) for n in range(len(data)//512))
+        assert data == expected, f"read at block {addr} does not match the image"
+
+    start     = bfm.clocks
+    latencies = []
+    for i in range(iterations):
+        data, _, data_latency = await bfm.read_blocks(i, 1)
+        check(data, i)
+        latencies.append(data_latency)
+    result["cmd17_mbps"] = throughput(start, 512*iterations)
+    result["cmd17_data_latency_clocks"] = _stats(latencies)
+
+    start = bfm.clocks
+    data, _, _ = await bfm.read_blocks(0, nblocks)
+    result["cmd18_mbps"] = throughput(start, 512*nblocks)
+    check(data, 0)
+
+    block = bytes(range(256))*2
+    start = bfm.clocks
+    for i in range(iterations):
+        await bfm.write_blocks(i, block)
+    result["cmd24_mbps"] = throughput(start, 512*iterations)
+
+    start = bfm.clocks
+    await bfm.write_blocks(0, block*nblocks)
+    result["cmd25_mbps"] = throughput(start, 512*nblocks)
+
+    # Backing round-trips (sys clocks from request to release).
+    result["fill_sys_cycles"]  = _stats(backing.fill_cycles)
+    if backing.drain_cycles:
+        result["drain_sys_cycles"] = _stats(backing.drain_cycles)
+    return result
+
+if cocotb is not None:
+    @cocotb.test()
+    async def benchmark(dut):
+        high_speed = bool(int(os.environ["SDBENCH_HS"]))
+        iterations = int(os.environ.get("SDBENCH_ITERATIONS", "4"))
+        nblocks    = int(os.environ.get("SDBENCH_BLOCKS", "8"))
+        latency    = int(os.environ.get("SDBENCH_LATENCY", "16"))
+        image      = DiskImage(os.environ["SDBENCH_IMAGE"])
+
+        cocotb.start_soon(Clock(dut.sys_clk, SYS_CLK_PERIOD, units="ns").start())
+        backing = ImageBacking(dut, image, latency)
+        backing.start()
+        dut.sys_rst.value = 1
+        await Timer(200, units="ns")
+        dut.sys_rst.value = 0
+
+        results = []
+        for width in (1, 4):
+            results.append(await _measure(dut, backing, width, high_speed, iterations, nblocks))
+            # Next width restarts from a reset card.
+            dut.sys_rst.value = 1
+            await Timer(200, units="ns")
+            dut.sys_rst.value = 0
+        with open(os.environ["SDBENCH_JSON"], "w") as f:
+            json.dump(results, f)
+        image.close()
+
+# Build/Run ----------------------------------------------------------------------------------------
+
+def build_top(build_dir, enable_hs):
+    platform = SimPlatform()
+    emulator = SDEmulator(platform, num_blocks=NUM_BLOCKS, enable_hs=enable_hs)
+    emulator.backed = True
+    pads     = emulator.pads
+    ios      = set()
+    for name in ["clk", "cmd_i", "cmd_o", "cmd_t", "dat_i", "dat_o", "dat_t"]:
+        sig = getattr(pads, name)
+        sig.name_override = "sd_" + name
+        ios.add(sig)
+    # Backing side, served by ImageBacking.
+    backing = {
+        "fill_adr"    : emulator.fill_port.adr,
+        "fill_dat_w"  : emulator.fill_port.dat_w,
+        "fill_we"     : emulator.fill_port.we,
+        "drain_adr"   : emulator.drain_port.adr,
+        "drain_dat_r" : emulator.drain_port.dat_r,
+    }
+    for name in ["fill_req", "fill_addr", "fill_slot", "fill_done",
+                 "drain_req", "drain_addr", "drain_slot", "drain_count", "drain_done",
+                 "erase_req", "erase_start", "erase_end", "erase_done"]:
+        backing[name] = getattr(emulator, name)
+    for name, sig in backing.items():
+        sig.name_override = name
+        ios.add(sig)
+    top = os.path.join(build_dir, "sdemulator.v")
+    output = convert(emulator, ios=ios, name="sdemulator")
+    # ConvOutput.write() puts the memory init files ($readmemh) in the cwd: keep them next to the
+    # top in build_dir, where the simulator runs.
+    with open(top, "w") as f:
+        f.write(output.main_source)
+    for filename, content in output.data_files.items():
+        with open(os.path.join(build_dir, filename), "w") as f:
+            f.write(content)
+    return [top] + platform.sources, platform.include_paths
+
+def make_image(filename, nblocks):
+    # Random payload, so reads served from the wrong block are caught.
+    with open(filename, "wb") as f:
+        f.write(os.urandom(512*nblocks))
+
+def run(build_dir, enable_hs, iterations, nblocks, image, latency):
+    from cocotb.runner import get_runner
+    sources, includes = build_top(build_dir, enable_hs)
+    runner = get_runner("icarus")
+    runner.build(
+        verilog_sources = sources,
+        includes        = includes,
+        hdl_toplevel    = "sdemulator",
+        build_dir       = build_dir,
+        timescale       = ("1ns", "1ps"),
+    )
+    json_file = os.path.join(build_dir, "results.json")
+    runner.test(
+        hdl_toplevel = "sdemulator",
+        test_module  = "bench",
+        build_dir    = build_dir,
+        extra_env    = {
+            "SDBENCH_HS"         : str(int(enable_hs)),
+            "SDBENCH_JSON"       : json_file,
+            "SDBENCH_ITERATIONS" : str(iterations),
+            "SDBENCH_BLOCKS"     : str(nblocks),
+            "SDBENCH_IMAGE"      : os.path.abspath(image),
+            "SDBENCH_LATENCY"    : str(latency),
+        },
+    )
+    with open(json_file) as f:
+        return json.load(f)
+
+def main():
+    parser = argparse.ArgumentParser(description="SDEmulator throughput/latency benchmarks.")
+    parser.add_argument("--output",     default=None,          help="JSON output file (default: stdout).")
+    parser.add_argument("--iterations", default=4, type=int,   help="Single-block commands per measure.")
+    parser.add_argument("--blocks",     default=8, type=int,   help="Blocks per CMD18/CMD25.")
+    parser.add_argument("--image",      default=None,          help="Disk image backing the card, the write measures modify it (default: random image).")
+    parser.add_argument("--latency",    default=16, type=int,  help="Backing access latency in sys clocks.")
+    args = parser.parse_args()
+
+    results = []
+    for enable_hs in [False, True]:
+        build_dir = tempfile.mkdtemp(prefix="sdbench_")
+        image     = args.image
+        if image is None:
+            image = os.path.join(build_dir, "sd.img")
+            make_image(image, max(args.iterations, args.blocks))
+        for result in run(build_dir, enable_hs, args.iterations, args.blocks, image, args.latency):
+            results.append(result)
+
+    report = json.dumps(results, indent=2)
+    if args.output is None:
+        print(report)
+    else:
+        with open(args.output, "w") as f:
+            f.write(report)
+
+if __name__ == "__main__":
+    main()
@@ -5,6 +5,7 @@
 import os
 
 from migen import *
+from migen.genlib.cdc import MultiReg
 
 
 def _sdemulator_pads():
@@ -29,18 +30,61 @@ def _sdemulator_pads():
 class SDEmulator(Module):
     """This is a Migen wrapper around the lower-level parts of the SD card emulator
        from Google Project Vault's Open Reference Platform. This core still does all
-       SD card command processing in hardware, integrating a 512-bytes block buffer.
+       SD card command processing in hardware, integrating a ring of 512-bytes block
+       buffers for each direction.
+
+       num_blocks sets the depth of the rings (power of two). The backing side fills
+       read slots through the fill_* interface and drains written slots through the
+       drain_* interface, so block k+1 can be fetched while block k is still being
+       clocked out (and the other way around for writes). When nothing is attached
+       the read ring serves the init pattern and written blocks are dropped.
+
+       Written blocks are written back in runs of consecutive addresses (drain_count
+       blocks per drain): during a CMD25 the ring gathers drain_burst blocks (default
+       half the ring) before draining them, and the rest is flushed as soon as the
+       write stops (CMD12, last block, CMD24).
+
+       enable_hs advertises High Speed support in the CMD6 function caps.
+
+       Erases (CMD32/CMD33/CMD38) are passed to the backing side through the erase_*
+       interface, ordered after the writes received before them; reads are held until
+       the erase has been applied.
+
+       clock_domain is the core clock of sd_phy/sd_link and of the rings control (clk_50 in
+       the original design). It can be faster than sys; the fill_*/drain_* interfaces and
+       the backing side memory ports always stay in sys, the fill/drain/erase req/done handshakes are
+       resynchronized (4-phase: done is held until req drops).
        """
-    def  __init__(self, platform):
+    def  __init__(self, platform, num_blocks=4, enable_hs=True, clock_domain="sys", drain_burst=None):
+        assert num_blocks >= 2 and (num_blocks & (num_blocks - 1)) == 0
+        if drain_burst is None:
+            drain_burst = max(num_blocks//2, 1)
+        assert 1 <= drain_burst <= num_blocks - 1
+        self.num_blocks   = num_blocks
+        self.clock_domain = clock_domain
+        self.backed       = False
+        slot_bits         = log2_int(num_blocks)
+        sync              = getattr(self.sync, clock_domain)
+
         self.pads = pads = _sdemulator_pads()
 
         # The external SD clock drives a separate clock domain
         self.clock_domains.cd_sd_ll = ClockDomain(reset_less=True)
         self.comb += self.cd_sd_ll.clk.eq(pads.clk)
 
-        self.specials.buffer = Memory(32, 512//4, init=[i for i in range(512//4)])
-        self.specials.internal_rd_port = self.buffer.get_port(clock_domain="sd_ll")
-        self.specials.internal_wr_port = self.buffer.get_port(write_capable=True, clock_domain="sd_ll")
+        # Block rings: one 512-bytes slot per block, PHY reads from rd_buffer and writes to wr_buffer
+        self.specials.rd_buffer = Memory(32, num_blocks*512//4, init=[i for i in range(512//4)]*num_blocks)
+        self.specials.wr_buffer = Memory(32, num_blocks*512//4)
+        self.specials.internal_rd_port = self.rd_buffer.get_port(clock_domain="sd_ll")
+        self.specials.internal_wr_port = self.wr_buffer.get_port(write_capable=True, clock_domain="sd_ll")
+
+        # Backing side of the rings (sys domain), word address is {slot, word}
+        self.specials.fill_port  = self.rd_buffer.get_port(write_capable=True)
+        self.specials.drain_port = self.wr_buffer.get_port()
+
+        # Word address inside the current slot, driven by the PHY
+        self.phy_rd_adr = Signal(7)
+        self.phy_wr_adr = Signal(7)
 
         # Communication between PHY and Link layers
         self.card_state       = Signal(4) # Where does this connect to?
@@ -153,6 +197,8 @@ class SDEmulator(Module):
                                      #  Output of SD_PHY
         self.link_state  = Signal(7) # Where does this connect to?
                                      #  Output of SD_LINK
+        self.link_erase_state = Signal(3) # Erase sequence: 1 after CMD32, 2 after CMD33
+                                          #  Output of SD_LINK
         self.link_ddc    = Signal(16) # Where does this connect to?
                                       #  Output of SD_LINK
         self.link_dc     = Signal(16) # Where does this connect to?
@@ -193,8 +239,8 @@ class SDEmulator(Module):
                                          # Also some combinational
 
         self.specials += Instance("sd_phy",
-            i_clk_50           = ClockSignal(),
-            i_reset_n          = ~ResetSignal(),
+            i_clk_50           = ClockSignal(clock_domain),
+            i_reset_n          = ~ResetSignal(clock_domain),
             i_sd_clk           = ClockSignal("sd_ll"),
             i_sd_cmd_i         = pads.cmd_i, # cmd_i is input to PHY
             o_sd_cmd_o         = pads.cmd_o, # cmd_o is output of PHY
@@ -228,9 +274,9 @@ class SDEmulator(Module):
             i_data_out_act     = self.data_out_act, # data_out_act is input to PHY
             i_data_out_stop    = self.data_out_stop, # data_out_stop is input to PHY
             o_data_out_done    = self.data_out_done, # data_out_done is output of PHY
-            o_bram_rd_sd_addr  = self.internal_rd_port.adr,
+            o_bram_rd_sd_addr  = self.phy_rd_adr,
             i_bram_rd_sd_q     = self.internal_rd_port.dat_r,
-            o_bram_wr_sd_addr  = self.internal_wr_port.adr,
+            o_bram_wr_sd_addr  = self.phy_wr_adr,
             o_bram_wr_sd_wren  = self.internal_wr_port.we,
             o_bram_wr_sd_data  = self.internal_wr_port.dat_w,
             i_bram_wr_sd_q     = self.internal_wr_port.dat_r,
@@ -242,8 +288,8 @@ class SDEmulator(Module):
         )
 
         self.specials += Instance("sd_link",
-            i_clk_50               = ClockSignal(),
-            i_reset_n              = ~ResetSignal(),
+            i_clk_50               = ClockSignal(clock_domain),
+            i_reset_n              = ~ResetSignal(clock_domain),
             o_link_card_state      = self.card_state, # Card State is also output of SD_LINK
             i_phy_cmd_in           = self.cmd_in, # cmd_in is input to SD_LINK
             i_phy_cmd_in_crc_good  = self.cmd_in_crc_good, # cmd_in_crc_good is input to SD_LINK
@@ -284,7 +330,7 @@ class SDEmulator(Module):
             o_block_preerase_num   = self.block_preerase_num, # block_preerase_num is output of SD_LINK
             o_block_erase_start    = self.block_erase_start, # block_erase_start is output of SD_LINK
             o_block_erase_end      = self.block_erase_end, # block_erase_end is output of SD_LINK
-            i_opt_enable_hs        = 1,
+            i_opt_enable_hs        = enable_hs,
             o_cmd_in_last          = self.cmd_in_last, # cmd_in_last is output of SD_LINK
             o_info_card_desel      = self.info_card_desel, # info_card_desel is output of SD_LINK
             o_err_unhandled_cmd    = self.err_unhandled_cmd, # err_unhandled_cmd is output of SD_LINK
@@ -293,17 +339,254 @@ class SDEmulator(Module):
             o_host_hc_support      = self.host_hc_support, # host_hc_support is output of SD_LINK
             o_card_status          = self.card_status, # card_status is output of SD_LINK
             o_state                = self.link_state, # link_state is output of SD_LINK
+            o_link_erase_state     = self.link_erase_state, # link_erase_state is output of SD_LINK
             o_dc                   = self.link_dc, # link_dc is output of SD_LINK
             o_ddc                  = self.link_ddc # link_ddc is output of SD_LINK
         )
 
-        # Send block data when receiving read_act.
-        self.comb += self.block_read_go.eq(self.block_read_act) # block_read_act is also comb.
+        # Write ring -----------------------------------------------------------------------------
+        # The PHY always receives into wr_head, so that slot is kept free: a block is only acked
+        # to the link when committing it leaves another free slot behind it.
+        self.drain_req   = Signal()                  # Output: written blocks are waiting from drain_slot
+        self.drain_addr  = Signal(32)                # Output: block address of drain_slot
+        self.drain_slot  = Signal(slot_bits)         # Output: first ring slot to drain (drain_port.adr[7:])
+        self.drain_count = Signal(max=num_blocks)    # Output: consecutive blocks to drain (slots wrap)
+        self.drain_done  = Signal()                  # Input: the drain_count blocks have been persisted
+        drain_req  = Signal()
+        drain_done = Signal()
+
+        self.wr_level = wr_level = Signal(max=num_blocks + 1)
+        wr_head  = Signal(slot_bits)
+        wr_tail  = Signal(slot_bits)
+        wr_addrs = Array(Signal(32) for _ in range(num_blocks))
+        wr_push  = Signal()
+        wr_pop   = Signal()
+
+        # Erase: sd_link answers CMD38 without busy, catch the R1b response of an accepted
+        # CMD38 (sent after CMD32/CMD33) and latch its range. Blocks written before it are drained
+        # first, those written after it wait for the erase.
+        self.erase_req   = Signal()   # Output: erase blocks erase_start..erase_end
+        self.erase_start = Signal(32) # Output: first erased block
+        self.erase_end   = Signal(32) # Output: last erased block (inclusive)
+        self.erase_done  = Signal()   # Input: erase has been applied
+        erase_req  = Signal()
+        erase_done = Signal()
+
+        erase_armed   = Signal() # CMD32 and CMD33 preceded the command being parsed
+        erase_cmd     = Signal()
+        erase_cmd_d   = Signal()
+        erase_event   = Signal()
+        erase_pending = Signal()
+        erase_wait    = Signal(max=num_blocks + 1) # Written blocks to drain before the erase
+        erase_again   = Signal()                   # CMD38 received while an erase was in flight
+        self.comb += [
+            erase_cmd.eq(
+                (self.link_state  == 11) & # ST_CMD_RESP_2
+                (self.cmd_in_cmd  == 38) & # CMD38_ERASE
+                (self.resp_type   == 8)  & # RESP_R1B
+                erase_armed
+            ),
+            erase_event.eq(erase_cmd & ~erase_cmd_d),
+        ]
+        sync += [
+            # sd_link resets its erase state while parsing the command (ST_CMD_ACT), sample it then.
+            # STAT_ERASE_SEQ_ERROR can't be used: it stays set until a CMD13 reads it.
+            If(self.link_state == 8,
+                erase_armed.eq(self.link_erase_state == 2)
+            ),
+            erase_cmd_d.eq(erase_cmd),
+            If(erase_req & erase_done,
+                erase_req.eq(0),
+                erase_pending.eq(0),
+            ).Elif(erase_pending & ~erase_done & (erase_wait == 0),
+                erase_req.eq(1)
+            ),
+            If(erase_pending & wr_pop,
+                erase_wait.eq(erase_wait - self.drain_count)
+            ),
+            # start/end are held until the erase is done, a CMD38 arriving meanwhile is replayed
+            # from the link registers afterwards.
+            If((erase_event & ~erase_pending) | (erase_again & ~erase_pending & ~erase_done),
+                erase_pending.eq(1),
+                erase_again.eq(0),
+                erase_wait.eq(wr_level - Mux(wr_pop, self.drain_count, 0)),
+                self.erase_start.eq(self.block_erase_start),
+                self.erase_end.eq(self.block_erase_end),
+            ).Elif(erase_event,
+                erase_again.eq(1)
+            ),
+        ]
 
-        # Ack block write when receiving write_act.
-        self.comb += self.block_write_done.eq(self.block_write_act) 
+        # Write-back: wr_run is the number of blocks from wr_tail with consecutive addresses (not
+        # crossing a pending erase). Draining waits for drain_burst of them while a CMD25 is
+        # streaming (card in RCV/PRG, no CMD12 yet), otherwise the run is drained right away.
+        wr_run       = Signal(max=num_blocks)
+        wr_streaming = Signal()
+        wr_drain     = Signal()
+        wr_contig    = [Signal() for _ in range(num_blocks - 1)]
+        for k in range(num_blocks - 1):
+            self.comb += wr_contig[k].eq(
+                (wr_level > k) &
+                ~(erase_pending & (erase_wait <= k)) &
+                (wr_addrs[(wr_tail + k)[:slot_bits]] == wr_addrs[wr_tail] + k) &
+                (wr_contig[k - 1] if k else 1)
+            )
+            self.comb += If(wr_contig[k], wr_run.eq(k + 1))
+        self.comb += [
+            wr_streaming.eq(
+                (self.block_write_num > 1) &
+                ((self.card_state == 6) | (self.card_state == 7)) & # CARD_RCV/CARD_PRG
+                ~self.data_in_stop
+            ),
+            wr_drain.eq((wr_run != 0) & (
+                (wr_run >= drain_burst) |
+                (wr_run != wr_level)    | # Run broken by another address or a pending erase
+                ~wr_streaming
+            )),
+        ]
+
+        self.comb += [
+            self.internal_wr_port.adr.eq(Cat(self.phy_wr_adr, wr_head)),
+            wr_push.eq(self.block_write_act & ~self.block_write_done & (wr_level < num_blocks - 1)),
+            wr_pop.eq(drain_req & drain_done),
+            self.drain_addr.eq(wr_addrs[wr_tail]),
+            self.drain_slot.eq(wr_tail),
+        ]
+        sync += [
+            If(wr_push,
+                wr_addrs[wr_head].eq(self.block_write_addr),
+                wr_head.eq(wr_head + 1),
+            ),
+            If(wr_pop, wr_tail.eq(wr_tail + self.drain_count)),
+            If( wr_push & ~wr_pop, wr_level.eq(wr_level + 1)),
+            If(~wr_push &  wr_pop, wr_level.eq(wr_level - self.drain_count)),
+            If( wr_push &  wr_pop, wr_level.eq(wr_level + 1 - self.drain_count)),
+
+            # Ack block write once committed, hold it until the link drops write_act.
+            If(wr_push,
+                self.block_write_done.eq(1)
+            ).Elif(~self.block_write_act,
+                self.block_write_done.eq(0)
+            ),
+
+            # drain_count is held while drain_req is high.
+            If(wr_pop,
+                drain_req.eq(0)
+            ).Elif(~drain_req & ~drain_done & wr_drain,
+                drain_req.eq(1),
+                self.drain_count.eq(wr_run),
+            ),
+        ]
+
+        # Read ring ------------------------------------------------------------------------------
+        # The backing side prefetches consecutive blocks from rd_next_addr into rd_head while the
+        # PHY sends from rd_tail, never past the block_read_num blocks of the current command
+        # (1 for CMD17, unbounded for CMD18). A request for another address (or any block
+        # write or erase, to keep the ring coherent) flushes the ring and restarts prefetching
+        # at block_read_addr.
+        self.fill_req  = Signal()          # Output: request a fill of fill_slot
+        self.fill_addr = Signal(32)        # Output: block address to fetch
+        self.fill_slot = Signal(slot_bits) # Output: ring slot to fill (fill_port.adr[7:])
+        self.fill_done = Signal()          # Input: fill_slot has been written
+        fill_req  = Signal()
+        fill_done = Signal()
+
+        self.rd_level = rd_level = Signal(max=num_blocks + 1)
+        rd_head      = Signal(slot_bits)
+        rd_tail      = Signal(slot_bits)
+        rd_tail_addr = Signal(32) # Block address held in rd_tail
+        rd_next_addr = Signal(32) # Next block address to prefetch
+        rd_remaining = Signal(32) # Blocks left to prefetch for the current command (block_read_num)
+        rd_flush     = Signal()
+        rd_miss      = Signal()
+        rd_push      = Signal()
+        rd_pop       = Signal()
+
+        self.comb += [
+            self.internal_rd_port.adr.eq(Cat(self.phy_rd_adr, rd_tail)),
+            rd_miss.eq(self.block_read_act & ~self.block_read_go & (self.block_read_addr != rd_tail_addr)),
+            rd_push.eq(fill_req & fill_done),
+            rd_pop.eq(self.block_read_go & self.block_read_stop),
+            self.fill_addr.eq(rd_next_addr),
+            self.fill_slot.eq(rd_head),
+        ]
+        sync += [
+            If(rd_push,
+                rd_head.eq(rd_head + 1),
+                rd_next_addr.eq(rd_next_addr + 1),
+                rd_remaining.eq(rd_remaining - 1),
+            ),
+            # Next command continues where the previous one stopped (e.g. a streak of CMD17s):
+            # keep the ring, just re-arm prefetch with its block count.
+            If(self.block_read_act & ~rd_miss & ~rd_flush & ~fill_req & (rd_level == 0) & (rd_remaining == 0),
+                rd_remaining.eq(self.block_read_num)
+            ),
+            If(rd_pop,
+                rd_tail.eq(rd_tail + 1),
+                rd_tail_addr.eq(rd_tail_addr + 1),
+            ),
+            If( rd_push & ~rd_pop, rd_level.eq(rd_level + 1)),
+            If(~rd_push &  rd_pop, rd_level.eq(rd_level - 1)),
+
+            # Send block data when the requested block is at the tail of the ring.
+            If(rd_pop,
+                self.block_read_go.eq(0)
+            ).Elif(self.block_read_act & ~rd_miss & ~rd_flush & (rd_level != 0),
+                self.block_read_go.eq(1)
+            ),
+
+            # Blocks still in the write ring are not in backing storage yet, hold fills until drained
+            # (and until a pending erase is applied).
+            If(rd_push,
+                fill_req.eq(0)
+            ).Elif(~fill_req & ~fill_done & ~rd_flush & (rd_level != num_blocks) & (rd_remaining != 0) &
+                (wr_level == 0) & ~erase_pending,
+                fill_req.eq(1)
+            ),
+
+            If(rd_flush & ~fill_req & ~self.block_read_go & ~wr_push,
+                rd_flush.eq(0),
+                rd_head.eq(rd_tail),
+                rd_level.eq(0),
+                rd_tail_addr.eq(self.block_read_addr),
+                rd_next_addr.eq(self.block_read_addr),
+                rd_remaining.eq(Mux(self.block_read_act, self.block_read_num, 0)),
+            ).Elif(rd_miss | wr_push | erase_event,
+                rd_flush.eq(1)
+            ),
+        ]
+
+        # Backing side handshakes -----------------------------------------------------------------
+        if clock_domain == "sys":
+            self.comb += [
+                self.fill_req.eq(fill_req),
+                fill_done.eq(self.fill_done),
+                self.drain_req.eq(drain_req),
+                drain_done.eq(self.drain_done),
+                self.erase_req.eq(erase_req),
+                erase_done.eq(self.erase_done),
+            ]
+        else:
+            # addr/slot/start/end are held while req is high.
+            self.specials += [
+                MultiReg(fill_req,        self.fill_req,  "sys"),
+                MultiReg(self.fill_done,  fill_done,      clock_domain),
+                MultiReg(drain_req,       self.drain_req, "sys"),
+                MultiReg(self.drain_done, drain_done,     clock_domain),
+                MultiReg(erase_req,       self.erase_req, "sys"),
+                MultiReg(self.erase_done, erase_done,     clock_domain),
+            ]
 
         # Verilog sources from ProjectVault ORP
-        vdir = os.path.join(os.path.abspath(os.path.dirname(__file__)), "verilog")
+        vdir = os.path.abspath(os.path.dirname(__file__))
         platform.add_verilog_include_path(vdir)
         platform.add_sources(vdir, "sd_common.v", "sd_link.v", "sd_phy.v")
+
+    def do_finalize(self):
+        # Without backing storage, serve the init pattern and drop written blocks and erases.
+        if not self.backed:
+            self.comb += [
+                self.fill_done.eq(self.fill_req),
+                self.drain_done.eq(self.drain_req),
+                self.erase_done.eq(self.erase_req),
+            ]
@@ -0,0 +1,186 @@
+# SPDX-License-Identifier: BSD-2-Clause
+
+from migen import *
+from migen.genlib.cdc import MultiReg, PulseSynchronizer, BusSynchronizer
+
+from litex.gen import *
+
+from litex.soc.interconnect.csr import *
+
+
+class SDEmulatorCounters(LiteXModule):
+    """Performance counters for an SDEmulator.
+
+       Counts host commands per opcode, blocks read/written, PHY busy cycles and link stall
+       cycles for each direction, command CRC errors and illegal/unhandled commands. Counters run
+       continuously; control.snapshot copies them all to the status registers at once (the
+       per-opcode table takes 64 cycles, see status.ready) and control.clear zeroes them.
+       The per-opcode counts are read through cmd_sel/cmd_count.
+
+       Counting runs in the emulator clock domain; control pulses are resynchronized to it and
+       the snapshot registers (static between snapshots) back to sys. cmd_count changes with
+       cmd_sel, so it goes back through a handshaked BusSynchronizer.
+       """
+    def __init__(self, emulator, width=32):
+        self.control = CSRStorage(fields=[
+            CSRField("snapshot", size=1, offset=0, pulse=True, description="Copy counters to status registers."),
+            CSRField("clear",    size=1, offset=1, pulse=True, description="Clear counters."),
+        ])
+        self.status = CSRStatus(fields=[
+            CSRField("ready", size=1, offset=0, description="Snapshot/clear done."),
+        ])
+        self.cmd_sel   = CSRStorage(6, description="Opcode read through cmd_count.")
+        self.cmd_count = CSRStatus(width, description="Snapshot of the commands received with opcode cmd_sel.")
+
+        # # #
+
+        cd   = emulator.clock_domain
+        sync = getattr(self.sync, cd)
+
+        # Control/status -------------------------------------------------------------------------
+        snapshot = Signal()
+        clear    = Signal()
+        cmd_sel  = Signal(6)
+        ready    = Signal()
+        if cd == "sys":
+            self.comb += [
+                snapshot.eq(self.control.fields.snapshot),
+                clear.eq(self.control.fields.clear),
+                cmd_sel.eq(self.cmd_sel.storage),
+                self.status.fields.ready.eq(ready),
+            ]
+        else:
+            self.snapshot_ps = PulseSynchronizer("sys", cd)
+            self.clear_ps    = PulseSynchronizer("sys", cd)
+            self.comb += [
+                self.snapshot_ps.i.eq(self.control.fields.snapshot),
+                snapshot.eq(self.snapshot_ps.o),
+                self.clear_ps.i.eq(self.control.fields.clear),
+                clear.eq(self.clear_ps.o),
+            ]
+            self.specials += [
+                MultiReg(self.cmd_sel.storage, cmd_sel, cd),
+                MultiReg(ready, self.status.fields.ready, "sys"),
+            ]
+
+        # Events -----------------------------------------------------------------------------------
+        # cmd_in/cmd_in_act/busy come from the sd_ll domain, resynchronize them like sd_link does.
+        cmd_in_act    = Signal()
+        cmd_in_act_d  = Signal()
+        cmd_crc_good  = Signal()
+        cmd_opcode    = Signal(6)
+        data_in_busy  = Signal()
+        data_out_busy = Signal()
+        unhandled_d   = Signal()
+        read_pop_d    = Signal()
+        write_push_d  = Signal()
+        self.specials += [
+            MultiReg(emulator.cmd_in_act,      cmd_in_act,    cd),
+            MultiReg(emulator.cmd_in_crc_good, cmd_crc_good,  cd),
+            MultiReg(emulator.cmd_in[40:46],   cmd_opcode,    cd),
+            MultiReg(emulator.data_in_busy,    data_in_busy,  cd),
+            MultiReg(emulator.data_out_busy,   data_out_busy, cd),
+        ]
+
+        cmd_event  = Signal()
+        read_pop   = Signal()
+        write_push = Signal()
+        self.comb += [
+            cmd_event.eq(cmd_in_act & ~cmd_in_act_d),
+            read_pop.eq(emulator.block_read_go & emulator.block_read_stop),
+            write_push.eq(emulator.block_write_act & emulator.block_write_done),
+        ]
+        sync += [
+            cmd_in_act_d.eq(cmd_in_act),
+            read_pop_d.eq(read_pop),
+            write_push_d.eq(write_push),
+            unhandled_d.eq(emulator.err_unhandled_cmd),
+        ]
+
+        # Scalar counters --------------------------------------------------------------------------
+        events = [
+            ("blocks_read",      read_pop & ~read_pop_d,       "Blocks sent to the host."),
+            ("blocks_written",   write_push & ~write_push_d,   "Blocks received from the host."),
+            ("read_busy",        data_out_busy,                "Cycles the PHY spent sending data."),
+            ("write_busy",       data_in_busy,                 "Cycles the PHY spent receiving data."),
+            ("read_stall",       emulator.block_read_act  & ~emulator.block_read_go,    "Cycles the link waited for a read block."),
+            ("write_stall",      emulator.block_write_act & ~emulator.block_write_done, "Cycles the link waited for a free write slot."),
+            ("cmd_crc_errors",   cmd_event & ~cmd_crc_good,    "Commands dropped on a bad CRC7."),
+            # sd_link raises err_unhandled_cmd on each unhandled command and clears it on the next one.
+            ("cmd_illegal",      emulator.err_unhandled_cmd & ~unhandled_d, "Illegal or unhandled commands."),
+        ]
+        for name, event, description in events:
+            count  = Signal(width)
+            copy   = Signal(width)
+            status = CSRStatus(width, name=name, description=description)
+            setattr(self, name, status)
+            sync += [
+                If(clear,
+                    count.eq(0)
+                ).Elif(event,
+                    count.eq(count + 1)
+                ),
+                If(snapshot,
+                    copy.eq(count)
+                )
+            ]
+            self.specials += MultiReg(copy, status.status, "sys")
+
+        # Per-opcode counters ----------------------------------------------------------------------
+        # Live table is incremented with a read-modify-write (commands are >48 SD clocks apart);
+        # snapshot/clear sweep the 64 entries.
+        live     = Memory(width, 64)
+        snap     = Memory(width, 64)
+        live_rw  = live.get_port(write_capable=True, clock_domain=cd)
+        live_rd  = live.get_port(clock_domain=cd)
+        snap_wr  = snap.get_port(write_capable=True, clock_domain=cd)
+        snap_rd  = snap.get_port(async_read=True, clock_domain=cd)
+        self.specials += live, snap, live_rw, live_rd, snap_wr, snap_rd
+
+        incr       = Signal()
+        sweep      = Signal(7, reset=64)
+        sweep_d    = Signal(6)
+        sweeping   = Signal()
+        sweeping_d = Signal()
+        copying    = Signal()
+        clearing   = Signal()
+        self.comb += sweeping.eq(~sweep[6])
+        sync += [
+            incr.eq(cmd_event & cmd_crc_good),
+            If(snapshot | clear,
+                sweep.eq(0),
+                copying.eq(snapshot),
+                clearing.eq(clear),
+            ).Elif(sweeping,
+                sweep.eq(sweep + 1)
+            ),
+            sweep_d.eq(sweep),
+            sweeping_d.eq(sweeping),
+        ]
+        self.comb += [
+            If(clearing & sweeping,
+                live_rw.adr.eq(sweep),
+                live_rw.we.eq(1),
+            ).Else(
+                live_rw.adr.eq(cmd_opcode),
+                live_rw.dat_w.eq(live_rw.dat_r + 1),
+                live_rw.we.eq(incr),
+            ),
+
+            # live_rd data is one cycle behind the sweep address.
+            live_rd.adr.eq(sweep),
+            snap_wr.adr.eq(sweep_d),
+            snap_wr.dat_w.eq(live_rd.dat_r),
+            snap_wr.we.eq(copying & sweeping_d),
+
+            snap_rd.adr.eq(cmd_sel),
+            ready.eq(~sweeping),
+        ]
+        if cd == "sys":
+            self.comb += self.cmd_count.status.eq(snap_rd.dat_r)
+        else:
+            self.cmd_count_sync = BusSynchronizer(width, cd, "sys")
+            self.comb += [
+                self.cmd_count_sync.i.eq(snap_rd.dat_r),
+                self.cmd_count.status.eq(self.cmd_count_sync.o),
+            ]
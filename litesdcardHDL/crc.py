@@ -0,0 +1,119 @@
+# SPDX-License-Identifier: BSD-2-Clause
+
+# CRC7/CRC16 reference models for SD bus verification.
+#
+# Table-driven and batched with NumPy: every function works on arrays whose last axis holds the
+# bytes of one frame/block, leading axes are processed in parallel (e.g. the 4 DAT lanes of many
+# blocks at once). Bit order matches sd_phy.v: MSB first, CRC16 per DAT line over the bits that
+# line carries.
+
+import numpy as np
+
+# Tables -------------------------------------------------------------------------------------------
+
+def _crc7_table():
+    # CRC7 (x^7 + x^3 + 1) kept left-aligned in 8 bits.
+    table = np.zeros(256, dtype=np.uint8)
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = ((crc << 1) ^ (0x12 if crc & 0x80 else 0)) & 0xff
+        table[i] = crc
+    return table
+
+def _crc16_table():
+    # CRC16-CCITT (x^16 + x^12 + x^5 + 1).
+    table = np.zeros(256, dtype=np.uint16)
+    for i in range(256):
+        crc = i << 8
+        for _ in range(8):
+            crc = ((crc << 1) ^ (0x1021 if crc & 0x8000 else 0)) & 0xffff
+        table[i] = crc
+    return table
+
+_CRC7  = _crc7_table()
+_CRC16 = _crc16_table()
+
+# CRC ----------------------------------------------------------------------------------------------
+
+def crc7(data):
+    """CRC7 over the last axis of a uint8 array, returns an array of the leading shape."""
+    data = np.asarray(data, dtype=np.uint8)
+    crc  = np.zeros(data.shape[:-1], dtype=np.uint8)
+    for i in range(data.shape[-1]):
+        crc = _CRC7[crc ^ data[..., i]]
+    return crc >> 1
+
+def crc16(data):
+    """CRC16 over the last axis of a uint8 array, returns an array of the leading shape."""
+    data = np.asarray(data, dtype=np.uint8)
+    crc  = np.zeros(data.shape[:-1], dtype=np.uint16)
+    for i in range(data.shape[-1]):
+        crc = (crc << 8) ^ _CRC16[(crc >> 8) ^ data[..., i]]
+    return crc
+
+def data_lanes(blocks, width=4):
+    """Splits blocks (..., nbytes) into the bytes each DAT line carries: (..., width, nbytes*8//width//8).
+
+       In 4-bit mode DAT3..DAT0 carry the high nibble then the low nibble of each byte, so line k
+       gets bits 4+k and k of every byte.
+       """
+    blocks = np.asarray(blocks, dtype=np.uint8)
+    if width == 1:
+        return blocks[..., np.newaxis, :]
+    lane = np.arange(4, dtype=np.uint8)
+    hi   = (blocks[..., np.newaxis] >> (lane + 4)) & 1
+    lo   = (blocks[..., np.newaxis] >> lane) & 1
+    bits = np.moveaxis(np.stack([hi, lo], axis=-1), -2, -3)
+    bits = bits.reshape(bits.shape[:-2] + (-1,))
+    return np.packbits(bits, axis=-1)
+
+def data_crc16(blocks, width=4):
+    """Per-line CRC16 of data blocks (..., nbytes), returns (..., width) indexed by DAT line."""
+    return crc16(data_lanes(blocks, width))
+
+# Frames -------------------------------------------------------------------------------------------
+
+def cmd_frames(index, arg):
+    """48-bit host command frames (start, direction, index, argument, CRC7, end) as uint64."""
+    index   = np.asarray(index, dtype=np.uint64)
+    arg     = np.asarray(arg,   dtype=np.uint64)
+    content = (np.uint64(0b01) << np.uint64(38)) | ((index & np.uint64(0x3f)) << np.uint64(32)) | arg
+    shifts  = np.arange(32, -8, -8, dtype=np.uint64)
+    crcs    = crc7(((content[..., np.newaxis] >> shifts) & np.uint64(0xff)).astype(np.uint8))
+    return (content << np.uint64(8)) | (crcs.astype(np.uint64) << np.uint64(1)) | np.uint64(1)
+
+def cmd_frame_crc_good(frames):
+    """Checks the CRC7 of 48-bit frames, as sd_phy does to raise cmd_in_crc_good."""
+    frames = np.asarray(frames, dtype=np.uint64)
+    shifts = np.arange(40, 0, -8, dtype=np.uint64)
+    crcs   = crc7(((frames[..., np.newaxis] >> shifts) & np.uint64(0xff)).astype(np.uint8))
+    return crcs == ((frames >> np.uint64(1)) & np.uint64(0x7f)).astype(np.uint8)
+
+# Corruption ---------------------------------------------------------------------------------------
+
+def _flip_positions(rng, nrows, low, high, nbits):
+    # nbits distinct bit positions in [low, high) per row, drawn without replacement so no flip
+    # cancels another one.
+    assert nbits <= high - low
+    return np.stack([rng.choice(np.arange(low, high), size=nbits, replace=False)
+        for _ in range(nrows)]).reshape(nrows, nbits)
+
+def corrupt_cmd_frames(frames, rng, nbits=1):
+    """Flips nbits distinct random bits of each frame between the direction and end bits (index,
+       argument or CRC7), so the frame is still received but fails its CRC and raises err_cmd_crc."""
+    frames = np.array(frames, dtype=np.uint64)
+    flat   = frames.reshape(-1)
+    pos    = _flip_positions(rng, flat.shape[0], 1, 46, nbits).astype(np.uint64)
+    flat  ^= np.bitwise_xor.reduce(np.uint64(1) << pos, axis=-1)
+    return flat.reshape(frames.shape)
+
+def corrupt_blocks(blocks, rng, nbits=1):
+    """Returns a copy of blocks (..., nbytes) with nbits distinct random bits flipped in each block."""
+    blocks = np.array(blocks, dtype=np.uint8)
+    flat   = blocks.reshape(-1, blocks.shape[-1])
+    rows   = np.arange(flat.shape[0])
+    pos    = _flip_positions(rng, flat.shape[0], 0, flat.shape[-1]*8, nbits)
+    for k in range(nbits):
+        flat[rows, pos[:, k] >> 3] ^= (np.uint8(0x80) >> (pos[:, k] & 7).astype(np.uint8))
+    return blocks
@@ -0,0 +1,258 @@
+# SPDX-License-Identifier: BSD-2-Clause
+
+# SD host bus-functional model for cocotb.
+#
+# Drives the SDEmulator pads (sd_clk, sd_cmd_i, sd_dat_i) of a simulated top-level and samples
+# sd_cmd_o/sd_cmd_t and sd_dat_o/sd_dat_t. The card samples on rising edges and drives on falling
+# edges (see sd_phy.v), so the host updates its lines while the clock is low and samples just
+# before the rising edge. Every SD clock is counted in self.clocks for latency measurements.
+
+import numpy as np
+
+from cocotb.triggers import Timer
+
+from crc import crc7, data_crc16, cmd_frames
+
+def _crc7(value, nbytes):
+    return int(crc7(np.frombuffer(value.to_bytes(nbytes, "big"), dtype=np.uint8)))
+
+# Responses ----------------------------------------------------------------------------------------
+
+RESP_NONE = None
+RESP_R1   = 48
+RESP_R1B  = 48
+RESP_R2   = 136
+RESP_R3   = 48
+RESP_R6   = 48
+RESP_R7   = 48
+
+
+class SDTimeout(Exception):
+    pass
+
+
+class SDCRCError(Exception):
+    pass
+
+# SDHostBFM ----------------------------------------------------------------------------------------
+
+class SDHostBFM:
+    """Host side of an SD bus, clk_period in ns (40 for Default Speed, 20 for High Speed)."""
+    def __init__(self, dut, clk_period=40):
+        self.dut        = dut
+        self.clk_period = clk_period
+        self.width      = 1
+        self.rca        = 0
+        self.clocks     = 0
+        self._cmd       = 1
+        self._dat       = 0xf
+
+        dut.sd_clk.value   = 0
+        dut.sd_cmd_i.value = 1
+        dut.sd_dat_i.value = 0xf
+
+    # Bus ------------------------------------------------------------------------------------------
+
+    def cmd_line(self):
+        # Pulled-up when neither side drives.
+        if not self._cmd:
+            return 0
+        return 1 if int(self.dut.sd_cmd_t.value) else int(self.dut.sd_cmd_o.value)
+
+    def dat_lines(self):
+        t = int(self.dut.sd_dat_t.value)
+        o = int(self.dut.sd_dat_o.value)
+        return ((o & ~t) | t) & self._dat & 0xf
+
+    async def clock(self, cmd=1, dat=0xf):
+        """One SD clock with the host driving cmd/dat, returns (cmd, dat) sampled at the rising edge."""
+        self._cmd = cmd
+        self._dat = dat
+        self.dut.sd_cmd_i.value = cmd
+        self.dut.sd_dat_i.value = dat
+        await Timer(self.clk_period/2, units="ns")
+        sample = (self.cmd_line(), self.dat_lines())
+        self.dut.sd_clk.value = 1
+        await Timer(self.clk_period/2, units="ns")
+        self.dut.sd_clk.value = 0
+        self.clocks += 1
+        return sample
+
+    async def idle(self, n):
+        for _ in range(n):
+            await self.clock()
+
+    # Command --------------------------------------------------------------------------------------
+
+    async def command(self, index, arg=0, resp=RESP_R1, busy=False, data=False, timeout=64):
+        """Sends a command and returns (response, latency in clocks from end bit to response).
+           With data, returns right after the response so the data start bit is not missed."""
+        frame = int(cmd_frames(index, arg))
+        for i in reversed(range(48)):
+            await self.clock(cmd=(frame >> i) & 1)
+        if resp is RESP_NONE:
+            await self.idle(8)
+            return None, 0
+
+        latency = 0
+        while True:
+            cmd, _ = await self.clock()
+            if cmd == 0:
+                break
+            latency += 1
+            if latency > timeout:
+                raise SDTimeout("CMD{}: no response".format(index))
+        response = 0
+        for _ in range(resp - 1):
+            cmd, _ = await self.clock()
+            response = (response << 1) | cmd
+
+        # R2 CRC only covers the CID/CSD, R3 (ACMD41) carries no CRC. The start bit (0) is left
+        # out of response but doesn't change the CRC.
+        crc = (response >> 1) & 0x7f
+        if resp == RESP_R2:
+            if _crc7((response >> 8) & ((1 << 120) - 1), 15) != crc:
+                raise SDCRCError("CMD{}: bad response CRC".format(index))
+        elif index != 41:
+            if _crc7(response >> 8, 5) != crc:
+                raise SDCRCError("CMD{}: bad response CRC".format(index))
+
+        if busy:
+            await self.wait_busy()
+        elif not data:
+            await self.idle(8)
+        return response, latency
+
+    async def app_command(self, index, arg=0, resp=RESP_R1, **kwargs):
+        await self.command(55, self.rca << 16)
+        return await self.command(index, arg, resp, **kwargs)
+
+    async def wait_busy(self, timeout=1 << 20):
+        # Card holds DAT0 low while programming.
+        await self.idle(2)
+        for _ in range(timeout):
+            _, dat = await self.clock()
+            if dat & 0x1:
+                return
+        raise SDTimeout("busy")
+
+    # Data -----------------------------------------------------------------------------------------
+
+    async def read_data(self, length=512, timeout=1 << 16):
+        """Receives one data block, returns (data, latency in clocks to the start bit)."""
+        mask    = (1 << self.width) - 1
+        latency = 0
+        while True:
+            _, dat = await self.clock()
+            if dat & mask == 0:
+                break
+            latency += 1
+            if latency > timeout:
+                raise SDTimeout("no data")
+
+        data  = bytearray()
+        byte  = 0
+        nbits = 0
+        for _ in range(length*8//self.width):
+            _, dat = await self.clock()
+            byte   = (byte << self.width) | (dat & mask)
+            nbits += self.width
+            if nbits == 8:
+                data.append(byte)
+                byte  = 0
+                nbits = 0
+        crcs = [0]*self.width
+        for _ in range(16):
+            _, dat = await self.clock()
+            for lane in range(self.width):
+                crcs[lane] = (crcs[lane] << 1) | ((dat >> lane) & 1)
+        await self.clock() # End bit.
+        expected = data_crc16(np.frombuffer(data, dtype=np.uint8), self.width)
+        for lane in range(self.width):
+            if expected[lane] != crcs[lane]:
+                raise SDCRCError("data lane {}: bad CRC".format(lane))
+        return bytes(data), latency
+
+    async def write_data(self, data):
+        """Sends one data block and returns the CRC status token (0b010: accepted)."""
+        mask  = (1 << self.width) - 1
+        await self.idle(2)
+        await self.clock(dat=0xf & ~mask) # Start bit.
+        for byte in data:
+            for shift in range(8 - self.width, -1, -self.width):
+                await self.clock(dat=(0xf & ~mask) | ((byte >> shift) & mask))
+        crcs = data_crc16(np.frombuffer(bytes(data), dtype=np.uint8), self.width)
+        for i in reversed(range(16)):
+            dat = 0xf & ~mask
+            for lane in range(self.width):
+                dat |= ((int(crcs[lane]) >> i) & 1) << lane
+            await self.clock(dat=dat)
+        await self.clock() # End bit.
+
+        # CRC status token on DAT0, then busy.
+        for _ in range(64):
+            _, dat = await self.clock()
+            if dat & 0x1 == 0:
+                break
+        else:
+            raise SDTimeout("no CRC status")
+        token = 0
+        for _ in range(3):
+            _, dat = await self.clock()
+            token = (token << 1) | (dat & 0x1)
+        await self.wait_busy()
+        return token
+
+    # Sequences ------------------------------------------------------------------------------------
+
+    async def init(self, width=4, high_speed=False):
+        """CMD0/CMD8/ACMD41/CMD2/CMD3/CMD7, then ACMD6 for 4-bit and CMD6 for High Speed."""
+        await self.idle(80)
+        await self.command(0, resp=RESP_NONE)
+        await self.command(8, 0x1aa, RESP_R7)
+        for _ in range(100):
+            r3, _ = await self.app_command(41, 0x40ff8000, RESP_R3)
+            if (r3 >> 39) & 0x1:
+                break
+        else:
+            raise SDTimeout("ACMD41: card stays busy")
+        await self.command(2, resp=RESP_R2)
+        r6, _ = await self.command(3, resp=RESP_R6)
+        self.rca = (r6 >> 24) & 0xffff
+        await self.command(7, self.rca << 16, RESP_R1B, busy=True)
+        if width == 4:
+            await self.app_command(6, 2)
+            self.width = 4
+        if high_speed:
+            await self.command(6, 0x80fffff1, data=True)
+            await self.read_data(64)
+            self.clk_period = 20
+
+    async def read_blocks(self, addr, count):
+        """CMD17 (count 1) or CMD18 + CMD12, returns (data, command latency, first data latency)."""
+        if count == 1:
+            _, cmd_latency = await self.command(17, addr, data=True)
+        else:
+            _, cmd_latency = await self.command(18, addr, data=True)
+        data = bytearray()
+        data_latency = None
+        for _ in range(count):
+            block, latency = await self.read_data()
+            data += block
+            if data_latency is None:
+                data_latency = latency
+        if count > 1:
+            await self.command(12, resp=RESP_R1B, busy=True)
+        return bytes(data), cmd_latency, data_latency
+
+    async def write_blocks(self, addr, data):
+        """CMD24 (one block) or CMD25 + CMD12, returns the command latency."""
+        count = len(data)//512
+        _, cmd_latency = await self.command(24 if count == 1 else 25, addr)
+        for i in range(count):
+            token = await self.write_data(data[512*i:512*(i + 1)])
+            if token != 0b010:
+                raise SDCRCError("block {}: rejected (token {:03b})".format(addr + i, token))
+        if count > 1:
+            await self.command(12, resp=RESP_R1B, busy=True)
+        return cmd_latency
@@ -27,6 +27,7 @@ module sd_link (
  input  wire         reset_n,
 
  output wire [3:0]   link_card_state,
+ output wire [2:0]   link_erase_state,
 
  input  wire [47:0]  phy_cmd_in,
  input  wire         phy_cmd_in_crc_good,
@@ -106,6 +107,7 @@ module sd_link (
  assign       link_card_state = card_state;
  reg  [3:0]   card_state_next;
  reg  [2:0]   card_erase_state;
+ assign       link_erase_state = card_erase_state;
  reg          card_appcmd;
  reg  [127:0] card_sd_status;
  reg  [127:0] card_csd;
@@ -288,6 +290,7 @@ module sd_link (
       cmd_in_latch <= phy_cmd_in;
       card_status[STAT_COM_CRC_ERROR] <= 0;
       card_status[STAT_ILLEGAL_COMMAND] <= 0;
+      err_unhandled_cmd <= 0;
       state <= ST_CMD_ACT;
       cmd_in_last <= cmd_in_cmd;
      end 
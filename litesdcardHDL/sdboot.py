@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+
+# SPDX-License-Identifier: BSD-2-Clause
+
+# SD fast boot images: header format, image tool and simulation of the load.
+#
+# The fast boot path of the sdcard driver (sdcard_boot in liteX/litesdcardSOC/sdcard.c) reads a
+# header block, then the payload with a single CMD18 whose DMA writes straight to the load
+# address, verifying each chunk against its CRC32 while the next ones are in flight. The header
+# (struct sdcard_boot_header, little-endian):
+#
+#   magic "SDBT", version, load_addr, length, chunk_blocks, nchunks, reserved, header_crc,
+#   chunk_crc[120]
+#
+# header_crc is the CRC32 of the block with header_crc = 0, chunk_crc[n] the CRC32 of the payload
+# bytes of chunk n. The payload starts at the block after the header.
+#
+#   ./sdboot.py make boot.bin sd.img --load-addr 0x40000000
+#   ./sdboot.py info sd.img
+#   ./sdboot.py sim sd.img
+
+import os
+import zlib
+import struct
+import argparse
+
+# Header -------------------------------------------------------------------------------------------
+
+BOOT_MAGIC   = 0x54424453 # "SDBT"
+BOOT_VERSION = 1
+BOOT_CHUNKS  = 120
+BOOT_BLOCK   = 1          # SDCARD_BOOT_BLOCK: after the MBR, before the first partition.
+
+_header = struct.Struct("<8I")
+
+def make_header(payload, load_addr, chunk_blocks=64):
+    """Returns the header block of payload. chunk_blocks is raised when the payload needs more
+       than BOOT_CHUNKS chunks."""
+    if not payload:
+        raise ValueError("Empty payload.")
+    nblocks      = (len(payload) + 511)//512
+    chunk_blocks = max(chunk_blocks, -(-nblocks//BOOT_CHUNKS))
+    chunk_bytes  = 512*chunk_blocks
+    crcs = [zlib.crc32(payload[i:i + chunk_bytes]) for i in range(0, len(payload), chunk_bytes)]
+    def pack(header_crc):
+        block = _header.pack(BOOT_MAGIC, BOOT_VERSION, load_addr, len(payload), chunk_blocks,
+            len(crcs), 0, header_crc)
+        block += struct.pack(f"<{len(crcs)}I", *crcs)
+        return block.ljust(512, b"\0")
+    return pack(zlib.crc32(pack(0)))
+
+def parse_header(block):
+    """Decodes a header block, returns a dict or None when the block is not a valid header."""
+    magic, version, load_addr, length, chunk_blocks, nchunks, _, header_crc = _header.unpack_from(block)
+    if magic != BOOT_MAGIC or version != BOOT_VERSION or nchunks > BOOT_CHUNKS:
+        return None
+    if zlib.crc32(bytes(block[:28]) + bytes(4) + bytes(block[32:512])) != header_crc:
+        return None
+    # Same checks as sdcard_boot_load: one chunk per started chunk_blocks of payload.
+    if length == 0 or chunk_blocks == 0 or nchunks != -(-length//(512*chunk_blocks)):
+        return None
+    return {
+        "load_addr"    : load_addr,
+        "length"       : length,
+        "chunk_blocks" : chunk_blocks,
+        "chunk_crc"    : list(struct.unpack_from(f"<{nchunks}I", block, _header.size)),
+    }
+
+# Image --------------------------------------------------------------------------------------------
+
+def write_image(filename, payload, load_addr, block=BOOT_BLOCK, chunk_blocks=64, size=None):
+    """Writes the header and payload at block of the disk image filename (created, or grown to
+       size bytes). Returns the header."""
+    header = make_header(payload, load_addr, chunk_blocks)
+    data   = header + payload.ljust(-(-len(payload)//512)*512, b"\0")
+    with open(filename, "r+b" if os.path.exists(filename) else "w+b") as f:
+        f.seek(0, os.SEEK_END)
+        end = max(f.tell(), size or 0, 512*block + len(data))
+        f.truncate(end)
+        f.seek(512*block)
+        f.write(data)
+    return parse_header(header)
+
+def verify(data, header):
+    """Returns the indexes of the chunks of data (the payload) failing their CRC."""
+    chunk_bytes = 512*header["chunk_blocks"]
+    return [n for n, crc in enumerate(header["chunk_crc"])
+        if zlib.crc32(data[n*chunk_bytes:min((n + 1)*chunk_bytes, header["length"])]) != crc]
+
+# Simulation ---------------------------------------------------------------------------------------
+
+def simulate(image, block=BOOT_BLOCK, num_blocks=4, transfer_cycles=64, vcd_name=None):
+    """Plays the fast boot load on an SDEmulator backed by image (a sim.DiskImage): header with
+       CMD17, payload with one CMD18, each chunk verified as soon as it is received while the
+       next ones are still being read.
+
+       Returns {"header", "ok", "failed" chunks, "cycles": {"header", "transfer", "verify_tail",
+       "total"}, "chunks": cycle each chunk was verified at}, header None without a boot image.
+       """
+    from migen.sim import passive
+    from sim import SDEmulatorSim
+
+    sim    = SDEmulatorSim(image, num_blocks=num_blocks)
+    data   = bytearray()
+    state  = {"cycle": 0, "header": None, "done": None, "loaded": None, "verified": None}
+    result = {"header": None, "ok": False, "failed": [], "chunks": []}
+
+    @passive
+    def clock():
+        while True:
+            state["cycle"] += 1
+            yield
+
+    def loader():
+        block_data = bytearray()
+        yield from sim.read_blocks(block, 1, block_data, transfer_cycles=transfer_cycles)
+        header = parse_header(block_data)
+        state["header"] = header or False
+        if not header:
+            return
+        state["loaded"] = state["cycle"]
+        yield from sim.read_blocks(block + 1, -(-header["length"]//512), data,
+            transfer_cycles = transfer_cycles)
+        state["done"] = state["cycle"]
+
+    def verifier():
+        while state["header"] is None:
+            yield
+        header = state["header"]
+        if not header:
+            return
+        chunk_bytes = 512*header["chunk_blocks"]
+        for n, crc in enumerate(header["chunk_crc"]):
+            end = min((n + 1)*chunk_bytes, header["length"])
+            while len(data) < end:
+                yield
+            if zlib.crc32(data[n*chunk_bytes:end]) != crc:
+                result["failed"].append(n)
+            result["chunks"].append(state["cycle"])
+            yield
+        while state["done"] is None:
+            yield
+        state["verified"] = state["cycle"]
+
+    sim.run(clock(), loader(), verifier(), vcd_name=vcd_name)
+
+    header = state["header"] or None
+    result["header"] = header
+    if header is not None:
+        result["ok"]     = not result["failed"]
+        result["cycles"] = {
+            "header"      : state["loaded"],
+            "transfer"    : state["done"] - state["loaded"],
+            "verify_tail" : state["verified"] - state["done"],
+            "total"       : state["verified"],
+        }
+    return result
+
+# Run ----------------------------------------------------------------------------------------------
+
+def _print_header(header, block):
+    nchunks = len(header["chunk_crc"])
+    print("Boot image at block {}: {} bytes to 0x{:08x}, {} chunks of {} blocks.".format(
+        block, header["length"], header["load_addr"], nchunks, header["chunk_blocks"]))
+
+def main():
+    parser = argparse.ArgumentParser(description="SD fast boot images.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    p = commands.add_parser("make", help="Write a payload and its boot header to a disk image.")
+    p.add_argument("payload",                                            help="Payload binary (linked at --load-addr).")
+    p.add_argument("image",                                              help="Disk image file (created if missing).")
+    p.add_argument("--load-addr",    default=0x4000_0000, type=lambda x: int(x, 0), help="Load/entry address.")
+    p.add_argument("--block",        default=BOOT_BLOCK,  type=int,      help="Header block (SDCARD_BOOT_BLOCK).")
+    p.add_argument("--chunk-blocks", default=64,          type=int,      help="Blocks per verified chunk.")
+    p.add_argument("--size",         default=None,        type=lambda x: int(x, 0), help="Minimum image size in bytes.")
+
+    p = commands.add_parser("info", help="Print and verify the boot image of a disk image.")
+    p.add_argument("image",                                              help="Disk image file.")
+    p.add_argument("--block",        default=BOOT_BLOCK,  type=int,      help="Header block (SDCARD_BOOT_BLOCK).")
+
+    p = commands.add_parser("sim", help="Simulate the fast boot load on the SDEmulator.")
+    p.add_argument("image",                                              help="Disk image file.")
+    p.add_argument("--block",        default=BOOT_BLOCK,  type=int,      help="Header block (SDCARD_BOOT_BLOCK).")
+    p.add_argument("--num-blocks",   default=4,           type=int,      help="SDEmulator ring depth.")
+    p.add_argument("--transfer-cycles", default=64,       type=int,      help="Cycles the PHY takes to clock a block out.")
+    p.add_argument("--vcd",          default=None,                       help="Dump waveforms to this VCD file.")
+    args = parser.parse_args()
+
+    if args.command == "make":
+        with open(args.payload, "rb") as f:
+            payload = f.read()
+        header = write_image(args.image, payload, args.load_addr, args.block, args.chunk_blocks, args.size)
+        _print_header(header, args.block)
+
+    if args.command == "info":
+        with open(args.image, "rb") as f:
+            f.seek(512*args.block)
+            header = parse_header(f.read(512))
+            if header is None:
+                raise SystemExit(f"No boot image at block {args.block}.")
+            _print_header(header, args.block)
+            failed = verify(f.read(header["length"]), header)
+        print("CRC errors in chunks {}.".format(failed) if failed else "All chunks verified.")
+        if failed:
+            raise SystemExit(1)
+
+    if args.command == "sim":
+        from sim import DiskImage
+        with DiskImage(args.image, writable=False) as image:
+            result = simulate(image, args.block, args.num_blocks, args.transfer_cycles, args.vcd)
+        if result["header"] is None:
+            raise SystemExit(f"No boot image at block {args.block}.")
+        _print_header(result["header"], args.block)
+        cycles = result["cycles"]
+        print("Boot load: {total} cycles (header {header}, transfer {transfer}, verify tail {verify_tail}).".format(**cycles))
+        print("OK" if result["ok"] else "CRC errors in chunks {}.".format(result["failed"]))
+        if not result["ok"]:
+            raise SystemExit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,412 @@
+#!/usr/bin/env python3
+
+# SPDX-License-Identifier: BSD-2-Clause
+
+# SDEmulator trace captures: record format, decoder and host tool.
+#
+# SDEmulatorTrace (tracer.py) writes change-only 64-bit records of the PHY/link state machines to
+# SDRAM: [63:62] type, [61:48] cycles since the previous record, [47:0] payload.
+#
+#   STATE: {data_out_act, resp_act, link_state[6:0], phy_ostate[6:0], phy_istate[6:0]}
+#   CMD:   cmd_in[47:0] of a command received by the PHY
+#   TIME:  cycles since the previous record, for gaps the delta field can't hold
+#
+# Captures are read back over the UART bridge (litex_server --uart) and saved as .sdtrace files
+# (a JSON header line followed by the raw little-endian records). Decoding only needs numpy, so
+# recorded or simulated captures (sim.py --trace) can be decoded anywhere.
+#
+#   ./sdtrace.py capture --csr-csv csr.csv --trigger-cmd 18 --ring --post 4096 -o read.sdtrace
+#   ./sdtrace.py decode read.sdtrace --vcd read.vcd
+
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+
+from crc import cmd_frame_crc_good
+
+# Record format ------------------------------------------------------------------------------------
+
+RECORD_STATE = 0
+RECORD_CMD   = 1
+RECORD_TIME  = 2
+
+DELTA_BITS   = 14
+PAYLOAD_BITS = 48
+
+# sd_phy.v istate/ostate and sd_link.v state encodings.
+PHY_STATES = {
+     0: "RESET",          1: "RESET_WAIT",      4: "IDLE",
+    10: "CMD_CHECK",     11: "CMD_READ",
+    14: "RESP_PREAMBLE", 15: "RESP_WRITE",     16: "RESP_WRITE_END",
+    20: "DATA_READ",     21: "DATA_READ_1",    22: "DATA_READ_2",    23: "DATA_READ_3",
+    24: "DATA_TOKEN",    25: "DATA_TOKEN_1",   26: "DATA_TOKEN_2",   27: "DATA_TOKEN_3",
+    30: "DATA_WRITE",    31: "DATA_WRITE_1",   32: "DATA_WRITE_2",   33: "DATA_WRITE_3",
+    40: "DATA_SPI_BEGIN", 41: "DATA_SPI_TOKEN", 127: "LAST",
+}
+LINK_STATES = {
+    0: "RESET", 4: "IDLE", 8: "CMD_ACT", 9: "CMD_RESP_0", 10: "CMD_RESP_1", 11: "CMD_RESP_2", 127: "LAST",
+}
+CMD_NAMES = {
+     0: "GO_IDLE_STATE",        2: "ALL_SEND_CID",         3: "SEND_RELATIVE_ADDR",
+     6: "SWITCH_FUNC",          7: "SELECT_CARD",          8: "SEND_IF_COND",
+     9: "SEND_CSD",            10: "SEND_CID",            12: "STOP_TRANSMISSION",
+    13: "SEND_STATUS",         16: "SET_BLOCKLEN",        17: "READ_SINGLE_BLOCK",
+    18: "READ_MULTIPLE_BLOCK", 24: "WRITE_BLOCK",         25: "WRITE_MULTIPLE_BLOCK",
+    32: "ERASE_WR_BLK_START",  33: "ERASE_WR_BLK_END",    38: "ERASE",
+    55: "APP_CMD",
+}
+ACMD_NAMES = {
+     6: "SET_BUS_WIDTH",       13: "SD_STATUS",           41: "SD_SEND_OP_COND",
+    42: "SET_CLR_CARD_DETECT", 51: "SEND_SCR",
+}
+
+def _state_name(states, value):
+    return states.get(value, str(value))
+
+# Capture files ------------------------------------------------------------------------------------
+
+_magic = "sdtrace"
+
+def save(filename, data, **info):
+    """Writes raw records and capture info (clk_freq, trigger, overflow...) to filename."""
+    with open(filename, "wb") as f:
+        f.write((json.dumps({"format": _magic, **info}) + "\n").encode())
+        f.write(bytes(data))
+
+def load(filename):
+    """Returns the Trace saved in filename."""
+    with open(filename, "rb") as f:
+        info = json.loads(f.readline())
+        if info.pop("format", None) != _magic:
+            raise ValueError("{}: not an SDEmulator trace.".format(filename))
+        return Trace(f.read(), **info)
+
+# Trace --------------------------------------------------------------------------------------------
+
+class Trace:
+    """Decoded capture: records in capture order with their time in cycles from the first record.
+
+       trigger is the index of the first record at or after the trigger (None if unknown),
+       clk_freq the capture clock (the SDEmulator core clock) in Hz.
+       """
+    def __init__(self, data, clk_freq=None, trigger=None, overflow=False, **info):
+        records = np.frombuffer(bytes(data)[:len(data)//8*8], dtype="<u8")
+        self.kind     = (records >> np.uint64(62)).astype(np.uint8)
+        delta         = (records >> np.uint64(PAYLOAD_BITS)) & np.uint64(2**DELTA_BITS - 1)
+        self.payload  = records & np.uint64(2**PAYLOAD_BITS - 1)
+        step          = np.where(self.kind == RECORD_TIME, self.payload, delta)
+        self.time     = np.cumsum(step) - (step[0] if len(step) else 0)
+        self.clk_freq = clk_freq
+        self.trigger  = trigger
+        self.overflow = overflow
+        self.info     = info
+
+    def __len__(self):
+        return len(self.kind)
+
+    def us(self, cycles):
+        return None if self.clk_freq is None else cycles*1e6/self.clk_freq
+
+    # Records --------------------------------------------------------------------------------------
+
+    def states(self):
+        """Yields (time, istate, ostate, link_state, resp_act, data_out_act) for each STATE record."""
+        for i in np.flatnonzero(self.kind == RECORD_STATE):
+            p = int(self.payload[i])
+            yield (int(self.time[i]), p & 0x7f, (p >> 7) & 0x7f, (p >> 14) & 0x7f, (p >> 21) & 1, (p >> 22) & 1)
+
+    def commands(self):
+        """Yields (time, index, argument, crc_good, frame) for each CMD record."""
+        cmds   = np.flatnonzero(self.kind == RECORD_CMD)
+        frames = self.payload[cmds]
+        good   = cmd_frame_crc_good(frames) if len(frames) else []
+        for i, frame, crc_good in zip(cmds, frames, good):
+            frame = int(frame)
+            yield (int(self.time[i]), (frame >> 40) & 0x3f, (frame >> 8) & 0xffffffff, bool(crc_good), frame)
+
+    # Transactions ---------------------------------------------------------------------------------
+
+    def transactions(self):
+        """Groups the records by command: for each command, returns a dict with its time, index,
+           name, argument, CRC status, response window (resp_act) and the data blocks sent to the
+           host (data_out_act windows) until the next command."""
+        transactions = []
+        app = False
+        for t, index, arg, crc_good, frame in self.commands():
+            name = (ACMD_NAMES if app else CMD_NAMES).get(index)
+            transactions.append({
+                "time"     : t,
+                "index"    : index,
+                "name"     : ("ACMD{}" if app else "CMD{}").format(index) + (" " + name if name else ""),
+                "arg"      : arg,
+                "crc_good" : crc_good,
+                "resp"     : None,
+                "blocks"   : [],
+            })
+            app = crc_good and index == 55
+        if not transactions:
+            return transactions
+
+        starts = [tr["time"] for tr in transactions]
+        n      = 0
+        resp_act = data_out_act = 0
+        resp_start = data_start = None
+        for t, istate, ostate, link_state, resp, data in self.states():
+            while n + 1 < len(starts) and t >= starts[n + 1]:
+                n += 1
+            if t < starts[0]:
+                resp_act, data_out_act = resp, data
+                continue
+            tr = transactions[n]
+            if resp and not resp_act:
+                resp_start = t
+            if not resp and resp_act and resp_start is not None and tr["resp"] is None:
+                tr["resp"] = (resp_start, t)
+            if data and not data_out_act:
+                data_start = t
+            if not data and data_out_act and data_start is not None:
+                tr["blocks"].append((data_start, t))
+            resp_act, data_out_act = resp, data
+        return transactions
+
+    def timeline(self, out=sys.stdout):
+        """Prints one line per transaction: response latency, blocks, block time and the longest
+           gap between blocks (where throughput stalls show up)."""
+        unit = "us" if self.clk_freq else "cycles"
+        fmt  = (lambda c: "{:.3f}".format(self.us(c))) if self.clk_freq else str
+        for tr in self.transactions():
+            line = "{:>14} {}  {:<28} arg=0x{:08x}".format(fmt(tr["time"]), unit, tr["name"], tr["arg"])
+            if not tr["crc_good"]:
+                line += "  BAD CRC"
+            if tr["resp"] is not None:
+                line += "  resp +{}".format(fmt(tr["resp"][0] - tr["time"]))
+            blocks = tr["blocks"]
+            if blocks:
+                line += "  {} block{}".format(len(blocks), "s" if len(blocks) > 1 else "")
+                line += "  first +{}".format(fmt(blocks[0][0] - tr["time"]))
+                line += "  block {}".format(fmt(max(end - start for start, end in blocks)))
+                if len(blocks) > 1:
+                    line += "  max gap {}".format(fmt(max(b[0] - a[1] for a, b in zip(blocks, blocks[1:]))))
+            print(line, file=out)
+
+    def dump(self, out=sys.stdout):
+        """Prints every record."""
+        names = {RECORD_STATE: "STATE", RECORD_CMD: "CMD", RECORD_TIME: "TIME"}
+        for i, (kind, t, p) in enumerate(zip(self.kind, self.time, self.payload)):
+            p = int(p)
+            if kind == RECORD_STATE:
+                value = "istate={} ostate={} link={} resp_act={} data_out_act={}".format(
+                    _state_name(PHY_STATES, p & 0x7f), _state_name(PHY_STATES, (p >> 7) & 0x7f),
+                    _state_name(LINK_STATES, (p >> 14) & 0x7f), (p >> 21) & 1, (p >> 22) & 1)
+            elif kind == RECORD_CMD:
+                value = "CMD{} arg=0x{:08x} frame=0x{:012x}".format((p >> 40) & 0x3f, (p >> 8) & 0xffffffff, p)
+            else:
+                value = "+{} cycles".format(p)
+            marker = " <- trigger" if i == self.trigger else ""
+            print("{:>8} {:>12}  {:<5} {}{}".format(i, int(t), names.get(int(kind), "?"), value, marker), file=out)
+
+    # VCD ------------------------------------------------------------------------------------------
+
+    def write_vcd(self, f):
+        """Writes the probed signals as a VCD (1 ps timescale with clk_freq, else 1 ns per cycle)."""
+        signals = [
+            ("phy_istate",   7),
+            ("phy_ostate",   7),
+            ("link_state",   7),
+            ("resp_act",     1),
+            ("data_out_act", 1),
+            ("cmd_in",       48),
+            ("cmd_index",    6),
+            ("trigger",      1),
+        ]
+        ids    = {name: chr(33 + i) for i, (name, _) in enumerate(signals)}
+        widths = dict(signals)
+        period = round(1e12/self.clk_freq) if self.clk_freq else 1
+
+        f.write("$timescale {} $end\n".format("1ps" if self.clk_freq else "1ns"))
+        f.write("$scope module sd_emulator $end\n")
+        for name, width in signals:
+            f.write("$var wire {} {} {} $end\n".format(width, ids[name], name))
+        f.write("$upscope $end\n$enddefinitions $end\n")
+
+        def value(name, v):
+            if widths[name] == 1:
+                return "{}{}\n".format("x" if v is None else v, ids[name])
+            return "b{} {}\n".format("x" if v is None else "{:b}".format(v), ids[name])
+
+        f.write("#0\n$dumpvars\n")
+        for name, _ in signals:
+            f.write(value(name, 0 if name == "trigger" else None))
+        f.write("$end\n")
+
+        current = {}
+        last_t  = None
+        for i, (kind, t, p) in enumerate(zip(self.kind, self.time, self.payload)):
+            p       = int(p)
+            changes = {}
+            if kind == RECORD_STATE:
+                changes = {
+                    "phy_istate"   : p & 0x7f,
+                    "phy_ostate"   : (p >> 7) & 0x7f,
+                    "link_state"   : (p >> 14) & 0x7f,
+                    "resp_act"     : (p >> 21) & 1,
+                    "data_out_act" : (p >> 22) & 1,
+                }
+            elif kind == RECORD_CMD:
+                changes = {"cmd_in": p, "cmd_index": (p >> 40) & 0x3f}
+            if i == self.trigger:
+                changes["trigger"] = 1
+            changes = {k: v for k, v in changes.items() if current.get(k) != v}
+            if not changes:
+                continue
+            t = int(t)*period
+            if t != last_t:
+                f.write("#{}\n".format(t))
+                last_t = t
+            for name, v in changes.items():
+                f.write(value(name, v))
+                current[name] = v
+
+# Capture (UART bridge) ----------------------------------------------------------------------------
+
+def capture(bus, ring=False, trigger_cmd=None, trigger_link_state=None, post=0, duration=None,
+    chunk=64, on_data=None):
+    """Runs a capture on a BaseSoC built with the SD emulator trace, through a RemoteClient.
+
+       Without ring the records are streamed from the trigger on: new records are read in bursts
+       of chunk records and released with rd_index so the SDRAM buffer never overflows while the
+       host keeps up. With ring the core records from arm (pre-trigger history) and the buffer is
+       read once the capture is done. Stops after post records following the trigger (0: until
+       duration elapses). Returns (data, info) for save().
+       """
+    regs     = bus.regs
+    base     = bus.mems.sd_trace.base
+    nrecords = bus.mems.sd_trace.size//8
+
+    trigger = 0
+    if trigger_cmd is not None:
+        trigger |= (1 << 0) | (trigger_cmd << 8)
+    if trigger_link_state is not None:
+        trigger |= (1 << 1) | (trigger_link_state << 16)
+    regs.sd_trace_trigger.write(trigger)
+    regs.sd_trace_post.write(post)
+    regs.sd_trace_rd_index.write(0)
+    regs.sd_trace_control.write((1 << 0) | (int(ring) << 8))
+
+    def read(first, count):
+        data = bytearray()
+        while count:
+            index = first % nrecords
+            n     = min(count, chunk, nrecords - index)
+            for word in bus.read(base + 8*index, 2*n):
+                data += word.to_bytes(4, "little")
+            first += n
+            count -= n
+        return data
+
+    def stopped():
+        return not (regs.sd_trace_status.read() & 0x1)
+
+    data  = bytearray()
+    start = time.time()
+    rd    = 0
+    try:
+        while True:
+            done = stopped()
+            if duration is not None and time.time() - start > duration:
+                regs.sd_trace_control.write(1 << 1)
+                done = True
+            if not ring:
+                wr = regs.sd_trace_wr_index.read()
+                if wr != rd:
+                    new = read(rd, wr - rd)
+                    data += new
+                    rd = wr
+                    regs.sd_trace_rd_index.write(rd)
+                    if on_data is not None:
+                        on_data(new)
+                    continue
+            if done:
+                break
+            time.sleep(0.01)
+    except KeyboardInterrupt:
+        regs.sd_trace_control.write(1 << 1)
+
+    status = regs.sd_trace_status.read()
+    wr     = regs.sd_trace_wr_index.read()
+    first  = 0
+    if ring:
+        first = max(wr - nrecords, 0)
+        data  = read(first, wr - first)
+    elif wr != rd:
+        data += read(rd, wr - rd)
+    trigger_index = regs.sd_trace_trigger_index.read() if status & 0x2 else None
+    info = {
+        "clk_freq" : bus.constants.sd_trace_clk_freq,
+        "trigger"  : None if trigger_index is None or trigger_index < first else trigger_index - first,
+        "overflow" : bool(status & 0x4),
+        "first"    : first,
+    }
+    return data, info
+
+# Run ----------------------------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="SDEmulator trace capture and decoder.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    p = commands.add_parser("capture", help="Capture a trace over the UART bridge (litex_server --uart).")
+    p.add_argument("-o", "--output",           required=True,           help="Capture file (.sdtrace).")
+    p.add_argument("--csr-csv",                default="csr.csv",       help="SoC CSR definitions.")
+    p.add_argument("--host",                   default="localhost",     help="litex_server host.")
+    p.add_argument("--port",                   default=1234, type=int,  help="litex_server port.")
+    p.add_argument("--ring",                   action="store_true",     help="Keep pre-trigger history, read the buffer once done.")
+    p.add_argument("--trigger-cmd",            default=None, type=int,  help="Trigger on this command index (default: immediate).")
+    p.add_argument("--trigger-link-state",     default=None, type=int,  help="Trigger on this sd_link state.")
+    p.add_argument("--post",                   default=0,    type=int,  help="Records captured after the trigger (0: until stopped).")
+    p.add_argument("--duration",               default=None, type=float, help="Stop after this many seconds (default: Ctrl-C).")
+
+    p = commands.add_parser("decode", help="Decode a capture file.")
+    p.add_argument("capture",                                           help="Capture file (.sdtrace).")
+    p.add_argument("--records",                action="store_true",     help="Print every record instead of the transactions.")
+    p.add_argument("--vcd",                    default=None,            help="Export the signals to this VCD file.")
+    args = parser.parse_args()
+
+    if args.command == "capture":
+        from litex import RemoteClient
+        bus = RemoteClient(host=args.host, port=args.port, csr_csv=args.csr_csv)
+        bus.open()
+        try:
+            received = [0]
+            def progress(new):
+                received[0] += len(new)//8
+                print("\r{} records".format(received[0]), end="", file=sys.stderr)
+            data, info = capture(bus,
+                ring               = args.ring,
+                trigger_cmd        = args.trigger_cmd,
+                trigger_link_state = args.trigger_link_state,
+                post               = args.post,
+                duration           = args.duration,
+                on_data            = progress,
+            )
+        finally:
+            bus.close()
+        save(args.output, data, **info)
+        print("\n{}: {} records{}.".format(args.output, len(data)//8,
+            ", OVERFLOW (changes were coalesced)" if info["overflow"] else ""), file=sys.stderr)
+
+    if args.command == "decode":
+        trace = load(args.capture)
+        if args.records:
+            trace.dump()
+        else:
+            trace.timeline()
+        if args.vcd is not None:
+            with open(args.vcd, "w") as f:
+                trace.write_vcd(f)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,315 @@
+#!/usr/bin/env python3
+
+# SPDX-License-Identifier: BSD-2-Clause
+
+# SDEmulator simulation harness: the block rings run in Migen's simulator, the block requests
+# of sd_link are driven from Python and the backing storage is a memory-mapped disk image.
+#
+# Migen's simulator can't run the sd_phy/sd_link Verilog, so their instances are left out and
+# the harness plays the link side of the block_read/block_write handshakes (the same sequence
+# as DST_DATA_OUT_* / DST_DATA_IN_* in sd_link.v) and the PHY/link outputs of each command.
+
+import os
+import mmap
+import argparse
+
+from migen import *
+from migen.fhdl.structure import _Assign
+from migen.sim import passive
+
+from core import SDEmulator
+from tracer import SDEmulatorTrace
+from crc import cmd_frames
+import sdtrace
+
+
+# Helpers ------------------------------------------------------------------------------------------
+
+class SimPlatform:
+    """Stands in for the LiteX platform, records the Verilog sources for simulators that can use them."""
+    def __init__(self):
+        self.sources       = []
+        self.include_paths = []
+
+    def add_verilog_include_path(self, path):
+        self.include_paths.append(path)
+
+    def add_sources(self, path, *filenames):
+        self.sources += [os.path.join(path, f) for f in filenames]
+
+
+class DiskImage:
+    """Memory-mapped disk image, blocks are returned as zero-copy memoryview slices."""
+    def __init__(self, filename, writable=True):
+        self._file    = open(filename, "r+b" if writable else "rb")
+        self._mmap    = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_WRITE if writable else mmap.ACCESS_READ)
+        self._view    = memoryview(self._mmap)
+        self.nblocks  = len(self._mmap)//512
+        self.writable = writable
+
+    def block(self, n):
+        if n >= self.nblocks:
+            return None
+        return self._view[512*n:512*(n + 1)]
+
+    def close(self):
+        self._view.release()
+        try:
+            self._mmap.close()
+        except BufferError:
+            pass # Blocks still referenced, the map goes away with them.
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+_zero_block = bytes(512)
+
+# SDEmulatorSim ------------------------------------------------------------------------------------
+
+class SDEmulatorSim:
+    """Runs an SDEmulator backed by a DiskImage.
+
+       read_blocks/write_blocks are generators playing the link side of one CMD17/18 or CMD24/25,
+       they are meant to be combined in a user generator passed to run(). With trace, an
+       SDEmulatorTrace records the run; its records are collected in trace_data. Writes and erases
+       need a writable image, they raise ValueError on a read-only one.
+       """
+    def __init__(self, image, num_blocks=4, trace=False):
+        self.image    = image
+        self.emulator = emulator = SDEmulator(SimPlatform(), num_blocks=num_blocks)
+        emulator.backed = True
+
+        # Drop the Verilog instances and let the simulator clock sd_ll instead of pads.clk.
+        fragment = emulator.get_fragment()
+        self.trace      = None
+        self.trace_data = bytearray()
+        if trace:
+            self.trace = SDEmulatorTrace(emulator, with_csr=False)
+            fragment  += self.trace.get_fragment()
+        fragment.specials = {s for s in fragment.specials if not isinstance(s, Instance)}
+        fragment.comb = [s for s in fragment.comb
+            if not (isinstance(s, _Assign) and s.l is emulator.cd_sd_ll.clk)]
+        self.fragment = fragment
+
+    # Backing storage ------------------------------------------------------------------------------
+
+    @passive
+    def _fill(self):
+        emulator = self.emulator
+        while True:
+            if (yield emulator.fill_req):
+                slot  = yield emulator.fill_slot
+                block = self.image.block((yield emulator.fill_addr)) or _zero_block
+                for i in range(512//4):
+                    word = int.from_bytes(block[4*i:4*(i + 1)], "big")
+                    yield emulator.rd_buffer[slot*512//4 + i].eq(word)
+                yield emulator.fill_done.eq(1)
+                yield
+                while (yield emulator.fill_req):
+                    yield
+                yield emulator.fill_done.eq(0)
+            yield
+
+    @passive
+    def _drain(self):
+        emulator = self.emulator
+        while True:
+            if (yield emulator.drain_req):
+                self._check_writable("write")
+                slot  = yield emulator.drain_slot
+                addr  = yield emulator.drain_addr
+                for n in range((yield emulator.drain_count)):
+                    block = self.image.block(addr + n)
+                    if block is None:
+                        continue
+                    base = ((slot + n) % emulator.num_blocks)*512//4
+                    for i in range(512//4):
+                        word = yield emulator.wr_buffer[base + i]
+                        block[4*i:4*(i + 1)] = word.to_bytes(4, "big")
+                yield emulator.drain_done.eq(1)
+                yield
+                while (yield emulator.drain_req):
+                    yield
+                yield emulator.drain_done.eq(0)
+            yield
+
+    @passive
+    def _erase(self):
+        emulator = self.emulator
+        while True:
+            if (yield emulator.erase_req):
+                self._check_writable("erase")
+                start = yield emulator.erase_start
+                end   = min((yield emulator.erase_end), self.image.nblocks - 1)
+                for n in range(start, end + 1):
+                    self.image.block(n)[:] = _zero_block
+                yield emulator.erase_done.eq(1)
+                yield
+                while (yield emulator.erase_req):
+                    yield
+                yield emulator.erase_done.eq(0)
+            yield
+
+    def _check_writable(self, what):
+        if not self.image.writable:
+            raise ValueError(f"Cannot {what} blocks of a read-only disk image.")
+
+    @passive
+    def _trace(self):
+        source = self.trace.source
+        yield source.ready.eq(1)
+        while True:
+            if (yield source.valid):
+                self.trace_data += (yield source.data).to_bytes(8, "little")
+            yield
+
+    def arm_trace(self, ring=False, post=0):
+        """Starts a trace capture, triggered immediately."""
+        trace = self.trace
+        yield trace.ring.eq(ring)
+        yield trace.post.eq(post)
+        yield trace.arm.eq(1)
+        yield
+        yield trace.arm.eq(0)
+        yield
+
+    # Link side ------------------------------------------------------------------------------------
+
+    def command(self, index, arg=0, resp_type=1, resp_cycles=4):
+        """Plays the PHY/link outputs of one command: cmd_in/cmd_in_act, then sd_link through
+           ST_CMD_ACT and ST_CMD_RESP_2 with resp_act while the response is sent."""
+        emulator = self.emulator
+        yield emulator.cmd_in.eq(int(cmd_frames(index, arg)))
+        yield emulator.cmd_in_act.eq(1)
+        yield emulator.cmd_in_cmd.eq(index)
+        yield emulator.resp_type.eq(resp_type)
+        yield emulator.link_state.eq(8)  # ST_CMD_ACT
+        for _ in range(8):               # cmd_in_act crosses from sd_ll
+            yield
+        yield emulator.cmd_in_act.eq(0)
+        yield emulator.link_state.eq(11) # ST_CMD_RESP_2
+        yield emulator.resp_act.eq(1)
+        for _ in range(resp_cycles):
+            yield
+        yield emulator.resp_act.eq(0)
+        yield emulator.link_state.eq(4)  # ST_IDLE
+        yield
+
+    def read_blocks(self, addr, count, data, transfer_cycles=0):
+        """Reads count blocks from addr into the data bytearray (CMD17 if count is 1, else CMD18
+           ended by CMD12). transfer_cycles models the time the PHY takes to clock each block out."""
+        emulator = self.emulator
+        num = 1 if count == 1 else 0xffffffff
+        yield from self.command(17 if count == 1 else 18, addr)
+        for i in range(count):
+            yield emulator.block_read_addr.eq(addr + i)
+            yield emulator.block_read_num.eq(num - i)
+            yield emulator.block_read_act.eq(1)
+            yield
+            while not (yield emulator.block_read_go):
+                yield
+            yield emulator.block_read_act.eq(0)
+            yield emulator.data_out_act.eq(1)
+            slot = (yield emulator.internal_rd_port.adr) >> 7
+            for j in range(512//4):
+                word = yield emulator.rd_buffer[slot*512//4 + j]
+                data += word.to_bytes(4, "big")
+            for _ in range(transfer_cycles):
+                yield
+            yield emulator.data_out_act.eq(0)
+            yield emulator.block_read_stop.eq(1)
+            yield
+            while (yield emulator.block_read_go):
+                yield
+            yield emulator.block_read_stop.eq(0)
+            yield
+        if count > 1:
+            yield from self.command(12, resp_type=8) # RESP_R1B
+
+    def write_blocks(self, addr, data):
+        """Writes data (a multiple of 512 bytes) to addr (CMD24 for one block, else CMD25 ended
+           by CMD12)."""
+        self._check_writable("write")
+        emulator = self.emulator
+        data  = memoryview(data)
+        count = len(data)//512
+        num   = 1 if count == 1 else 0xffffffff
+        yield from self.command(24 if count == 1 else 25, addr)
+        yield emulator.card_state.eq(6) # CARD_RCV
+        for i in range(count):
+            slot  = (yield emulator.internal_wr_port.adr) >> 7
+            block = data[512*i:512*(i + 1)]
+            for j in range(512//4):
+                word = int.from_bytes(block[4*j:4*(j + 1)], "big")
+                yield emulator.wr_buffer[slot*512//4 + j].eq(word)
+            yield emulator.block_write_addr.eq(addr + i)
+            yield emulator.block_write_num.eq(num - i)
+            yield emulator.block_write_act.eq(1)
+            yield
+            while not (yield emulator.block_write_done):
+                yield
+            yield emulator.block_write_act.eq(0)
+            yield
+        if count > 1:
+            yield from self.command(12, resp_type=8) # RESP_R1B
+        yield emulator.card_state.eq(4) # CARD_TRAN
+        yield
+
+    def erase_blocks(self, start, end):
+        """Erases blocks start..end (CMD32/CMD33/CMD38), returns once the R1b response is out."""
+        self._check_writable("erase")
+        emulator = self.emulator
+        yield emulator.block_erase_start.eq(start)
+        yield emulator.block_erase_end.eq(end)
+        yield emulator.link_erase_state.eq(2)    # after CMD32/CMD33
+        yield from self.command(38, resp_type=8) # RESP_R1B
+        yield emulator.link_erase_state.eq(0)
+
+    def flush(self):
+        """Waits until every written block and erase reached the image."""
+        while (yield self.emulator.wr_level) or (yield self.emulator.erase_req):
+            yield
+
+    def run(self, *generators, vcd_name=None):
+        if self.trace is not None:
+            generators = (self._trace(), *generators)
+        run_simulation(self.fragment, [self._fill(), self._drain(), self._erase(), *generators],
+            clocks   = {"sys": 10, "sd_ll": 40},
+            vcd_name = vcd_name)
+
+# Run ----------------------------------------------------------------------------------------------
+
+def main():
+    parser = argparse.ArgumentParser(description="SDEmulator simulation on a disk image.")
+    parser.add_argument("image",                                 help="Disk image file.")
+    parser.add_argument("--addr",       default=0,  type=int,    help="First block to read.")
+    parser.add_argument("--count",      default=8,  type=int,    help="Number of blocks to read.")
+    parser.add_argument("--num-blocks", default=4,  type=int,    help="SDEmulator ring depth.")
+    parser.add_argument("--vcd",        default=None,            help="Dump waveforms to this VCD file.")
+    parser.add_argument("--trace",      default=None,            help="Save an SDEmulatorTrace capture of the run to this file.")
+    args = parser.parse_args()
+
+    with DiskImage(args.image, writable=False) as image:
+        sim  = SDEmulatorSim(image, num_blocks=args.num_blocks, trace=args.trace is not None)
+        data = bytearray()
+        def run():
+            if args.trace is not None:
+                yield from sim.arm_trace()
+            yield from sim.read_blocks(args.addr, args.count, data, transfer_cycles=64)
+            for _ in range(16): # Last records through the trace FIFO.
+                yield
+        sim.run(run(), vcd_name=args.vcd)
+        if args.trace is not None:
+            sdtrace.save(args.trace, sim.trace_data, clk_freq=1e9/10, trigger=0)
+        expected = bytearray()
+        for n in range(args.addr, args.addr + args.count):
+            expected += image.block(n) or _zero_block
+        print("OK" if data == expected else "MISMATCH")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+# SPDX-License-Identifier: BSD-2-Clause
+
+from migen import *
+from migen.genlib.cdc import MultiReg, PulseSynchronizer
+
+from litex.gen import *
+
+from litex.soc.interconnect import stream
+from litex.soc.interconnect.csr import *
+
+from litedram.frontend.dma import LiteDRAMDMAWriter
+
+from sdtrace import RECORD_STATE, RECORD_CMD, RECORD_TIME, DELTA_BITS, PAYLOAD_BITS
+
+
+trace_layout = [("data", 64)]
+
+# SDEmulatorTrace ----------------------------------------------------------------------------------
+
+class SDEmulatorTrace(LiteXModule):
+    """Change-only trace of the SDEmulator PHY/link state machines.
+
+       Samples phy_istate, phy_ostate, link_state, resp_act and data_out_act every cycle of the
+       emulator clock domain and emits a STATE record only when one of them changes; cmd_in only
+       changes once per command (sd_phy latches it with cmd_in_act), it is recorded as a CMD
+       record on each command. Records carry the cycles elapsed since the previous one, longer
+       gaps are emitted as TIME records (see sdtrace.py for the format and the decoder).
+
+       A capture starts on arm and triggers immediately or on a command index/link state. In
+       ring mode records are produced from arm on (pre-trigger history, the storage wraps),
+       otherwise from the trigger on with the host consuming them (rd_index). The capture ends
+       post records after the trigger, or on stop. At most one record is emitted per cycle: when
+       the storage falls behind, changes are coalesced into the next STATE record and overflow
+       is raised. Records leave on source (sys domain) for a storage module such as
+       SDEmulatorTraceDRAMWriter, which reports its progress on stored and flow-controls on
+       consumed.
+       """
+    def __init__(self, emulator, fifo_depth=64, with_csr=True):
+        self.source = stream.Endpoint(trace_layout)
+
+        # Control (sys domain).
+        self.arm                  = Signal()   # Pulse: start a capture (clears the previous one).
+        self.stop                 = Signal()   # Pulse: end the capture.
+        self.ring                 = Signal()   # Record from arm on, storage wraps.
+        self.trigger_cmd_enable   = Signal()
+        self.trigger_cmd          = Signal(6)
+        self.trigger_state_enable = Signal()
+        self.trigger_state        = Signal(7)
+        self.post                 = Signal(32) # Records after the trigger, 0: until stopped.
+        self.consumed             = Signal(32) # Records read by the host (stream mode).
+
+        # Status (sys domain).
+        self.capturing     = Signal()
+        self.triggered     = Signal()
+        self.overflow      = Signal()
+        self.trigger_index = Signal(32) # First record at or after the trigger.
+        self.stored        = Signal(32) # Records stored, driven by the storage side.
+
+        # # #
+
+        cd   = emulator.clock_domain
+        sync = getattr(self.sync, cd)
+
+        # Control/status -------------------------------------------------------------------------
+        arm                  = Signal()
+        stop                 = Signal()
+        ring                 = Signal()
+        trigger_cmd_enable   = Signal()
+        trigger_cmd          = Signal(6)
+        trigger_state_enable = Signal()
+        trigger_state        = Signal(7)
+        post                 = Signal(32)
+        capturing            = Signal()
+        triggered            = Signal()
+        overflow             = Signal()
+        trigger_index        = Signal(32)
+        config = [
+            (self.ring,                 ring),
+            (self.trigger_cmd_enable,   trigger_cmd_enable),
+            (self.trigger_cmd,          trigger_cmd),
+            (self.trigger_state_enable, trigger_state_enable),
+            (self.trigger_state,        trigger_state),
+            (self.post,                 post),
+        ]
+        status = [
+            (capturing,     self.capturing),
+            (triggered,     self.triggered),
+            (overflow,      self.overflow),
+            (trigger_index, self.trigger_index),
+        ]
+        if cd == "sys":
+            self.comb += [
+                arm.eq(self.arm),
+                stop.eq(self.stop),
+            ]
+            self.comb += [o.eq(i) for i, o in config + status]
+        else:
+            # Configuration is static during a capture, trigger_index once triggered.
+            self.arm_ps  = PulseSynchronizer("sys", cd)
+            self.stop_ps = PulseSynchronizer("sys", cd)
+            self.comb += [
+                self.arm_ps.i.eq(self.arm),
+                arm.eq(self.arm_ps.o),
+                self.stop_ps.i.eq(self.stop),
+                stop.eq(self.stop_ps.o),
+            ]
+            self.specials += [MultiReg(i, o, cd)    for i, o in config]
+            self.specials += [MultiReg(i, o, "sys") for i, o in status]
+
+        # Probes ---------------------------------------------------------------------------------
+        # The PHY states and cmd_in come from the sd_ll domain, resynchronize them like sd_link does.
+        istate       = Signal(7)
+        ostate       = Signal(7)
+        cmd_in       = Signal(48)
+        cmd_in_act   = Signal()
+        cmd_in_act_d = Signal()
+        self.specials += [
+            MultiReg(emulator.phy_istate, istate,     cd),
+            MultiReg(emulator.phy_ostate, ostate,     cd),
+            MultiReg(emulator.cmd_in,     cmd_in,     cd),
+            MultiReg(emulator.cmd_in_act, cmd_in_act, cd),
+        ]
+        probe     = Signal(23)
+        cmd_event = Signal()
+        self.comb += [
+            probe.eq(Cat(istate, ostate, emulator.link_state, emulator.resp_act, emulator.data_out_act)),
+            cmd_event.eq(cmd_in_act & ~cmd_in_act_d),
+        ]
+        sync += cmd_in_act_d.eq(cmd_in_act)
+
+        # Trigger --------------------------------------------------------------------------------
+        trigger   = Signal()
+        recording = Signal()
+        count     = Signal(32) # Records emitted
+        self.comb += [
+            trigger.eq(capturing & ~triggered & (
+                (~trigger_cmd_enable & ~trigger_state_enable) |
+                (trigger_cmd_enable   & cmd_event & (cmd_in[40:46] == trigger_cmd)) |
+                (trigger_state_enable & (emulator.link_state == trigger_state)))),
+            recording.eq(capturing & (ring | triggered)),
+        ]
+
+        # Records --------------------------------------------------------------------------------
+        self.cdc = cdc = stream.ClockDomainCrossing(trace_layout, cd_from=cd, cd_to="sys")
+
+        last        = Signal(23) # Last recorded probe values
+        force       = Signal()   # Next STATE record is due even without a change
+        cmd_pending = Signal()
+        cmd_latch   = Signal(48)
+        gap         = Signal(PAYLOAD_BITS) # Cycles since the previous record
+        long_gap    = Signal()
+        changed     = Signal()
+        kind        = Signal(2)
+        payload     = Signal(PAYLOAD_BITS)
+        emit        = Signal()
+        self.comb += [
+            changed.eq(force | (probe != last)),
+            long_gap.eq(gap >= 2**DELTA_BITS),
+            If(long_gap,
+                kind.eq(RECORD_TIME),
+                payload.eq(gap)
+            ).Elif(cmd_pending,
+                kind.eq(RECORD_CMD),
+                payload.eq(cmd_latch)
+            ).Else(
+                kind.eq(RECORD_STATE),
+                payload.eq(probe)
+            ),
+            cdc.sink.valid.eq(recording & (cmd_pending | changed)),
+            cdc.sink.data.eq(Cat(payload, Mux(long_gap, 0, gap[:DELTA_BITS]), kind)),
+            emit.eq(cdc.sink.valid & cdc.sink.ready),
+        ]
+        sync += [
+            If(emit,
+                gap.eq(1),
+                count.eq(count + 1),
+                If(~long_gap,
+                    If(cmd_pending,
+                        cmd_pending.eq(0)
+                    ).Else(
+                        last.eq(probe),
+                        force.eq(0)
+                    )
+                )
+            ).Elif(gap != (2**PAYLOAD_BITS - 1),
+                gap.eq(gap + 1)
+            ),
+            If(cdc.sink.valid & ~cdc.sink.ready,
+                overflow.eq(1)
+            ),
+            If(cmd_event & (recording | trigger),
+                If(cmd_pending & ~(emit & ~long_gap),
+                    overflow.eq(1)
+                ),
+                cmd_latch.eq(cmd_in),
+                cmd_pending.eq(1)
+            ),
+            If(trigger,
+                triggered.eq(1),
+                trigger_index.eq(count),
+                If(~ring,
+                    # The stream starts with a full snapshot at the trigger.
+                    gap.eq(0),
+                    force.eq(1)
+                )
+            ),
+            If(stop | (triggered & (post != 0) & ((count - trigger_index)[:32] >= post)),
+                capturing.eq(0)
+            ),
+            If(arm,
+                capturing.eq(1),
+                triggered.eq(0),
+                overflow.eq(0),
+                count.eq(0),
+                gap.eq(0),
+                force.eq(1),
+                cmd_pending.eq(0)
+            )
+        ]
+
+        # Output FIFO (sys) ------------------------------------------------------------------------
+        # Absorbs bursts of records while the storage side is busy, cleared on arm.
+        self.fifo = fifo = ResetInserter()(stream.SyncFIFO(trace_layout, fifo_depth, buffered=True))
+        self.comb += [
+            fifo.reset.eq(self.arm),
+            cdc.source.connect(fifo.sink),
+            fifo.source.connect(self.source),
+        ]
+
+        if with_csr:
+            self.add_csr()
+
+    def add_csr(self):
+        self.control = CSRStorage(fields=[
+            CSRField("arm",  size=1, offset=0, pulse=True, description="Start a capture."),
+            CSRField("stop", size=1, offset=1, pulse=True, description="Stop the capture."),
+            CSRField("ring", size=1, offset=8, description="Record from arm on and wrap the buffer (pre-trigger history), else record from the trigger on and wait for rd_index."),
+        ])
+        self.trigger = CSRStorage(fields=[
+            CSRField("cmd_enable",   size=1, offset=0,  description="Trigger on command cmd."),
+            CSRField("state_enable", size=1, offset=1,  description="Trigger on link state link_state."),
+            CSRField("cmd",          size=6, offset=8,  description="Command index."),
+            CSRField("link_state",   size=7, offset=16, description="sd_link state."),
+        ], description="Trigger condition, immediate when no condition is enabled.")
+        self._post    = CSRStorage(32, name="post", description="Records captured after the trigger, 0: until stopped.")
+        self.rd_index = CSRStorage(32, description="Records read by the host (stream mode).")
+        self.status   = CSRStatus(fields=[
+            CSRField("capturing", size=1, offset=0, description="Capture running."),
+            CSRField("triggered", size=1, offset=1, description="Trigger seen."),
+            CSRField("overflow",  size=1, offset=2, description="Records were delayed, changes in between were coalesced."),
+        ])
+        self._trigger_index = CSRStatus(32, name="trigger_index", description="Index of the first record at or after the trigger.")
+        self.wr_index       = CSRStatus(32, description="Records stored.")
+
+        self.comb += [
+            self.arm.eq(self.control.fields.arm),
+            self.stop.eq(self.control.fields.stop),
+            self.ring.eq(self.control.fields.ring),
+            self.trigger_cmd_enable.eq(self.trigger.fields.cmd_enable),
+            self.trigger_cmd.eq(self.trigger.fields.cmd),
+            self.trigger_state_enable.eq(self.trigger.fields.state_enable),
+            self.trigger_state.eq(self.trigger.fields.link_state),
+            self.post.eq(self._post.storage),
+            self.consumed.eq(self.rd_index.storage),
+            self.status.fields.capturing.eq(self.capturing),
+            self.status.fields.triggered.eq(self.triggered),
+            self.status.fields.overflow.eq(self.overflow),
+            self._trigger_index.status.eq(self.trigger_index),
+            self.wr_index.status.eq(self.stored),
+        ]
+
+# SDEmulatorTraceDRAMWriter ------------------------------------------------------------------------
+
+class SDEmulatorTraceDRAMWriter(Module):
+    """Stores the records of an SDEmulatorTrace in a region of SDRAM through a 32-bit LiteDRAM
+       native port.
+
+       Record n lives at base + 8*(n modulo size//8), low word first. In ring mode the oldest
+       records are overwritten; otherwise writing stalls while the region holds size//8 records
+       the host has not consumed yet.
+       """
+    def __init__(self, trace, port, base, size):
+        assert port.data_width == 32
+        assert size >= 8 and (size & (size - 1)) == 0
+
+        self.writer = writer = LiteDRAMDMAWriter(port, fifo_depth=16)
+        self.submodules += writer
+
+        base_words = base//4
+        index_bits = log2_int(size//8)
+
+        index = Signal(32)
+        word  = Signal()
+        full  = Signal()
+        self.comb += [
+            full.eq(~trace.ring & ((index - trace.consumed)[:32] >= size//8)),
+            writer.sink.valid.eq(trace.source.valid & ~full),
+            writer.sink.address.eq(base_words + Cat(word, index[:index_bits])),
+            writer.sink.data.eq(Mux(word, trace.source.data[32:], trace.source.data[:32])),
+            trace.source.ready.eq(writer.sink.ready & word & ~full),
+            trace.stored.eq(index),
+        ]
+        self.sync += [
+            If(trace.arm,
+                index.eq(0),
+                word.eq(0)
+            ).Elif(writer.sink.valid & writer.sink.ready,
+                word.eq(~word),
+                If(word,
+                    index.eq(index + 1)
+                )
+            )
+        ]
@@ -0,0 +1,54 @@
+# SPDX-License-Identifier: BSD-2-Clause
+
+# CRC7/CRC16 models (litesdcardHDL/crc.py) against known vectors.
+
+import os
+import sys
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "litesdcardHDL"))
+
+from crc import (crc7, crc16, data_crc16, cmd_frames, cmd_frame_crc_good,
+    corrupt_cmd_frames, corrupt_blocks)
+
+
+def test_cmd_frames_known_crc7():
+    # Last byte of the frame is {CRC7, end bit}.
+    assert int(cmd_frames(0,  0x0000_0000)) == 0x40_0000_0000_95 # CMD0
+    assert int(cmd_frames(8,  0x0000_01aa)) == 0x48_0000_01aa_87 # CMD8
+    assert int(cmd_frames(17, 0x0000_0000)) == 0x51_0000_0000_55 # CMD17
+
+def test_crc7_batched():
+    frames = np.array([[0x40, 0, 0, 0, 0], [0x48, 0, 0, 0x01, 0xaa]], dtype=np.uint8)
+    assert list(crc7(frames)) == [0x95 >> 1, 0x87 >> 1]
+
+def test_crc16_known_vectors():
+    assert int(crc16(np.frombuffer(b"123456789", dtype=np.uint8))) == 0x31c3 # CRC-16/XMODEM check
+    block = np.full(512, 0xff, dtype=np.uint8)
+    assert list(data_crc16(block, width=1)) == [0x7fa1]
+    # 4-bit: each line carries 128 bytes of ones.
+    assert list(data_crc16(block, width=4)) == [int(crc16(np.full(128, 0xff, dtype=np.uint8)))]*4
+
+def test_cmd_frame_crc_good():
+    frames = cmd_frames(np.arange(64), 0x1234_5678)
+    assert cmd_frame_crc_good(frames).all()
+
+def test_corrupt_cmd_frames_flips_distinct_bits():
+    rng    = np.random.default_rng(0)
+    frames = cmd_frames(np.arange(64).repeat(16), 0)
+    for nbits in [1, 2, 3]:
+        corrupted = corrupt_cmd_frames(frames, rng, nbits=nbits)
+        diff      = frames ^ corrupted
+        assert all(bin(int(d)).count("1") == nbits for d in diff)
+        # Start, direction and end bits are untouched.
+        assert not (diff & np.uint64(1 << 47 | 1 << 46 | 1)).any()
+    assert not cmd_frame_crc_good(corrupt_cmd_frames(frames, rng, nbits=1)).any()
+
+def test_corrupt_blocks_flips_distinct_bits():
+    rng       = np.random.default_rng(1)
+    blocks    = rng.integers(0, 256, size=(8, 4, 512), dtype=np.uint8)
+    corrupted = corrupt_blocks(blocks, rng, nbits=4)
+    flipped   = np.unpackbits(blocks ^ corrupted, axis=-1).sum(axis=-1)
+    assert (flipped == 4).all()
+    assert (data_crc16(corrupted) != data_crc16(blocks)).any(axis=-1).all()
@@ -0,0 +1,120 @@
+# SPDX-License-Identifier: BSD-2-Clause
+
+# SDEmulatorSim (litesdcardHDL/sim.py) on temporary disk images.
+
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "litesdcardHDL"))
+
+from migen.sim import passive
+
+from sim import DiskImage, SDEmulatorSim
+
+
+NBLOCKS = 64
+
+@pytest.fixture
+def image_file(tmp_path):
+    filename = tmp_path / "sd.img"
+    filename.write_bytes(os.urandom(512*NBLOCKS))
+    return str(filename)
+
+def _blocks(filename, start, count):
+    with open(filename, "rb") as f:
+        f.seek(512*start)
+        return f.read(512*count)
+
+
+def test_multi_block_read(image_file):
+    data = bytearray()
+    with DiskImage(image_file, writable=False) as image:
+        sim = SDEmulatorSim(image, num_blocks=4)
+        sim.run(sim.read_blocks(5, 8, data, transfer_cycles=16))
+    assert data == _blocks(image_file, 5, 8)
+
+def test_multi_block_write_round_trip(image_file):
+    written = os.urandom(512*6)
+    data    = bytearray()
+    with DiskImage(image_file) as image:
+        sim = SDEmulatorSim(image, num_blocks=4)
+        def run():
+            yield from sim.write_blocks(10, written)
+            yield from sim.flush()
+            yield from sim.read_blocks(10, 6, data)
+        sim.run(run())
+    assert _blocks(image_file, 10, 6) == written
+    assert data == written
+
+def test_erase_zeroes_range(image_file):
+    before = _blocks(image_file, 0, NBLOCKS)
+    with DiskImage(image_file) as image:
+        sim = SDEmulatorSim(image, num_blocks=4)
+        def run():
+            yield from sim.erase_blocks(20, 27)
+            yield from sim.flush()
+        sim.run(run())
+    after = _blocks(image_file, 0, NBLOCKS)
+    assert after[512*20:512*28] == bytes(512*8)
+    assert after[:512*20] == before[:512*20]
+    assert after[512*28:] == before[512*28:]
+
+def test_erase_after_sequence_error(image_file):
+    before = _blocks(image_file, 0, NBLOCKS)
+    with DiskImage(image_file) as image:
+        sim = SDEmulatorSim(image, num_blocks=4)
+        emulator = sim.emulator
+        def run():
+            # STAT_ERASE_SEQ_ERROR left set by an earlier out-of-sequence CMD38, which is ignored.
+            yield emulator.card_status.eq(1 << 28)
+            yield emulator.block_erase_start.eq(0)
+            yield emulator.block_erase_end.eq(3)
+            yield from sim.command(38, resp_type=8)
+            yield from sim.flush()
+            # A following valid sequence is still applied.
+            yield from sim.erase_blocks(8, 9)
+            yield from sim.flush()
+        sim.run(run())
+    after = _blocks(image_file, 0, NBLOCKS)
+    assert after[:512*8] == before[:512*8]
+    assert after[512*8:512*10] == bytes(512*2)
+    assert after[512*10:] == before[512*10:]
+
+def test_drain_coalescing(image_file):
+    written = os.urandom(512*8)
+    drains  = []
+    with DiskImage(image_file) as image:
+        sim = SDEmulatorSim(image, num_blocks=8)
+        emulator = sim.emulator
+        @passive
+        def monitor():
+            while True:
+                if (yield emulator.drain_req):
+                    drains.append(((yield emulator.drain_addr), (yield emulator.drain_count)))
+                    while (yield emulator.drain_req):
+                        yield
+                yield
+        def run():
+            yield from sim.write_blocks(30, written)
+            yield from sim.flush()
+        sim.run(monitor(), run())
+    assert _blocks(image_file, 30, 8) == written
+    # Consecutive blocks of the CMD25 are drained in runs, not one block at a time.
+    assert sum(count for addr, count in drains) == 8
+    assert len(drains) < 8
+    assert any(count > 1 for addr, count in drains)
+    for (addr, count), (next_addr, _) in zip(drains, drains[1:]):
+        assert next_addr == addr + count
+
+def test_read_only_image_refuses_writes(image_file):
+    before = _blocks(image_file, 0, NBLOCKS)
+    with DiskImage(image_file, writable=False) as image:
+        sim = SDEmulatorSim(image, num_blocks=4)
+        with pytest.raises(ValueError, match="read-only"):
+            sim.run(sim.write_blocks(0, bytes(512)))
+        sim = SDEmulatorSim(image, num_blocks=4)
+        with pytest.raises(ValueError, match="read-only"):
+            sim.run(sim.erase_blocks(0, 3))
+    assert _blocks(image_file, 0, NBLOCKS) == before